@@ -0,0 +1,759 @@
+import os
+import random
+import sys
+import tracemalloc
+from dataclasses import asdict
+from time import perf_counter
+
+from csa import ConnectionScan
+from graph import (
+    Connection,
+    ExpandedGraph,
+    TimetableUpdate,
+    format_minutes,
+    from_minutes,
+    to_minutes,
+    to_row_entry,
+)
+from pathfinder import PathQuery, Pathfinder, SearchStats
+from raptor import Raptor
+from tabu import Solution, Tabu
+from transfer_patterns import TransferPatterns
+from transfers import TransferModel
+from tabu_main import (
+    build_distance_matrix,
+    get_cost_function,
+    load_cost_function,
+    two_swap_neighbourhood,
+)
+
+
+def stop_names(pathfinder: Pathfinder) -> list[str]:
+    return sorted({n.bus_stop_name for n in pathfinder._graph.get_nodes()})
+
+
+def sample_queries(pathfinder: Pathfinder, n: int, seed: int = 0):
+    rng = random.Random(seed)
+    stops = stop_names(pathfinder)
+    queries = []
+    for _ in range(n):
+        a, b = rng.sample(stops, 2)
+        queries.append((a, b, f"{rng.randint(6, 20)}:{rng.randint(0, 59):02d}"))
+    return queries
+
+
+def bench_find_path(csv_filename: str, n: int = 30):
+    pathfinder = Pathfinder.from_csv(csv_filename)
+    queries = sample_queries(pathfinder, n)
+
+    timings = []
+    for start, end, time in queries:
+        t = perf_counter()
+        pathfinder.find_path(start, end, time, km_cost=0)
+        timings.append((perf_counter() - t) * 1000)
+
+    timings.sort()
+    print(f"find_path: {len(timings)} queries")
+    print(f"  mean {sum(timings) / len(timings):.2f}ms")
+    print(f"  p50  {timings[len(timings) // 2]:.2f}ms")
+    print(f"  max  {timings[-1]:.2f}ms")
+
+
+def busiest_edges(pathfinder: Pathfinder, n: int):
+    graph = pathfinder._graph
+    edges = []
+    for node in graph.get_nodes():
+        for e in range(graph._edge_offsets[node.id], graph._edge_offsets[node.id + 1]):
+            first, last = graph._trip_offsets[e], graph._trip_offsets[e + 1]
+            edges.append(
+                (
+                    node,
+                    graph._nodes[graph._edge_targets[e]],
+                    graph._departures[first:last],
+                    graph._arrivals[first:last],
+                )
+            )
+    edges.sort(key=lambda e: len(e[2]), reverse=True)
+    return edges[:n]
+
+
+def bench_trip_lookup(csv_filename: str, n: int = 20000):
+    pathfinder = Pathfinder.from_csv(csv_filename)
+    graph = pathfinder._graph
+    edges = busiest_edges(pathfinder, 100)
+    # The lookup used before the trip arrays: Connections sorted by arrival,
+    # the first one that can still be caught wins.
+    by_arrival = [
+        sorted(
+            (
+                Connection(from_minutes(d), from_minutes(a), "")
+                for d, a in zip(departures, arrivals)
+            ),
+            key=lambda c: c.arrives_at,
+        )
+        for _, _, departures, arrivals in edges
+    ]
+
+    def scan(connections, departure_time):
+        for c in connections:
+            if c.departs_at >= departure_time:
+                return c
+        return None
+
+    rng = random.Random(0)
+    lookups = [(rng.randrange(len(edges)), rng.randint(300, 1440)) for _ in range(n)]
+    datetimes = [(i, from_minutes(time)) for i, time in lookups]
+
+    t = perf_counter()
+    scanned = [scan(by_arrival[i], time) for i, time in datetimes]
+    scan_time = perf_counter() - t
+
+    t = perf_counter()
+    found = [graph.get_best_trip(edges[i][0], edges[i][1], time) for i, time in lookups]
+    bisect_time = perf_counter() - t
+
+    mismatches = sum(
+        1
+        for a, b in zip(scanned, found)
+        if (a and a.arrives_at) != (b and from_minutes(b[1]))
+    )
+    print(f"trip lookup: {n} lookups on the {len(edges)} busiest edges")
+    print(f"  avg trips per edge {sum(len(e[2]) for e in edges) / len(edges):.0f}")
+    print(f"  scan   {scan_time / n * 1e6:.2f}us per lookup")
+    print(f"  bisect {bisect_time / n * 1e6:.2f}us per lookup")
+    print(f"  arrival mismatches {mismatches}")
+
+
+def bench_memory(csv_filename: str):
+    rows = open(csv_filename).read().splitlines()[1:]
+    row_entries = [to_row_entry(r) for r in rows]
+
+    tracemalloc.start()
+    t = perf_counter()
+    graph = ExpandedGraph(row_entries)
+    build_time = perf_counter() - t
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"graph memory: {len(row_entries)} rows, {len(graph._nodes)} nodes")
+    print(f"  build    {build_time:.2f}s (traced)")
+    print(f"  retained {size / 2**20:.1f}MB")
+    print(f"  peak     {peak / 2**20:.1f}MB")
+
+
+def load_from_row_entries(csv_filename: str):
+    rows = open(csv_filename).read().splitlines()[1:]
+    row_entries = [to_row_entry(r) for r in rows]
+    return ExpandedGraph(row_entries)
+
+
+def bench_load(csv_filename: str):
+    print(f"load: {csv_filename}")
+    for name, load in [
+        ("row entries", load_from_row_entries),
+        ("streaming", ExpandedGraph.from_csv),
+    ]:
+        t = perf_counter()
+        load(csv_filename)
+        load_time = perf_counter() - t
+
+        tracemalloc.start()
+        load(csv_filename)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"  {name:12} {load_time:.2f}s, peak {peak / 2**20:.1f}MB")
+
+
+def bench_snapshot(csv_filename: str):
+    snapshot = csv_filename + ".snapshot"
+    ExpandedGraph.from_csv(csv_filename).save(snapshot)
+
+    print(f"snapshot: {csv_filename}")
+    for name, load in [
+        ("csv", lambda: ExpandedGraph.from_csv(csv_filename)),
+        ("snapshot", lambda: ExpandedGraph.load(snapshot, mmap=False)),
+        ("snapshot mmap", lambda: ExpandedGraph.load(snapshot)),
+        (
+            "mmap + check",
+            lambda: ExpandedGraph.load(snapshot, source=csv_filename),
+        ),
+    ]:
+        t = perf_counter()
+        load()
+        print(f"  {name:14} {(perf_counter() - t) * 1000:.1f}ms")
+
+
+def sample_tour(pathfinder: Pathfinder, n: int, seed: int = 0) -> list[str]:
+    stops = random.Random(seed).sample(stop_names(pathfinder), n)
+    return stops + [stops[0]]
+
+
+def run_tabu(pathfinder: Pathfinder, tour: list[str], iterations: int, **kwargs):
+    random.seed(0)
+    tabu = Tabu(
+        initial_solution=Solution(tour),
+        calculate_cost=get_cost_function(pathfinder, "8:00", 0, 1, 0),
+        generate_neighborhood=two_swap_neighbourhood,
+        **kwargs,
+    )
+    t = perf_counter()
+    _, cost, _ = tabu.run(iterations)
+    return perf_counter() - t, cost
+
+
+def bench_tabu_cache(csv_filename: str, iterations: int = 10):
+    graph = ExpandedGraph.from_csv(csv_filename)
+    tour = sample_tour(Pathfinder(graph=graph), 5)
+    print(f"tabu: {iterations} iterations, tour {'->'.join(tour)}")
+    for cache_size in (0, 4096):
+        pathfinder = Pathfinder(graph=graph, cache_size=cache_size)
+        elapsed, cost = run_tabu(pathfinder, tour, iterations)
+        info = pathfinder.cache_info()
+        print(
+            f"  cache_size={cache_size:<5} {elapsed:.2f}s, cost {cost}, "
+            f"hits {info.hits}, misses {info.misses}"
+        )
+
+
+def bench_tabu_incremental(csv_filename: str, iterations: int = 10):
+    # Swap neighbours share the legs before their first swapped stop with the
+    # current solution, so find_path only runs from there on.
+    graph = ExpandedGraph.from_csv(csv_filename)
+    tour = sample_tour(Pathfinder(graph=graph), 7)
+    print(f"tabu: {iterations} iterations, {len(tour) - 1} stops")
+    for name, max_prefixes in (("full tours", 0), ("incremental", 4096)):
+        pathfinder = Pathfinder(graph=graph, cache_size=0)
+        calculate_cost = get_cost_function(pathfinder, "8:00", 0, 1, 0, max_prefixes)
+        random.seed(0)
+        tabu = Tabu(Solution(tour), calculate_cost, two_swap_neighbourhood)
+        t = perf_counter()
+        _, cost, _ = tabu.run(iterations)
+        elapsed = perf_counter() - t
+        print(
+            f"  {name:12} {elapsed:.2f}s, cost {cost}, "
+            f"{calculate_cost.find_path_calls / iterations:.1f} find_path calls "
+            f"and {calculate_cost.reused_legs / iterations:.1f} reused legs "
+            "per iteration"
+        )
+
+
+def bench_tabu_workers(csv_filename: str, iterations: int = 10, workers: int = 4):
+    snapshot = csv_filename + ".snapshot"
+    graph = ExpandedGraph.from_csv(csv_filename)
+    graph.save(snapshot)
+    tour = sample_tour(Pathfinder(graph=graph), 7)
+
+    print(f"tabu: {iterations} iterations, {len(tour) - 1} stops")
+    for name, kwargs in [
+        ("serial", {}),
+        (f"{workers} threads", {"workers": workers}),
+        (
+            f"{workers} processes",
+            {
+                "workers": workers,
+                "cost_factory": load_cost_function,
+                "cost_factory_args": (csv_filename, snapshot, "8:00", 0, 1, 0),
+            },
+        ),
+    ]:
+        elapsed, cost = run_tabu(Pathfinder(graph=graph), tour, iterations, **kwargs)
+        print(f"  {name:12} {iterations / elapsed:.2f} it/s, cost {cost}")
+
+
+def bench_tabu_memory(csv_filename: str, iterations: int = 300):
+    # A cheap planar tour length stands in for find_path here, so the time
+    # left is mostly the tabu bookkeeping itself.
+    rng = random.Random(0)
+    coords = {str(i): (rng.random(), rng.random()) for i in range(31)}
+
+    def tour_length(sol: Solution):
+        stops = [coords[s] for s in sol.bus_stops]
+        length = sum(
+            ((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) ** 0.5
+            for a, b in zip(stops, stops[1:])
+        )
+        return length, []
+
+    def all_swaps(sol: Solution):
+        neighbours = []
+        for i in range(1, len(sol.bus_stops) - 1):
+            for j in range(i + 1, len(sol.bus_stops) - 1):
+                route = list(sol.bus_stops)
+                route[i], route[j] = route[j], route[i]
+                neighbours.append(Solution(route))
+        return neighbours
+
+    print(f"tabu memory: {iterations} iterations, full 2-swap neighbourhood")
+    for n in (10, 20, 30):
+        tour = [str(i) for i in range(n)] + ["0"]
+        tabu = Tabu(Solution(tour), tour_length, all_swaps)
+        t = perf_counter()
+        _, cost, _ = tabu.run(iterations)
+        elapsed = perf_counter() - t
+        print(f"  {n:2} stops {elapsed:.2f}s, {iterations / elapsed:.0f} it/s, cost {cost:.3f}")
+
+
+def bench_distance_matrix(csv_filename: str, n: int = 10):
+    pathfinder = Pathfinder.from_csv(csv_filename, cache_size=0)
+    stops = sample_tour(pathfinder, n)[:-1]
+
+    t = perf_counter()
+    pairwise = {}
+    for a in stops:
+        for b in stops:
+            if a != b:
+                result = pathfinder.find_path(a, b, "8:00", 1, 5, 0)
+                pairwise[(a, b)] = result[1] if result else float("inf")
+    pairwise_time = perf_counter() - t
+
+    t = perf_counter()
+    matrix = build_distance_matrix(pathfinder, stops, "8:00", 1, 5)
+    matrix_time = perf_counter() - t
+
+    print(f"distance matrix: {n} stops")
+    print(f"  find_path per pair    {pairwise_time:.2f}s ({n * (n - 1)} searches)")
+    print(f"  find_paths_from       {matrix_time:.2f}s ({n} searches)")
+    print(f"  same costs            {matrix == pairwise}")
+
+
+def percentiles(timings: list[float]) -> str:
+    timings = sorted(timings)
+    p50 = timings[len(timings) // 2]
+    p95 = timings[min(len(timings) - 1, len(timings) * 95 // 100)]
+    return f"mean {sum(timings) / len(timings):.2f}ms, p50 {p50:.2f}ms, p95 {p95:.2f}ms"
+
+
+def bench_csa(csv_filename: str, n: int = 50):
+    pathfinder = Pathfinder.from_csv(csv_filename, cache_size=0)
+    t = perf_counter()
+    scan = ConnectionScan.from_graph(pathfinder.graph)
+    build_time = perf_counter() - t
+    queries = sample_queries(pathfinder, n)
+
+    astar, csa, mismatches = [], [], 0
+    for start, end, time in queries:
+        t = perf_counter()
+        expected = pathfinder.find_path(start, end, time, 1, 0, 0)
+        astar.append((perf_counter() - t) * 1000)
+        t = perf_counter()
+        result = scan.find_path(start, end, time)
+        csa.append((perf_counter() - t) * 1000)
+        if (expected and expected[1]) != (result and result[1]):
+            mismatches += 1
+
+    print(f"csa: {n} earliest arrival queries, built in {build_time:.2f}s")
+    print(f"  find_path  {percentiles(astar)}")
+    print(f"  csa        {percentiles(csa)}")
+    print(f"  cost mismatches {mismatches}")
+
+
+def bench_raptor(csv_filename: str, n: int = 30):
+    pathfinder = Pathfinder.from_csv(csv_filename, cache_size=0)
+    raptor = Raptor.from_graph(pathfinder.graph)
+    queries = sample_queries(pathfinder, n)
+    weights = [(1, 0), (1, 5), (1, 15), (0, 1)]
+
+    weighted, rounds, options = [], [], 0
+    for start, end, time in queries:
+        t = perf_counter()
+        for minute_cost, transfer_cost in weights:
+            pathfinder.find_path(start, end, time, minute_cost, transfer_cost, 0)
+        weighted.append((perf_counter() - t) * 1000)
+        t = perf_counter()
+        options += len(raptor.find_journeys(start, end, time))
+        rounds.append((perf_counter() - t) * 1000)
+
+    print(f"raptor: {n} queries, {options / n:.1f} Pareto options per query")
+    print(f"  {len(weights)} weighted find_path  {percentiles(weighted)}")
+    print(f"  raptor               {percentiles(rounds)}")
+
+
+def bench_profile(csv_filename: str, n: int = 5, window: int = 120):
+    pathfinder = Pathfinder.from_csv(csv_filename, cache_size=0)
+    queries = sample_queries(pathfinder, n)
+    # The first call builds the connection arrays, keep that out of the timings.
+    t = perf_counter()
+    pathfinder.find_profile(queries[0][0], queries[0][1], "0:00", "0:00")
+    build_time = perf_counter() - t
+
+    loop, profile, journeys, missing = [], [], 0, 0
+    for start, end, time in queries:
+        first = to_minutes(time)
+        t = perf_counter()
+        arrivals = set()
+        for minute in range(first, first + window + 1):
+            result = pathfinder.find_path(start, end, format_minutes(minute), 1, 0, 0)
+            if result is not None:
+                arrivals.add(minute + result[1])
+        loop.append((perf_counter() - t) * 1000)
+        t = perf_counter()
+        result = pathfinder.find_profile(
+            start, end, time, format_minutes(first + window)
+        )
+        profile.append((perf_counter() - t) * 1000)
+        journeys += len(result)
+        missing += sum(to_minutes(s[-1].arrival) not in arrivals for s, _ in result)
+
+    print(f"profile: {n} queries over {window} minutes, built in {build_time:.2f}s")
+    print(f"  {journeys / n:.1f} journeys per profile")
+    print(f"  per minute find_path  {percentiles(loop)}")
+    print(f"  find_profile          {percentiles(profile)}")
+    print(f"  profile arrivals missing from the loop {missing}")
+
+
+class CountingPathfinder(Pathfinder):
+    expanded = 0
+    relaxed = 0
+    settled = 0
+
+    def _discover_node(self, ctx, node):
+        self.expanded += 1
+        super()._discover_node(ctx, node)
+
+    def _relax(self, ctx, node, *args):
+        self.relaxed += 1
+        super()._relax(ctx, node, *args)
+
+    def _settle_backward(self, ctx, back):
+        node = super()._settle_backward(ctx, back)
+        if node is not None:
+            self.settled += 1
+        return node
+
+
+def bench_heuristics(csv_filename: str, n: int = 30):
+    pathfinder = CountingPathfinder(
+        graph=Pathfinder.from_csv(csv_filename).graph, cache_size=0
+    )
+    t = perf_counter()
+    pathfinder.precompute_bounds()
+    print(f"heuristics: {n} queries, bounds built in {perf_counter() - t:.2f}s")
+    queries = sample_queries(pathfinder, n)
+    # main.py settings for the time optimization, km_cost 100000 is its A*.
+    modes = {
+        "dijkstra": dict(km_cost=0),
+        "distance": dict(km_cost=100000),
+        "geodesic": dict(km_cost=0, heuristic="geodesic"),
+        "landmarks": dict(km_cost=0, heuristic="landmarks"),
+    }
+
+    optimal = [pathfinder.find_path(*q, 1, 0, km_cost=0) for q in queries]
+    for name, kwargs in modes.items():
+        timings, worse = [], 0
+        pathfinder.expanded = 0
+        for query, best in zip(queries, optimal):
+            t = perf_counter()
+            result = pathfinder.find_path(*query, 1, 0, **kwargs)
+            timings.append((perf_counter() - t) * 1000)
+            if result and best and result[1] > best[1]:
+                worse += 1
+        print(
+            f"  {name:10} {pathfinder.expanded / n:6.0f} expanded, "
+            f"{worse:2} worse than optimal, {percentiles(timings)}"
+        )
+
+
+def bench_transfer_patterns(
+    csv_filename: str, n: int = 100, workers: int = 4, step: int = 5
+):
+    snapshot = csv_filename + ".snapshot"
+    graph = ExpandedGraph.from_csv(csv_filename)
+    graph.save(snapshot)
+    pathfinder = Pathfinder(graph=graph, cache_size=0)
+    # Commuter traffic: a few busy origins, departures between 7:00 and 9:00.
+    rng = random.Random(0)
+    stops = stop_names(pathfinder)
+    origins = rng.sample(stops, 10)
+    pairs = [(rng.choice(origins), b) for b in rng.sample(stops, n)]
+    pairs = [(a, b) for a, b in pairs if a != b]
+    times = [format_minutes(m) for m in range(7 * 60, 9 * 60 + 1, step)]
+
+    print(f"transfer patterns: {len(pairs)} pairs, {len(times)} departure times")
+    for name, kwargs in [("serial", {}), (f"{workers} processes", {"workers": workers})]:
+        t = perf_counter()
+        patterns = TransferPatterns.build(
+            Pathfinder.from_csv, (csv_filename, snapshot), pairs, times, **kwargs
+        )
+        print(f"  build {name:12} {perf_counter() - t:.2f}s")
+    patterns.save(csv_filename + ".patterns")
+    size = os.path.getsize(csv_filename + ".patterns")
+    t = perf_counter()
+    pathfinder.use_transfer_patterns(TransferPatterns.load(csv_filename + ".patterns"))
+    print(f"  file {size / 1024:.1f}KB, loaded in {(perf_counter() - t) * 1000:.1f}ms")
+
+    search, by_patterns, better, worse = [], [], 0, 0
+    for a, b in pairs:
+        time = format_minutes(rng.randint(7 * 60, 9 * 60))
+        t = perf_counter()
+        expected = pathfinder.find_path(a, b, time, 1, 5, 0)
+        search.append((perf_counter() - t) * 1000)
+        t = perf_counter()
+        result = pathfinder.find_path_by_patterns(a, b, time, 1, 5)
+        by_patterns.append((perf_counter() - t) * 1000)
+        if expected and result:
+            better += result[1] < expected[1]
+            worse += result[1] > expected[1]
+    print(f"  find_path      {percentiles(search)}")
+    print(f"  by patterns    {percentiles(by_patterns)}")
+    print(f"  cheaper than find_path {better}, more expensive {worse}")
+
+
+def bench_contraction(csv_filename: str, n: int = 30):
+    graph = ExpandedGraph.from_csv(csv_filename)
+    t = perf_counter()
+    contracted = ExpandedGraph.from_csv(csv_filename, contract=True)
+    print(f"contraction: {csv_filename}, built in {perf_counter() - t:.2f}s")
+    # Skipped nodes keep their own edges for searches starting there, they
+    # are just never reached from anywhere else.
+    searched = [
+        n for n in contracted.get_nodes() if n.id not in contracted._bypassing_shortcuts
+    ]
+    offsets = contracted._search_offsets
+    edges = sum(offsets[n.id + 1] - offsets[n.id] for n in searched)
+    print(f"  line nodes  {len(graph.get_nodes())} -> {len(searched)} searched")
+    print(f"  edges       {len(graph._edge_targets)} -> {edges} searched")
+    print(f"  shortcuts   {len(contracted._shortcut_targets)}")
+
+    full = CountingPathfinder(graph=graph, cache_size=0)
+    short = CountingPathfinder(graph=contracted, cache_size=0)
+    queries = sample_queries(full, n)
+    for minute_cost, transfer_cost in [(1, 0), (1, 5)]:
+        timings = {full: [], short: []}
+        full.expanded = short.expanded = 0
+        mismatches = 0
+        for query in queries:
+            costs = []
+            for pathfinder in (full, short):
+                t = perf_counter()
+                result = pathfinder.find_path(*query, minute_cost, transfer_cost, 0)
+                timings[pathfinder].append((perf_counter() - t) * 1000)
+                costs.append(result and result[1])
+            mismatches += costs[0] != costs[1]
+        print(f"  minute_cost={minute_cost}, transfer_cost={transfer_cost}:")
+        for name, pathfinder in [("full", full), ("contracted", short)]:
+            print(
+                f"    {name:10} {pathfinder.expanded / n:6.0f} expanded, "
+                f"{percentiles(timings[pathfinder])}"
+            )
+        print(f"    cost mismatches {mismatches}")
+
+
+def bench_transfers(csv_filename: str, n: int = 30):
+    graph = ExpandedGraph.from_csv(csv_filename)
+    stops = len({node.bus_stop_name for node in graph.get_nodes()})
+    print(f"transfers: {n} queries, {len(graph.get_nodes())} line nodes, {stops} stops")
+    models = {
+        "same stop": None,
+        "hubs": TransferModel(radius=0),
+        "hubs, 500m walks": TransferModel(radius=500, change_minutes=1),
+    }
+    queries = None
+    for name, model in models.items():
+        t = perf_counter()
+        pathfinder = CountingPathfinder(graph=graph, cache_size=0, transfers=model)
+        build_time = (perf_counter() - t) * 1000
+        if queries is None:
+            queries = sample_queries(pathfinder, n)
+        walks = pathfinder._hubs.walk_count() if pathfinder._hubs else 0
+        timings, costs = [], []
+        for query in queries:
+            t = perf_counter()
+            result = pathfinder.find_path(*query, 1, 5, 0)
+            timings.append((perf_counter() - t) * 1000)
+            if result:
+                costs.append(result[1])
+        print(
+            f"  {name:17} {walks:5} walks, built in {build_time:.0f}ms, "
+            f"{pathfinder.expanded / n:.0f} expanded, "
+            f"{pathfinder.relaxed / n:.0f} relaxed, {len(costs)} found, "
+            f"mean cost {sum(costs) / len(costs):.1f}"
+        )
+        print(f"  {'':17} {percentiles(timings)}")
+
+
+def bench_bidirectional(csv_filename: str, n: int = 100, sampled: int = 1000):
+    pathfinder = CountingPathfinder(
+        graph=Pathfinder.from_csv(csv_filename).graph, cache_size=0
+    )
+    pathfinder.precompute_bounds(landmarks=0)
+    geodesic = pathfinder._geodesic_bound
+    queries = sample_queries(pathfinder, sampled)
+    queries.sort(key=lambda q: geodesic.distance(q[0], q[1]), reverse=True)
+    queries = queries[:n]
+    print(f"bidirectional: {n} longest of {sampled} sampled pairs")
+    modes = {
+        "dijkstra": dict(km_cost=0),
+        "geodesic": dict(km_cost=0, heuristic="geodesic"),
+        "bidirectional": dict(algorithm="bidirectional"),
+    }
+    for transfer_cost in (0, 5):
+        optimal = [pathfinder.find_path(*q, 1, transfer_cost, 0) for q in queries]
+        print(f"  transfer_cost={transfer_cost}:")
+        for name, kwargs in modes.items():
+            timings, cheaper, dearer = [], 0, 0
+            pathfinder.expanded = pathfinder.settled = 0
+            for query, best in zip(queries, optimal):
+                t = perf_counter()
+                result = pathfinder.find_path(*query, 1, transfer_cost, **kwargs)
+                timings.append((perf_counter() - t) * 1000)
+                if result and best:
+                    cheaper += result[1] < best[1]
+                    dearer += result[1] > best[1]
+            print(
+                f"    {name:13} {pathfinder.expanded / n:5.0f} expanded, "
+                f"{pathfinder.settled / n:5.0f} settled backward, "
+                f"{cheaper:2} cheaper, {dearer:2} dearer than find_path"
+            )
+            print(f"    {'':13} {percentiles(timings)}")
+
+
+def bench_batch(csv_filename: str, n: int = 200):
+    pathfinder = Pathfinder.from_csv(csv_filename, cache_size=0)
+    queries = [PathQuery(*q, 1, 5, 0) for q in sample_queries(pathfinder, n)]
+    print(f"batch: {n} queries")
+
+    t = perf_counter()
+    expected = [pathfinder.find_path(**asdict(q)) for q in queries]
+    print(f"  find_path             {n / (perf_counter() - t):6.1f} queries/s")
+
+    t = perf_counter()
+    results = pathfinder.find_paths(queries)
+    print(f"  find_paths            {n / (perf_counter() - t):6.1f} queries/s")
+
+    t = perf_counter()
+    results = pathfinder.find_paths(queries)
+    for r in results:
+        if r is not None:
+            r.bus_stops()
+    print(f"  find_paths, formatted {n / (perf_counter() - t):5.1f} queries/s")
+
+    mismatches = sum(
+        (r and r.cost) != (e and e[1]) for r, e in zip(results, expected)
+    )
+    print(f"  cost mismatches {mismatches}")
+
+
+def bench_stats(csv_filename: str, n: int = 100):
+    pathfinder = Pathfinder.from_csv(csv_filename, cache_size=0)
+    queries = sample_queries(pathfinder, n)
+    print(f"stats: {n} queries")
+
+    collected: list[SearchStats] = []
+    for name, hook in [
+        ("no hook", None),
+        ("hook", lambda query, stats: collected.append(stats)),
+        ("no hook", None),
+    ]:
+        pathfinder.set_stats_hook(hook)
+        t = perf_counter()
+        for query in queries:
+            pathfinder.find_path(*query, 1, 5, 0)
+        print(f"  {name:8} {(perf_counter() - t) * 1000 / n:.2f}ms per query")
+
+    for field in ("expanded", "relaxed", "transfers", "pushes", "pops", "lookups"):
+        print(f"  {field:10} {sum(getattr(s, field) for s in collected) / n:8.0f}")
+    for field in ("setup_time", "search_time", "reconstruction_time"):
+        total = sum(getattr(s, field) for s in collected) * 1000 / n
+        print(f"  {field:20} {total:.3f}ms")
+
+
+def sample_updates(graph: ExpandedGraph, n: int, seed: int = 0):
+    # Mostly delays, some cancellations and extra trips, a few closures.
+    rng = random.Random(seed)
+    rows = rng.sample(list(graph.get_timetable_rows()), n)
+    updates = []
+    for r in rows:
+        kind = rng.choices(["delay", "cancel", "add", "close"], [70, 15, 14, 1])[0]
+        if kind == "close":
+            updates.append(TimetableUpdate("close", r.start))
+        elif kind == "add":
+            departure = r.departs_at + rng.randint(1, 10)
+            arrival = departure + r.arrives_at - r.departs_at
+            updates.append(
+                TimetableUpdate("add", r.start, r.bus_n, r.end, departure, arrival)
+            )
+        else:
+            minutes = rng.randint(1, 15)
+            updates.append(
+                TimetableUpdate(kind, r.start, r.bus_n, r.end, r.departs_at, 0, minutes)
+            )
+    # Two trips of a row can leave at the same minute, keep one update each.
+    unique = {(u.stop, u.line, u.next_stop, u.departure): u for u in updates}
+    return list(unique.values())
+
+
+def bench_updates(csv_filename: str, n: int = 1000, queries: int = 200):
+    pathfinder = Pathfinder.from_csv(csv_filename)
+    updates = sample_updates(pathfinder.graph, n)
+    sampled = sample_queries(pathfinder, queries)
+    print(f"updates: {len(updates)} updates, {queries} cached queries")
+
+    for batch in (updates[:10], updates[10:]):
+        for query in sampled:
+            pathfinder.find_path(*query, 1, 5, 0)
+        t = perf_counter()
+        changes = pathfinder.apply_updates(batch)
+        elapsed = (perf_counter() - t) * 1000
+        print(
+            f"  apply_updates {elapsed:8.1f}ms for {len(batch)}, "
+            f"{len(changes.edges)} edges changed, {len(changes.closed)} stops "
+            f"closed, {pathfinder.cache_info().currsize} cached results kept"
+        )
+    t = perf_counter()
+    ExpandedGraph.from_csv(csv_filename)
+    print(f"  full reload   {(perf_counter() - t) * 1000:8.1f}ms")
+
+    fresh = Pathfinder(
+        graph=ExpandedGraph.from_rows(pathfinder.graph.get_timetable_rows()),
+        cache_size=0,
+    )
+    for stop in pathfinder.graph.closed_stops():
+        for node in fresh.graph.get_nodes_by_stop_name(stop):
+            fresh.graph.remove_node(node)
+    mismatches = 0
+    timings = {"updated": [], "rebuilt": []}
+    for query in sampled:
+        t = perf_counter()
+        expected = fresh.find_path(*query, 1, 5, 0)
+        timings["rebuilt"].append((perf_counter() - t) * 1000)
+        pathfinder.clear_cache()
+        t = perf_counter()
+        result = pathfinder.find_path(*query, 1, 5, 0)
+        timings["updated"].append((perf_counter() - t) * 1000)
+        mismatches += (result and result[1]) != (expected and expected[1])
+    for name, values in timings.items():
+        print(f"  {name} graph queries: {percentiles(values)}")
+    print(f"  cost mismatches against the rebuilt graph {mismatches}")
+
+
+BENCHMARKS = {
+    "find_path": bench_find_path,
+    "trip_lookup": bench_trip_lookup,
+    "memory": bench_memory,
+    "load": bench_load,
+    "snapshot": bench_snapshot,
+    "tabu_cache": bench_tabu_cache,
+    "tabu_workers": bench_tabu_workers,
+    "tabu_incremental": bench_tabu_incremental,
+    "tabu_memory": bench_tabu_memory,
+    "distance_matrix": bench_distance_matrix,
+    "csa": bench_csa,
+    "raptor": bench_raptor,
+    "profile": bench_profile,
+    "heuristics": bench_heuristics,
+    "transfer_patterns": bench_transfer_patterns,
+    "contraction": bench_contraction,
+    "transfers": bench_transfers,
+    "bidirectional": bench_bidirectional,
+    "batch": bench_batch,
+    "stats": bench_stats,
+    "updates": bench_updates,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"Usage: {sys.argv[0]} [{'|'.join(BENCHMARKS)}] [csv_file]")
+        sys.exit(1)
+    csv_filename = sys.argv[2] if len(sys.argv) > 2 else "connection_graph.csv"
+    BENCHMARKS[sys.argv[1]](csv_filename)
@@ -0,0 +1,117 @@
+import json
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+from benchmark import percentiles, run_tabu, sample_queries, sample_tour
+from graph import ExpandedGraph, read_timetable
+from pathfinder import PathQuery, Pathfinder
+from synthetic import CityParameters, write_csv
+
+BASELINE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json"
+)
+SIZES = {
+    "small": CityParameters(stops=200, lines=12, trips_per_line=40),
+    "medium": CityParameters(stops=1000, lines=40, trips_per_line=60),
+    "large": CityParameters(stops=4000, lines=100, trips_per_line=60),
+}
+# Metrics where a larger value is better, the rest are timings.
+THROUGHPUTS = ("batch_qps", "tabu_iterations_per_s")
+# Slowdown tolerated before a metric is reported as a regression.
+TOLERANCE = 1.5
+
+
+def measure(csv_filename: str, queries: int = 50, tabu_iterations: int = 5) -> dict:
+    results = {}
+    t = perf_counter()
+    rows = list(read_timetable(csv_filename))
+    results["csv_load_s"] = perf_counter() - t
+    results["rows"] = len(rows)
+
+    t = perf_counter()
+    graph = ExpandedGraph.from_rows(rows)
+    results["graph_build_s"] = perf_counter() - t
+    results["nodes"] = len(graph.get_nodes())
+
+    pathfinder = Pathfinder(graph=graph, cache_size=0)
+    sampled = sample_queries(pathfinder, queries)
+    timings = []
+    for query in sampled:
+        t = perf_counter()
+        pathfinder.find_path(*query, 1, 5, 0)
+        timings.append((perf_counter() - t) * 1000)
+    timings.sort()
+    results["query_p50_ms"] = timings[len(timings) // 2]
+    results["query_p95_ms"] = timings[int(len(timings) * 0.95)]
+
+    # The best of a few runs, one batch on a small city takes milliseconds.
+    batch = [PathQuery(*q, 1, 5, 0) for q in sampled]
+    results["batch_qps"] = 0
+    for _ in range(3):
+        t = perf_counter()
+        pathfinder.find_paths(batch)
+        qps = len(batch) / (perf_counter() - t)
+        results["batch_qps"] = max(results["batch_qps"], qps)
+
+    elapsed, _ = run_tabu(pathfinder, sample_tour(pathfinder, 5), tabu_iterations)
+    results["tabu_iterations_per_s"] = tabu_iterations / elapsed
+    print(f"    query latency {percentiles(timings)}")
+    return results
+
+
+def compare(name: str, results: dict, baseline: dict) -> list[str]:
+    regressions = []
+    for metric, value in results.items():
+        if metric in ("rows", "nodes"):
+            print(f"    {metric:22} {value}")
+            continue
+        line = f"    {metric:22} {value:10.3f}"
+        old = baseline.get(metric)
+        if old:
+            ratio = old / value if metric in THROUGHPUTS else value / old
+            line += f"  baseline {old:10.3f}  x{ratio:.2f}"
+            if ratio > TOLERANCE:
+                line += "  REGRESSION"
+                regressions.append(f"{name}.{metric}")
+        print(line)
+    return regressions
+
+
+def run(sizes: list[str], update: bool) -> int:
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+
+    measured = {}
+    regressions = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in sizes:
+            csv_filename = os.path.join(directory, f"{name}.csv")
+            write_csv(csv_filename, SIZES[name])
+            print(f"{name}: {SIZES[name]}")
+            measured[name] = measure(csv_filename)
+            regressions += compare(name, measured[name], baseline.get(name, {}))
+
+    if update:
+        for name, results in measured.items():
+            baseline[name] = {k: round(v, 4) for k, v in results.items()}
+        with open(BASELINE, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {BASELINE}")
+    elif regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if a != "--update"]
+    unknown = [a for a in args if a not in SIZES]
+    if unknown:
+        print(f"Usage: {sys.argv[0]} [{'|'.join(SIZES)}]... [--update]")
+        sys.exit(1)
+    sys.exit(run(args or list(SIZES), "--update" in sys.argv))
@@ -0,0 +1,148 @@
+from array import array
+from typing import Iterable, Tuple
+import heapq
+import math
+
+from graph import ExpandedGraph, TimetableRow
+
+EARTH_RADIUS = 6371000
+UNREACHED = 2**32 - 1
+
+
+def to_metres(
+    latitude: float, longitude: float, reference_latitude: float
+) -> Tuple[float, float]:
+    # Equirectangular projection, close enough over the area of one city.
+    x = math.radians(longitude) * math.cos(math.radians(reference_latitude))
+    y = math.radians(latitude)
+    return x * EARTH_RADIUS, y * EARTH_RADIUS
+
+
+class GeodesicBound:
+    # Straight line distance over the fastest hop seen anywhere in the
+    # timetable. No ride can beat that speed, so the result never exceeds the
+    # minutes actually needed. Hops are timed in whole minutes, so a zero
+    # minute hop that covers any distance makes the speed unbounded and the
+    # bound falls back to 0.
+    _coords: dict[str, Tuple[float, float]]
+    max_speed: float
+
+    def __init__(self, graph: ExpandedGraph):
+        # Removed nodes too, their rows are still in the timetable.
+        nodes = [graph.get_node_by_id(i) for i in range(graph.node_count())]
+        reference = sum(n.latitude for n in nodes) / len(nodes) if nodes else 0
+        self._coords = {}
+        for n in nodes:
+            if n.bus_stop_name not in self._coords:
+                self._coords[n.bus_stop_name] = to_metres(
+                    n.latitude, n.longitude, reference
+                )
+
+        self.max_speed = 0
+        for r in graph.get_timetable_rows():
+            distance = self.distance(r.start, r.end)
+            minutes = r.arrives_at - r.departs_at
+            if minutes > 0:
+                self.max_speed = max(self.max_speed, distance / minutes)
+            elif distance > 0:
+                self.max_speed = math.inf
+                break
+
+    def distance(self, a: str, b: str) -> float:
+        a_coords, b_coords = self._coords[a], self._coords[b]
+        return math.hypot(a_coords[0] - b_coords[0], a_coords[1] - b_coords[1])
+
+    def lower_bound(self, stop: str, target: str) -> float:
+        if self.max_speed in (0, math.inf):
+            return 0
+        return self.distance(stop, target) / self.max_speed
+
+
+class LandmarkTable:
+    # ALT lower bounds. For a handful of landmark stops the shortest ride time
+    # to and from every stop is precomputed, ignoring waiting. The triangle
+    # inequality then bounds the time between any two stops from below.
+    _stop_ids: dict[str, int]
+    _from_landmarks: list[array]
+    _to_landmarks: list[array]
+
+    def __init__(self, graph: ExpandedGraph, count: int = 8):
+        self._stop_ids = {}
+        forward, backward = self._build(graph.get_timetable_rows())
+        self._from_landmarks = []
+        self._to_landmarks = []
+        if not self._stop_ids:
+            return
+
+        # Each landmark is the stop furthest away from the ones picked so far.
+        closest = [math.inf] * len(self._stop_ids)
+        landmark = self._furthest(self._shortest_times(forward, 0))
+        for _ in range(min(count, len(self._stop_ids))):
+            from_landmark = self._shortest_times(forward, landmark)
+            to_landmark = self._shortest_times(backward, landmark)
+            self._from_landmarks.append(from_landmark)
+            self._to_landmarks.append(to_landmark)
+            for stop, (a, b) in enumerate(zip(from_landmark, to_landmark)):
+                if a != UNREACHED and b != UNREACHED:
+                    closest[stop] = min(closest[stop], a + b)
+            landmark = self._furthest(closest)
+
+    @property
+    def count(self) -> int:
+        return len(self._from_landmarks)
+
+    def lower_bound(self, stop: str, target: str) -> float:
+        v, t = self._stop_ids[stop], self._stop_ids[target]
+        bound = 0
+        for from_landmark, to_landmark in zip(self._from_landmarks, self._to_landmarks):
+            if from_landmark[v] != UNREACHED and from_landmark[t] != UNREACHED:
+                bound = max(bound, from_landmark[t] - from_landmark[v])
+            if to_landmark[v] != UNREACHED and to_landmark[t] != UNREACHED:
+                bound = max(bound, to_landmark[v] - to_landmark[t])
+        return bound
+
+    @staticmethod
+    def _furthest(times: Iterable[float]) -> int:
+        best, best_time = 0, -1
+        for stop, time in enumerate(times):
+            if time != UNREACHED and time != math.inf and time > best_time:
+                best, best_time = stop, time
+        return best
+
+    @staticmethod
+    def _shortest_times(edges: list[dict[int, int]], source: int) -> array:
+        times = array("I", [UNREACHED]) * len(edges)
+        times[source] = 0
+        open = [(0, source)]
+        while open:
+            time, stop = heapq.heappop(open)
+            if time > times[stop]:
+                continue
+            for neighbour, duration in edges[stop].items():
+                if time + duration < times[neighbour]:
+                    times[neighbour] = time + duration
+                    heapq.heappush(open, (time + duration, neighbour))
+        return times
+
+    def _build(
+        self, rows: Iterable[TimetableRow]
+    ) -> Tuple[list[dict[int, int]], list[dict[int, int]]]:
+        forward: list[dict[int, int]] = []
+        backward: list[dict[int, int]] = []
+
+        def stop_id(name):
+            if name not in self._stop_ids:
+                self._stop_ids[name] = len(forward)
+                forward.append({})
+                backward.append({})
+            return self._stop_ids[name]
+
+        for r in rows:
+            a, b = stop_id(r.start), stop_id(r.end)
+            if a == b:
+                continue
+            duration = r.arrives_at - r.departs_at
+            if duration < forward[a].get(b, UNREACHED):
+                forward[a][b] = duration
+                backward[b][a] = duration
+        return forward, backward
@@ -0,0 +1,217 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Optional, Tuple
+
+from graph import (
+    ExpandedGraph,
+    RowEntry,
+    TimetableRow,
+    format_minutes,
+    read_timetable,
+    sort_connections,
+    to_minutes,
+    to_timetable_row,
+)
+from pathfinder import BusStop
+
+UNREACHED = 2**32
+
+
+class ConnectionScan:
+    # Earliest arrival queries answered by one pass over every timetable row,
+    # sorted by departure. Changing lines is free, so this matches
+    # Pathfinder.find_path with minute_cost=1, transfer_cost=0.
+    _stop_names: list[str]
+    _stop_ids: dict[str, int]
+    _lines: list[str]
+    _departure_stops: array
+    _arrival_stops: array
+    _departures: array
+    _arrivals: array
+    _connection_lines: array
+
+    def __init__(self, row_entries: Iterable[RowEntry] = ()):
+        self._build(to_timetable_row(e) for e in row_entries)
+
+    @staticmethod
+    def from_rows(rows: Iterable[TimetableRow]) -> "ConnectionScan":
+        scan = ConnectionScan.__new__(ConnectionScan)
+        scan._build(rows)
+        return scan
+
+    @staticmethod
+    def from_csv(csv_filename) -> "ConnectionScan":
+        return ConnectionScan.from_rows(read_timetable(csv_filename))
+
+    @staticmethod
+    def from_graph(graph: ExpandedGraph) -> "ConnectionScan":
+        return ConnectionScan.from_rows(graph.get_timetable_rows())
+
+    def stop_exists(self, stop_name: str):
+        return stop_name in self._stop_ids
+
+    def find_path(
+        self, start: str, end: str, time: str
+    ) -> Optional[Tuple[list[BusStop], float]]:
+        starting_time = to_minutes(time)
+        target = self._stop_ids[end]
+        arrivals, parents = self._scan(self._stop_ids[start], starting_time, target)
+        if parents[target] == -1:
+            return None
+        stops = self._prepare_results(target, parents)
+        return stops, arrivals[target] - starting_time
+
+    def find_profile(
+        self, start: str, end: str, from_time: str, to_time: str
+    ) -> list[Tuple[list[BusStop], float]]:
+        # Profile CSA: one backwards scan keeps, for every stop, the Pareto
+        # set of (departure, arrival at end) pairs. Any journey leaving before
+        # to_time that arrives after the earliest arrival for to_time is
+        # dominated, so connections past that arrival are never looked at.
+        first, last = to_minutes(from_time), to_minutes(to_time)
+        start_id, target = self._stop_ids[start], self._stop_ids[end]
+        bound = self._scan(start_id, last, target)[0][target]
+
+        # Per stop, departures are appended in decreasing order and stored
+        # negated so that bisect works on an increasing list.
+        profile_departures: list[list[int]] = [[] for _ in self._stop_names]
+        profile_arrivals: list[list[int]] = [[] for _ in self._stop_names]
+        profile_connections: list[list[int]] = [[] for _ in self._stop_names]
+
+        departure_stops = self._departure_stops
+        arrival_stops = self._arrival_stops
+        departures = self._departures
+        arrivals = self._arrivals
+        lowest = bisect_left(departures, first)
+        for c in range(bisect_right(departures, bound) - 1, lowest - 1, -1):
+            arrival = arrivals[c]
+            if arrival > bound:
+                continue
+            stop = departure_stops[c]
+            if stop == target:
+                continue
+            end_stop = arrival_stops[c]
+            if end_stop == target:
+                reached = arrival
+            else:
+                deps = profile_departures[end_stop]
+                i = bisect_right(deps, -arrival) - 1
+                if i < 0:
+                    continue
+                reached = profile_arrivals[end_stop][i]
+
+            deps = profile_departures[stop]
+            arrs = profile_arrivals[stop]
+            if arrs and arrs[-1] <= reached:
+                continue
+            departure = departures[c]
+            if deps and deps[-1] == -departure:
+                arrs[-1] = reached
+                profile_connections[stop][-1] = c
+            else:
+                deps.append(-departure)
+                arrs.append(reached)
+                profile_connections[stop].append(c)
+
+        results = []
+        for departure, arrival, c in zip(
+            reversed(profile_departures[start_id]),
+            reversed(profile_arrivals[start_id]),
+            reversed(profile_connections[start_id]),
+        ):
+            if -departure > last:
+                break
+            stops = self._prepare_profile_results(
+                c, target, profile_departures, profile_connections
+            )
+            results.append((stops, arrival + departure))
+        return results
+
+    def _scan(self, start: int, starting_time: int, target: Optional[int] = None):
+        earliest = [UNREACHED] * len(self._stop_names)
+        parents = [-1] * len(self._stop_names)
+        earliest[start] = starting_time
+
+        departure_stops = self._departure_stops
+        arrival_stops = self._arrival_stops
+        departures = self._departures
+        arrivals = self._arrivals
+        for c in range(bisect_left(departures, starting_time), len(departures)):
+            departure = departures[c]
+            if target is not None and earliest[target] <= departure:
+                break
+            if earliest[departure_stops[c]] <= departure:
+                stop = arrival_stops[c]
+                if arrivals[c] < earliest[stop]:
+                    earliest[stop] = arrivals[c]
+                    parents[stop] = c
+        return earliest, parents
+
+    def _prepare_results(self, target: int, parents: list[int]) -> list[BusStop]:
+        bus_stops = []
+        stop = target
+        while parents[stop] != -1:
+            c = parents[stop]
+            bus_stops.append(self._bus_stop(c))
+            stop = self._departure_stops[c]
+        bus_stops.reverse()
+        return bus_stops
+
+    def _prepare_profile_results(
+        self,
+        c: int,
+        target: int,
+        profile_departures: list[list[int]],
+        profile_connections: list[list[int]],
+    ) -> list[BusStop]:
+        bus_stops = [self._bus_stop(c)]
+        stop = self._arrival_stops[c]
+        while stop != target:
+            i = bisect_right(profile_departures[stop], -self._arrivals[c]) - 1
+            c = profile_connections[stop][i]
+            bus_stops.append(self._bus_stop(c))
+            stop = self._arrival_stops[c]
+        return bus_stops
+
+    def _bus_stop(self, c: int) -> BusStop:
+        return BusStop(
+            departs_from=self._stop_names[self._departure_stops[c]],
+            departure=format_minutes(self._departures[c]),
+            arrives_to=self._stop_names[self._arrival_stops[c]],
+            arrival=format_minutes(self._arrivals[c]),
+            bus_n=self._lines[self._connection_lines[c]],
+        )
+
+    def _build(self, rows: Iterable[TimetableRow]):
+        self._stop_names = []
+        self._stop_ids = {}
+        self._lines = []
+        line_ids: dict[str, int] = {}
+
+        def stop_id(name):
+            if name not in self._stop_ids:
+                self._stop_ids[name] = len(self._stop_names)
+                self._stop_names.append(name)
+            return self._stop_ids[name]
+
+        connections = []
+        for r in rows:
+            if r.bus_n not in line_ids:
+                line_ids[r.bus_n] = len(self._lines)
+                self._lines.append(r.bus_n)
+            connections.append(
+                (
+                    r.departs_at,
+                    r.arrives_at,
+                    stop_id(r.start),
+                    stop_id(r.end),
+                    line_ids[r.bus_n],
+                )
+            )
+        sort_connections(connections)
+
+        self._departures = array("H", [c[0] for c in connections])
+        self._arrivals = array("H", [c[1] for c in connections])
+        self._departure_stops = array("I", [c[2] for c in connections])
+        self._arrival_stops = array("I", [c[3] for c in connections])
+        self._connection_lines = array("I", [c[4] for c in connections])
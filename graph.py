@@ -1,8 +1,28 @@
-from collections import defaultdict
-from dataclasses import dataclass
-from datetime import datetime
-from typing import Optional, Tuple
+from array import array
+from bisect import bisect_left
+from collections import defaultdict, deque
+import difflib
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, NamedTuple, Optional, Sequence, Tuple
+import csv
+import hashlib
+import json
 import math
+import mmap as mmap_module
+import os
+import struct
+import sys
+import tempfile
+
+MIDNIGHT = datetime(2000, 1, 1)
+
+SNAPSHOT_MAGIC = b"MPKGRAPH"
+SNAPSHOT_VERSION = 2
+# Sections that stay memory-mapped when a snapshot is loaded with mmap=True,
+# the rest is small enough to be copied into arrays.
+MAPPED_SECTIONS = ("trip_offsets", "departures", "arrivals", "earliest")
+UPDATE_KINDS = ("delay", "cancel", "add", "close", "reopen")
 
 
 def to_datetime(time: str):
@@ -16,6 +36,23 @@ def to_datetime(time: str):
     return datetime(2000, 1, day, hour, minute, 0)
 
 
+def to_minutes(time: str) -> int:
+    parts = time.split(":")
+    return int(parts[0]) * 60 + int(parts[1])
+
+
+def datetime_to_minutes(time: datetime) -> int:
+    return (time.day - 1) * 24 * 60 + time.hour * 60 + time.minute
+
+
+def from_minutes(minutes: int) -> datetime:
+    return MIDNIGHT + timedelta(minutes=minutes)
+
+
+def format_minutes(minutes: int) -> str:
+    return f"{minutes // 60 % 24:02d}:{minutes % 60:02d}"
+
+
 def to_row_entry(row: str):
     r = row.split(",")
     return RowEntry(
@@ -44,6 +81,144 @@ class RowEntry:
     end_longitude: float
 
 
+def file_checksum(filename) -> str:
+    with open(filename, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class TimetableRow(NamedTuple):
+    start: str
+    end: str
+    departs_at: int
+    arrives_at: int
+    bus_n: str
+    start_latitude: float
+    start_longitude: float
+    end_latitude: float
+    end_longitude: float
+
+
+@dataclass(frozen=True)
+class TimetableUpdate:
+    # A real-time change. Trips are the rows of line from stop to next_stop,
+    # picked by their departure in minutes since midnight. "delay" shifts a
+    # trip by minutes, "cancel" drops it, "add" adds one arriving at arrival,
+    # "close" and "reopen" only need the stop.
+    kind: str
+    stop: str
+    line: Optional[str] = None
+    next_stop: Optional[str] = None
+    departure: int = 0
+    arrival: int = 0
+    minutes: int = 0
+
+
+@dataclass
+class TimetableChanges:
+    # What apply_updates touched. Edges are the (line, stop, next stop) that
+    # lost or moved a trip, trips lists every added or moved trip as
+    # (departure, arrival).
+    edges: set[Tuple[str, str, str]] = field(default_factory=set)
+    trips: list[Tuple[int, int]] = field(default_factory=list)
+    closed: set[str] = field(default_factory=set)
+    reopened: set[str] = field(default_factory=set)
+
+
+def to_timetable_row(entry: RowEntry) -> TimetableRow:
+    return TimetableRow(
+        entry.start,
+        entry.end,
+        datetime_to_minutes(entry.departs_at),
+        datetime_to_minutes(entry.arrives_at),
+        entry.bus_n,
+        entry.start_latitude,
+        entry.start_longitude,
+        entry.end_latitude,
+        entry.end_longitude,
+    )
+
+
+def read_timetable(csv_filename) -> Iterator[TimetableRow]:
+    # Rows of the CSV one at a time, after its header. Blank lines are
+    # skipped, a row that cannot be parsed raises ValueError with its line.
+    intern = sys.intern
+    minutes: dict[str, int] = {}
+    with open(csv_filename, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for r in reader:
+            if not r:
+                continue
+            try:
+                departs_at = minutes.get(r[3])
+                if departs_at is None:
+                    departs_at = minutes[r[3]] = to_minutes(r[3])
+                arrives_at = minutes.get(r[4])
+                if arrives_at is None:
+                    arrives_at = minutes[r[4]] = to_minutes(r[4])
+                row = TimetableRow(
+                    intern(r[5]),
+                    intern(r[6]),
+                    departs_at,
+                    arrives_at,
+                    intern(r[2]),
+                    float(r[7]),
+                    float(r[8]),
+                    float(r[9]),
+                    float(r[10]),
+                )
+            except (IndexError, ValueError) as e:
+                raise ValueError(
+                    f"Malformed row on line {reader.line_num} of {csv_filename}"
+                ) from e
+            yield row
+
+
+def sort_connections(connections: list[tuple]) -> list[tuple]:
+    # Connections as (departure, arrival, from stop, to stop, ...) sorted by
+    # time. Among the ones that depart and arrive in the same minute, a
+    # connection comes after those that reach its stop, so a single pass in
+    # this order can ride a chain of them. Those that wait on each other in a
+    # cycle are repeated once for every connection in it instead.
+    connections.sort()
+    # The zero minute connections of each departure minute, one block each.
+    blocks: list[list[int]] = []
+    for i in [i for i, c in enumerate(connections) if c[0] == c[1]]:
+        if blocks and blocks[-1][1] == i and connections[i - 1][0] == connections[i][0]:
+            blocks[-1][1] = i + 1
+        else:
+            blocks.append([i, i + 1])
+    # From the last block on, repeating a cycle shifts what comes after it.
+    for first, last in reversed(blocks):
+        if last - first > 1:
+            connections[first:last] = _chain_order(connections[first:last])
+    return connections
+
+
+def _chain_order(block: list[tuple]) -> list[tuple]:
+    waiting = [0] * len(block)
+    departing: dict[int, list[int]] = defaultdict(list)
+    for i, c in enumerate(block):
+        departing[c[2]].append(i)
+    for i, c in enumerate(block):
+        for j in departing.get(c[3], ()):
+            if j != i:
+                waiting[j] += 1
+
+    ready = deque(i for i in range(len(block)) if waiting[i] == 0)
+    ordered = []
+    while ready:
+        i = ready.popleft()
+        ordered.append(block[i])
+        for j in departing.get(block[i][3], ()):
+            if j != i:
+                waiting[j] -= 1
+                if waiting[j] == 0:
+                    ready.append(j)
+    cycle = [c for i, c in enumerate(block) if waiting[i] > 0]
+    return ordered + cycle * len(cycle)
+
+
 @dataclass
 class Connection:
     departs_at: datetime
@@ -52,24 +227,31 @@ class Connection:
 
 
 class Node:
+    __slots__ = (
+        "id",
+        "bus_stop_name",
+        "bus_n",
+        "latitude",
+        "longitude",
+        "removed",
+        "_hash",
+    )
+
+    id: int
     bus_stop_name: str
     bus_n: str
     latitude: float
     longitude: float
     removed: bool
-    parent: Optional["Node"]
-
-    _connections: dict["Node", list[Connection]]
-    _same_stop_nodes: list["Node"]
 
-    def __init__(self, stop_name, bus_name, latitude=0.0, longitude=0.0) -> None:
-        self._connections = {}
+    def __init__(self, stop_name, bus_name, latitude=0.0, longitude=0.0, id=-1) -> None:
+        self.id = id
         self.bus_stop_name = stop_name
         self.bus_n = bus_name
         self.latitude = latitude
         self.longitude = longitude
         self.removed = False
-        self.parent = None
+        self._hash = hash((stop_name, bus_name))
 
     def __eq__(self, value: object) -> bool:
         if not isinstance(value, Node):
@@ -77,53 +259,284 @@ class Node:
         return value.bus_n == self.bus_n and value.bus_stop_name == self.bus_stop_name
 
     def __hash__(self) -> int:
-        return hash(self.bus_stop_name + self.bus_n)
+        return self._hash
 
     def __repr__(self) -> str:
         s = f"{self.bus_stop_name}:{self.bus_n}"
         return s
 
-    def add_connection(self, node: "Node", connection: Connection):
-        if not node in self._connections:
-            self._connections[node] = []
-        self._connections[node].append(connection)
 
-    def get_best_connection(self, end: "Node", departure_time) -> Optional[Connection]:
-        if end not in self._connections or end.removed:
-            raise ValueError("Connection doesnt exist")
-
-        connections = self._connections[end]
-        for c in connections:
-            if c.departs_at >= departure_time:
-                return c
-        return None
+def _aligned(size: int) -> int:
+    return (size + 7) // 8 * 8
 
-    def set_same_stop_nodes(self, nodes: list["Node"]):
-        self._same_stop_nodes = nodes
 
-    def get_neighbours(self):
-        all_nodes = list(self._connections.keys()) + self._same_stop_nodes
-        active_nodes = [n for n in all_nodes if n.removed is False]
-        return active_nodes
+def distance(a: Tuple[float, float], b: Tuple[float, float]):
+    return math.sqrt(((a[0] - b[0]) * (a[0] - b[0]) + (a[1] - b[1]) * (a[1] - b[1])))
 
-    def sort_connections(self):
-        for _, value in self._connections.items():
-            value.sort(key=lambda x: x.arrives_at)
 
+def _append_sorted_trips(
+    trips: Iterable[Tuple[int, int]],
+    offsets: array,
+    departures: array,
+    arrivals: array,
+    earliest: array,
+):
+    first = len(departures)
+    trips = sorted(trips)
+    departures.extend(d for d, _ in trips)
+    arrivals.extend(a for _, a in trips)
 
-def distance(a: Tuple[float, float], b: Tuple[float, float]):
-    return math.sqrt(((a[0] - b[0]) * (a[0] - b[0]) + (a[1] - b[1]) * (a[1] - b[1])))
+    best = first + len(trips) - 1
+    suffix = array("I", bytes(4 * len(trips)))
+    for i in range(len(trips) - 1, -1, -1):
+        if arrivals[first + i] < arrivals[best]:
+            best = first + i
+        suffix[i] = best
+    earliest.extend(suffix)
+    offsets.append(len(departures))
 
 
 class ExpandedGraph:
+    # Nodes are numbered by their position in _nodes. Everything else is kept
+    # in flat arrays in CSR layout, instead of one object per timetable row:
+    # - out edges of node i: _edge_targets[_edge_offsets[i]:_edge_offsets[i + 1]]
+    # - trips of edge e, sorted by departure (minutes since midnight):
+    #   _departures/_arrivals[_trip_offsets[e]:_trip_offsets[e + 1]]
+    # - _earliest[t] is the trip arriving first among those departing at or
+    #   after trip t on the same edge, as a later trip can overtake an earlier one
+    # - nodes at stop s: _stop_nodes[_stop_offsets[s]:_stop_offsets[s + 1]]
+    # - edges into node i: _reverse_edges[_reverse_offsets[i]:_reverse_offsets[i + 1]],
+    #   starting at _reverse_sources of the same range, _min_durations[e] is
+    #   the shortest trip of edge e
+    # Edges changed by apply_updates keep their trips in _trip_overrides,
+    # laid out the same way on their own, and the arrays above stay as built.
+    # After contract(), searches follow _search_edges instead of the edges of
+    # a node. Those are edge ids, or ~s for shortcut s, which skips a chain of
+    # line nodes that have nothing else at their stop. Shortcut trips are laid
+    # out like edge trips, _shortcut_paths holds the nodes each one passes.
     _nodes: list[Node]
+    # The checksum of the CSV a snapshot was saved from. A graph read from a
+    # CSV only remembers the file and hashes it when it is saved.
+    source_checksum: Optional[str]
+    _source_file: Optional[str]
+    _nodes_by_stop_name: dict[str, list[Node]]
+    _nodes_by_key: dict[Tuple[str, str], Node]
+    _sorted_stop_names: list[Tuple[str, str]]
+    _stop_ids: array
+    _stop_offsets: array
+    _stop_nodes: array
+    _edge_offsets: array
+    _edge_targets: array
+    _trip_offsets: array
+    _departures: array
+    _arrivals: array
+    _earliest: array
+    _reverse_offsets: array
+    _reverse_sources: array
+    _reverse_edges: array
+    _min_durations: array
+    _trip_overrides: dict[int, Tuple[array, array, array]]
+    _closed_stops: set[str]
+    # Bumped by every change to the timetable, so results computed before can
+    # be told apart.
+    generation: int
+    contracted: bool
+    _search_offsets: array
+    _search_edges: array
+    _shortcut_targets: array
+    _shortcut_path_offsets: array
+    _shortcut_paths: array
+    _shortcut_trip_offsets: array
+    _shortcut_departures: array
+    _shortcut_arrivals: array
+    _shortcut_earliest: array
+    _shortcuts_by_key: dict[Tuple[int, int], int]
+    _bypassing_shortcuts: dict[int, list[int]]
 
     def __init__(
         self,
-        connections: list[RowEntry],
+        connections: Iterable[RowEntry],
+        contract: bool = False,
     ):
-        self._nodes = self._create_nodes(connections)
-        self._append_connections_to_nodes(connections)
+        self._build(to_timetable_row(c) for c in connections)
+        if contract:
+            self.contract()
+
+    @staticmethod
+    def from_rows(rows: Iterable[TimetableRow], contract=False) -> "ExpandedGraph":
+        graph = ExpandedGraph.__new__(ExpandedGraph)
+        graph._build(rows)
+        if contract:
+            graph.contract()
+        return graph
+
+    @staticmethod
+    def from_csv(csv_filename, contract=False) -> "ExpandedGraph":
+        graph = ExpandedGraph.from_rows(read_timetable(csv_filename), contract)
+        graph._source_file = csv_filename
+        return graph
+
+    def save(self, path):
+        trip_offsets, departures, arrivals, earliest = self._merged_trips()
+        stop_names = [
+            self._nodes[self._stop_nodes[self._stop_offsets[s]]].bus_stop_name
+            for s in range(len(self._stop_offsets) - 1)
+        ]
+        line_names = list(dict.fromkeys(n.bus_n for n in self._nodes))
+        line_ids = {name: i for i, name in enumerate(line_names)}
+        if self.source_checksum is None and self._source_file is not None:
+            self.source_checksum = file_checksum(self._source_file)
+        sections = {
+            "stop_ids": self._stop_ids,
+            "stop_offsets": self._stop_offsets,
+            "stop_nodes": self._stop_nodes,
+            "node_lines": array("I", [line_ids[n.bus_n] for n in self._nodes]),
+            "latitudes": array("d", [n.latitude for n in self._nodes]),
+            "longitudes": array("d", [n.longitude for n in self._nodes]),
+            "edge_offsets": self._edge_offsets,
+            "edge_targets": self._edge_targets,
+            "trip_offsets": trip_offsets,
+            "departures": departures,
+            "arrivals": arrivals,
+            "earliest": earliest,
+            "reverse_offsets": self._reverse_offsets,
+            "reverse_sources": self._reverse_sources,
+            "reverse_edges": self._reverse_edges,
+            "min_durations": self._min_durations,
+        }
+
+        layout = {}
+        offset = 0
+        for name, values in sections.items():
+            data = memoryview(values)
+            layout[name] = [data.format, offset, len(data)]
+            offset += _aligned(data.nbytes)
+        header = json.dumps(
+            {
+                "byteorder": sys.byteorder,
+                "source_checksum": self.source_checksum,
+                "contracted": self.contracted,
+                "closed_stops": sorted(self._closed_stops),
+                "stops": stop_names,
+                "lines": line_names,
+                "sections": layout,
+            }
+        ).encode()
+
+        # Written next to path and moved over it, so a process loading the
+        # snapshot meanwhile never sees half a file.
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(SNAPSHOT_MAGIC)
+                f.write(struct.pack("<IQ", SNAPSHOT_VERSION, len(header)))
+                f.write(header)
+                f.write(bytes(_aligned(f.tell()) - f.tell()))
+                for values in sections.values():
+                    data = memoryview(values).cast("B")
+                    f.write(data)
+                    f.write(bytes(_aligned(data.nbytes) - data.nbytes))
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    @staticmethod
+    def load(path, mmap=True, source=None) -> "ExpandedGraph":
+        with open(path, "rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError("Not a graph snapshot")
+            fields = f.read(12)
+            if len(fields) != 12:
+                raise ValueError("Snapshot is truncated")
+            version, header_length = struct.unpack("<IQ", fields)
+            if version != SNAPSHOT_VERSION:
+                raise ValueError("Unsupported snapshot version")
+            header = f.read(header_length)
+            if len(header) != header_length:
+                raise ValueError("Snapshot is truncated")
+            header = json.loads(header)
+            if header["byteorder"] != sys.byteorder:
+                raise ValueError("Snapshot was saved with a different byte order")
+            if source is not None and header["source_checksum"] != file_checksum(
+                source
+            ):
+                raise ValueError("Snapshot is out of date")
+            data_start = _aligned(f.tell())
+            if mmap:
+                buffer = memoryview(
+                    mmap_module.mmap(f.fileno(), 0, access=mmap_module.ACCESS_READ)
+                )
+            else:
+                f.seek(0)
+                buffer = memoryview(f.read())
+
+        sections = {}
+        for name, (typecode, offset, length) in header["sections"].items():
+            start = data_start + offset
+            end = start + length * array(typecode).itemsize
+            if end > len(buffer):
+                raise ValueError("Snapshot is truncated")
+            view = buffer[start:end]
+            if mmap and name in MAPPED_SECTIONS:
+                sections[name] = view.cast(typecode)
+            else:
+                sections[name] = array(typecode, view.tobytes())
+
+        graph = ExpandedGraph.__new__(ExpandedGraph)
+        graph.source_checksum = header["source_checksum"]
+        graph._source_file = None
+        graph._nodes = []
+        stop_names = header["stops"]
+        line_names = header["lines"]
+        for i, stop in enumerate(sections["stop_ids"]):
+            graph._nodes.append(
+                Node(
+                    stop_names[stop],
+                    line_names[sections["node_lines"][i]],
+                    sections["latitudes"][i],
+                    sections["longitudes"][i],
+                    i,
+                )
+            )
+        graph._stop_ids = sections["stop_ids"]
+        graph._stop_offsets = sections["stop_offsets"]
+        graph._stop_nodes = sections["stop_nodes"]
+        graph._edge_offsets = sections["edge_offsets"]
+        graph._edge_targets = sections["edge_targets"]
+        graph._trip_offsets = sections["trip_offsets"]
+        graph._departures = sections["departures"]
+        graph._arrivals = sections["arrivals"]
+        graph._earliest = sections["earliest"]
+        graph._reverse_offsets = sections["reverse_offsets"]
+        graph._reverse_sources = sections["reverse_sources"]
+        graph._reverse_edges = sections["reverse_edges"]
+        graph._min_durations = sections["min_durations"]
+        graph._trip_overrides = {}
+        graph._closed_stops = set(header.get("closed_stops", []))
+        graph.generation = 0
+        graph._create_indexes()
+        for stop in graph._closed_stops:
+            for n in graph._nodes_by_stop_name[stop]:
+                n.removed = True
+        graph.contracted = False
+        if header.get("contracted"):
+            graph.contract()
+        return graph
+
+    def _build(self, rows: Iterable[TimetableRow]):
+        self.source_checksum = None
+        self._source_file = None
+        self._nodes = []
+        self._trip_overrides = {}
+        self._closed_stops = set()
+        self.generation = 0
+        trips = self._create_nodes(rows)
+        self._create_stops()
+        self._append_connections_to_nodes(trips)
+        self._create_indexes()
+        self.contracted = False
 
     def get_nodes(self) -> list[Node]:
         return [n for n in self._nodes if n.removed is False]
@@ -134,66 +547,552 @@ class ExpandedGraph:
         end: Node,
         departure_time: datetime,
     ) -> Optional[Connection]:
+        trip = self.get_best_trip(start, end, datetime_to_minutes(departure_time))
+        if trip is None:
+            return None
+        return Connection(from_minutes(trip[0]), from_minutes(trip[1]), start.bus_n)
+
+    def get_best_trip(
+        self,
+        start: Node,
+        end: Node,
+        departure_time: int,
+    ) -> Optional[Tuple[int, int]]:
         if start.bus_n != end.bus_n:
             raise ValueError()
         if start.removed or end.removed:
             raise ValueError()
 
-        return start.get_best_connection(end, departure_time)
+        shortcut = None
+        if self.contracted:
+            shortcut = self._shortcuts_by_key.get((start.id, end.id))
+            if shortcut is None and end.id in self._bypassing_shortcuts:
+                path = self._bypass_path(start.id, end.id)
+                if path is not None:
+                    return self._path_trip(path, departure_time)
+        if shortcut is None:
+            return self._edge_trip(self._find_edge(start.id, end.id), departure_time)
+
+        # A shortcut can run next to an edge of its own between the same nodes.
+        trips = [self._shortcut_trip(shortcut, departure_time)]
+        edge = self._find_edge_or_none(start.id, end.id)
+        if edge is not None:
+            trips.append(self._edge_trip(edge, departure_time))
+        trips = [t for t in trips if t is not None]
+        if not trips:
+            return None
+        return min(trips, key=lambda t: (t[1], -t[0]))
+
+    def unpack_trip(
+        self, start: Node, end: Node, trip: Tuple[int, int]
+    ) -> list[Tuple[Node, Node, Tuple[int, int]]]:
+        # The timetable rows behind a trip returned by get_best_trip, which can
+        # span a whole shortcut.
+        if not self.contracted:
+            return [(start, end, trip)]
+        edge = self._find_edge_or_none(start.id, end.id)
+        if edge is not None and self._edge_trip(edge, trip[0]) == trip:
+            return [(start, end, trip)]
+
+        shortcut = self._shortcuts_by_key.get((start.id, end.id))
+        if shortcut is not None:
+            path = self._shortcut_path(shortcut)
+        else:
+            path = self._bypass_path(start.id, end.id)
+        legs = []
+        time = trip[0]
+        for a, b in zip(path, path[1:]):
+            leg = self._edge_trip(self._find_edge(a, b), time)
+            legs.append((self._nodes[a], self._nodes[b], leg))
+            time = leg[1]
+        return legs
+
+    def get_shortcut_heads(self, node: Node) -> list[Node]:
+        # Nodes whose shortcuts skip over node, searches aiming for node have to
+        # look at it from there.
+        if not self.contracted:
+            return []
+        return [
+            self._nodes[self._shortcut_paths[self._shortcut_path_offsets[s]]]
+            for s in self._bypassing_shortcuts.get(node.id, [])
+        ]
 
-    def get_neighbouring_nodes(self, node: Node) -> list[Node]:
-        return node.get_neighbours()
+    def _edge_trip(self, edge: int, departure_time: int) -> Optional[Tuple[int, int]]:
+        if edge in self._trip_overrides:
+            departures, arrivals, earliest = self._trip_overrides[edge]
+            i = bisect_left(departures, departure_time)
+            if i == len(departures):
+                return None
+            best = earliest[i]
+            return departures[best], arrivals[best]
+        last = self._trip_offsets[edge + 1]
+        i = bisect_left(self._departures, departure_time, self._trip_offsets[edge], last)
+        if i == last:
+            return None
+        best = self._earliest[i]
+        return self._departures[best], self._arrivals[best]
+
+    def _edge_trips(self, edge: int) -> Tuple[Sequence[int], Sequence[int]]:
+        if edge in self._trip_overrides:
+            departures, arrivals, _ = self._trip_overrides[edge]
+            return departures, arrivals
+        first, last = self._trip_offsets[edge], self._trip_offsets[edge + 1]
+        return self._departures[first:last], self._arrivals[first:last]
+
+    def _merged_trips(self) -> Tuple[array, array, array, array]:
+        # Trip arrays with the overrides folded back in, for saving.
+        if not self._trip_overrides:
+            return self._trip_offsets, self._departures, self._arrivals, self._earliest
+        offsets, departures, arrivals, earliest = (
+            array("I", [0]),
+            array("H"),
+            array("H"),
+            array("I"),
+        )
+        for edge in range(len(self._edge_targets)):
+            _append_sorted_trips(
+                zip(*self._edge_trips(edge)), offsets, departures, arrivals, earliest
+            )
+        return offsets, departures, arrivals, earliest
+
+    def _shortcut_trip(
+        self, shortcut: int, departure_time: int
+    ) -> Optional[Tuple[int, int]]:
+        last = self._shortcut_trip_offsets[shortcut + 1]
+        i = bisect_left(
+            self._shortcut_departures,
+            departure_time,
+            self._shortcut_trip_offsets[shortcut],
+            last,
+        )
+        if i == last:
+            return None
+        best = self._shortcut_earliest[i]
+        return self._shortcut_departures[best], self._shortcut_arrivals[best]
+
+    def _path_trip(self, path: list[int], departure_time: int):
+        # No trip rides through a removed node.
+        if any(self._nodes[i].removed for i in path):
+            return None
+        departure = None
+        time = departure_time
+        for a, b in zip(path, path[1:]):
+            trip = self._edge_trip(self._find_edge(a, b), time)
+            if trip is None:
+                return None
+            if departure is None:
+                departure = trip[0]
+            time = trip[1]
+        return departure, time
+
+    def _shortcut_path(self, shortcut: int) -> list[int]:
+        offsets = self._shortcut_path_offsets
+        return list(self._shortcut_paths[offsets[shortcut] : offsets[shortcut + 1]])
+
+    def _bypass_path(self, start: int, end: int) -> Optional[list[int]]:
+        for s in self._bypassing_shortcuts.get(end, []):
+            path = self._shortcut_path(s)
+            if path[0] == start:
+                return path[: path.index(end) + 1]
+        return None
+
+    def _find_edge_or_none(self, start: int, end: int) -> Optional[int]:
+        try:
+            return self._find_edge(start, end)
+        except ValueError:
+            return None
+
+    def get_neighbouring_nodes(self, node: Node, same_stop: bool = True) -> list[Node]:
+        nodes = self._nodes
+        if self.contracted:
+            neighbours = []
+            for e in self._search_edges[
+                self._search_offsets[node.id] : self._search_offsets[node.id + 1]
+            ]:
+                if e >= 0:
+                    neighbours.append(nodes[self._edge_targets[e]])
+                else:
+                    offsets = self._shortcut_path_offsets
+                    path = self._shortcut_paths[offsets[~e] : offsets[~e + 1]]
+                    if not any(nodes[i].removed for i in path):
+                        neighbours.append(nodes[path[-1]])
+        else:
+            neighbours = [
+                nodes[i]
+                for i in self._edge_targets[
+                    self._edge_offsets[node.id] : self._edge_offsets[node.id + 1]
+                ]
+            ]
+        if same_stop:
+            stop = self._stop_ids[node.id]
+            for i in self._stop_nodes[
+                self._stop_offsets[stop] : self._stop_offsets[stop + 1]
+            ]:
+                if i != node.id:
+                    neighbours.append(nodes[i])
+        return [n for n in neighbours if n.removed is False]
+
+    def get_reverse_neighbours(self, node: Node) -> list[Tuple[Node, int]]:
+        # Nodes with an edge into node, with the shortest trip along it.
+        nodes = self._nodes
+        neighbours = []
+        for i in range(self._reverse_offsets[node.id], self._reverse_offsets[node.id + 1]):
+            source = nodes[self._reverse_sources[i]]
+            if source.removed is False:
+                neighbours.append((source, self._min_durations[self._reverse_edges[i]]))
+        return neighbours
+
+    def get_timetable_rows(self) -> Iterator[TimetableRow]:
+        for start in self._nodes:
+            for edge in range(self._edge_offsets[start.id], self._edge_offsets[start.id + 1]):
+                end = self._nodes[self._edge_targets[edge]]
+                for departure, arrival in zip(*self._edge_trips(edge)):
+                    yield TimetableRow(
+                        start.bus_stop_name,
+                        end.bus_stop_name,
+                        departure,
+                        arrival,
+                        start.bus_n,
+                        start.latitude,
+                        start.longitude,
+                        end.latitude,
+                        end.longitude,
+                    )
 
     def remove_node(self, node: Node):
         node.removed = True
+        self.generation += 1
+
+    def closed_stops(self) -> set[str]:
+        return set(self._closed_stops)
+
+    def is_closed(self, stop_name: str) -> bool:
+        return stop_name in self._closed_stops
+
+    def apply_updates(self, updates: Iterable[TimetableUpdate]) -> TimetableChanges:
+        # Trips of the edges an update touches are sorted again into a
+        # _trip_overrides entry, the rest of the graph is left alone. All
+        # updates are checked before any of them is applied. Closing a stop
+        # removes its nodes until it is reopened.
+        changes = TimetableChanges()
+        edited: dict[int, list[Tuple[int, int]]] = {}
+        closures: dict[str, bool] = {}
+        for u in updates:
+            if u.kind not in UPDATE_KINDS:
+                raise ValueError(f"Unknown update {u.kind}")
+            if u.kind in ("close", "reopen"):
+                if u.stop not in self._nodes_by_stop_name:
+                    raise ValueError(f"Bus stop {u.stop} doesnt exist")
+                closures[u.stop] = u.kind == "close"
+                continue
+
+            start = self.get_node(u.stop, u.line)
+            end = self.get_node(u.next_stop, u.line)
+            edge = self._find_edge(start.id, end.id)
+            if edge not in edited:
+                edited[edge] = list(zip(*self._edge_trips(edge)))
+            trips = edited[edge]
+            if u.kind == "add":
+                trip = (u.departure, u.arrival)
+            else:
+                for i, (departure, arrival) in enumerate(trips):
+                    if departure == u.departure:
+                        break
+                else:
+                    raise ValueError(
+                        f"No trip of {u.line} leaves {u.stop} "
+                        f"at {format_minutes(u.departure)}"
+                    )
+                trips.pop(i)
+                changes.edges.add((u.line, u.stop, u.next_stop))
+                trip = None
+                if u.kind == "delay":
+                    trip = (departure + u.minutes, arrival + u.minutes)
+            if trip is not None:
+                if not 0 <= trip[0] <= trip[1] < 2**16:
+                    raise ValueError(f"Invalid trip times {trip}")
+                trips.append(trip)
+                changes.trips.append(trip)
+
+        for edge, trips in edited.items():
+            offsets, departures, arrivals, earliest = (
+                array("I", [0]),
+                array("H"),
+                array("H"),
+                array("I"),
+            )
+            _append_sorted_trips(trips, offsets, departures, arrivals, earliest)
+            self._trip_overrides[edge] = (departures, arrivals, earliest)
+            # Lower bounds only have to drop, removed trips can stay counted.
+            for departure, arrival in trips:
+                if arrival - departure < self._min_durations[edge]:
+                    self._min_durations[edge] = arrival - departure
+
+        for stop, closed in closures.items():
+            for n in self._nodes_by_stop_name[stop]:
+                n.removed = closed
+            if closed:
+                self._closed_stops.add(stop)
+                changes.closed.add(stop)
+            elif stop in self._closed_stops:
+                self._closed_stops.discard(stop)
+                changes.reopened.add(stop)
+
+        if edited or closures:
+            self.source_checksum = None
+            self._source_file = None
+            self.generation += 1
+        # Shortcut trips are made from edge trips, so they are made again.
+        if edited and self.contracted:
+            self.contract()
+        return changes
 
     def get_nodes_by_stop_name(self, stop_name: str) -> list[Node]:
-        nodes = []
-        for n in self._nodes:
-            if n.bus_stop_name == stop_name:
-                nodes.append(n)
-        return nodes
+        return list(self._nodes_by_stop_name.get(stop_name, []))
+
+    def node_count(self) -> int:
+        # Node ids run from 0 to node_count() - 1, removed nodes included.
+        return len(self._nodes)
+
+    def get_node_by_id(self, id: int) -> Node:
+        return self._nodes[id]
 
     def get_node(self, stop_name, bus_name) -> Node:
-        for n in self._nodes:
-            if n.bus_stop_name == stop_name and n.bus_n == bus_name:
-                return n
-        raise ValueError("Tried to get a node that doesnt exist")
+        node = self._nodes_by_key.get((stop_name, bus_name))
+        if node is None:
+            raise ValueError("Tried to get a node that doesnt exist")
+        return node
+
+    def find_stop_names(self, query: str, limit: int = 5) -> list[str]:
+        key = query.casefold()
+        names = self._sorted_stop_names
+        found = []
+        i = bisect_left(names, (key, ""))
+        while i < len(names) and names[i][0].startswith(key) and len(found) < limit:
+            found.append(names[i][1])
+            i += 1
+
+        if len(found) < limit:
+            by_key = dict(names)
+            for match in difflib.get_close_matches(key, by_key, limit, 0.6):
+                if by_key[match] not in found:
+                    found.append(by_key[match])
+        return found[:limit]
 
     def reset(self):
+        # Puts back every removed node and reopens every closed stop.
         for n in self._nodes:
             n.removed = False
-            n.parent = None
-
-    def _create_nodes(self, connections: list[RowEntry]) -> list[Node]:
-        nodes: dict[Tuple[str, str], Node] = {}
-        nodes_by_bus_stop: dict[str, set[Node]] = defaultdict(set)
-
-        for c in connections:
-            if (c.start, c.bus_n) not in nodes:
-                node = Node(c.start, c.bus_n, c.start_latitude, c.start_longitude)
-                nodes[(c.start, c.bus_n)] = node
-                nodes_by_bus_stop[c.start].add(node)
-            if (c.end, c.bus_n) not in nodes:
-                node = Node(c.end, c.bus_n, c.end_latitude, c.end_longitude)
-                nodes[(c.end, c.bus_n)] = node
-                nodes_by_bus_stop[c.end].add(node)
-
-        for n in nodes.values():
-            n.set_same_stop_nodes(list(nodes_by_bus_stop[n.bus_stop_name] - set([n])))
-        return list(nodes.values())
-
-    def _append_connections_to_nodes(self, entries: list[RowEntry]):
-        node_dict = {}
-        for n in self._nodes:
-            node_dict[(n.bus_stop_name, n.bus_n)] = n
-        for entry in entries:
-
-            start = node_dict[(entry.start, entry.bus_n)]
-            end = node_dict[(entry.end, entry.bus_n)]
+        self._closed_stops.clear()
+        self.generation += 1
 
-            start.add_connection(
-                end, Connection(entry.departs_at, entry.arrives_at, entry.bus_n)
+    def _find_edge(self, start: int, end: int) -> int:
+        try:
+            return self._edge_targets.index(
+                end, self._edge_offsets[start], self._edge_offsets[start + 1]
             )
+        except ValueError:
+            raise ValueError("Connection doesnt exist")
+
+    def _create_nodes(
+        self, rows: Iterable[TimetableRow]
+    ) -> dict[Tuple[int, int], Tuple[array, array]]:
+        node_ids: dict[Tuple[str, str], int] = {}
+        edges: dict[Tuple[str, str, str], Tuple[array, array]] = {}
+        trips: dict[Tuple[int, int], Tuple[array, array]] = {}
+
+        def node_id(stop, bus_n, latitude, longitude):
+            key = (stop, bus_n)
+            if key not in node_ids:
+                node_ids[key] = len(self._nodes)
+                self._nodes.append(
+                    Node(stop, bus_n, latitude, longitude, len(self._nodes))
+                )
+            return node_ids[key]
+
+        for r in rows:
+            edge = edges.get((r.start, r.end, r.bus_n))
+            if edge is None:
+                start = node_id(r.start, r.bus_n, r.start_latitude, r.start_longitude)
+                end = node_id(r.end, r.bus_n, r.end_latitude, r.end_longitude)
+                edge = edges[(r.start, r.end, r.bus_n)] = (array("H"), array("H"))
+                trips[(start, end)] = edge
+            edge[0].append(r.departs_at)
+            edge[1].append(r.arrives_at)
+        return trips
+
+    def _create_stops(self):
+        nodes_by_bus_stop: dict[str, list[int]] = defaultdict(list)
         for n in self._nodes:
-            n.sort_connections()
+            nodes_by_bus_stop[n.bus_stop_name].append(n.id)
+
+        self._stop_ids = array("I", bytes(4 * len(self._nodes)))
+        self._stop_offsets = array("I", [0])
+        self._stop_nodes = array("I")
+        for stop, ids in enumerate(nodes_by_bus_stop.values()):
+            for i in ids:
+                self._stop_ids[i] = stop
+            self._stop_nodes.extend(ids)
+            self._stop_offsets.append(len(self._stop_nodes))
+
+    def _create_indexes(self):
+        self._nodes_by_stop_name = {}
+        for s in range(len(self._stop_offsets) - 1):
+            nodes = [
+                self._nodes[i]
+                for i in self._stop_nodes[self._stop_offsets[s] : self._stop_offsets[s + 1]]
+            ]
+            self._nodes_by_stop_name[nodes[0].bus_stop_name] = nodes
+        self._nodes_by_key = {(n.bus_stop_name, n.bus_n): n for n in self._nodes}
+        self._sorted_stop_names = sorted(
+            (name.casefold(), name) for name in self._nodes_by_stop_name
+        )
+
+    def _append_connections_to_nodes(
+        self, trips: dict[Tuple[int, int], Tuple[array, array]]
+    ):
+        self._edge_offsets = array("I", [0])
+        self._edge_targets = array("I")
+        self._trip_offsets = array("I", [0])
+        self._departures = array("H")
+        self._arrivals = array("H")
+        self._earliest = array("I")
+
+        targets: list[list[int]] = [[] for _ in self._nodes]
+        for start, end in trips:
+            targets[start].append(end)
+
+        for start, ends in enumerate(targets):
+            for end in sorted(ends):
+                departures, arrivals = trips.pop((start, end))
+                self._edge_targets.append(end)
+                self._append_trips(departures, arrivals)
+            self._edge_offsets.append(len(self._edge_targets))
+        self._create_reverse_index()
+
+    def _create_reverse_index(self):
+        incoming: list[list[Tuple[int, int]]] = [[] for _ in self._nodes]
+        self._min_durations = array("H")
+        for start in range(len(self._nodes)):
+            for edge in range(self._edge_offsets[start], self._edge_offsets[start + 1]):
+                incoming[self._edge_targets[edge]].append((start, edge))
+                first, last = self._trip_offsets[edge], self._trip_offsets[edge + 1]
+                durations = (
+                    a - d
+                    for d, a in zip(
+                        self._departures[first:last], self._arrivals[first:last]
+                    )
+                )
+                self._min_durations.append(max(min(durations), 0))
+
+        self._reverse_offsets = array("I", [0])
+        self._reverse_sources = array("I")
+        self._reverse_edges = array("I")
+        for edges in incoming:
+            for start, edge in edges:
+                self._reverse_sources.append(start)
+                self._reverse_edges.append(edge)
+            self._reverse_offsets.append(len(self._reverse_edges))
+
+    def _append_trips(self, departures: array, arrivals: array):
+        _append_sorted_trips(
+            zip(departures, arrivals),
+            self._trip_offsets,
+            self._departures,
+            self._arrivals,
+            self._earliest,
+        )
+
+    def contract(self):
+        # A line node is skipped when nothing else stops at its stop and it
+        # only connects to the two nodes before and after it on the line.
+        # Every chain of those becomes one shortcut per direction between the
+        # nodes at either end, with the trips of riding the whole chain.
+        nodes = self._nodes
+        neighbours: list[set[int]] = [set() for _ in nodes]
+        for n in nodes:
+            for end in self._edge_targets[
+                self._edge_offsets[n.id] : self._edge_offsets[n.id + 1]
+            ]:
+                neighbours[n.id].add(end)
+                neighbours[end].add(n.id)
+        skipped = [
+            self._stop_offsets[self._stop_ids[n.id] + 1]
+            - self._stop_offsets[self._stop_ids[n.id]]
+            == 1
+            and len(neighbours[n.id]) == 2
+            and n.id not in neighbours[n.id]
+            for n in nodes
+        ]
+
+        self._search_offsets = array("I", [0])
+        self._search_edges = array("i")
+        self._shortcut_targets = array("I")
+        self._shortcut_path_offsets = array("I", [0])
+        self._shortcut_paths = array("I")
+        self._shortcut_trip_offsets = array("I", [0])
+        self._shortcut_departures = array("H")
+        self._shortcut_arrivals = array("H")
+        self._shortcut_earliest = array("I")
+        self._shortcuts_by_key = {}
+        self._bypassing_shortcuts = {}
+
+        for n in nodes:
+            for edge in range(self._edge_offsets[n.id], self._edge_offsets[n.id + 1]):
+                path = None
+                if not skipped[n.id] and skipped[self._edge_targets[edge]]:
+                    path = self._chain(
+                        n.id, self._edge_targets[edge], skipped, neighbours
+                    )
+                if path is None:
+                    self._search_edges.append(edge)
+                    continue
+
+                # Two chains between the same nodes keep the second one as is.
+                if (path[0], path[-1]) in self._shortcuts_by_key:
+                    self._search_edges.append(edge)
+                else:
+                    self._search_edges.append(~len(self._shortcut_targets))
+                    self._append_shortcut(path)
+            self._search_offsets.append(len(self._search_edges))
+        self.contracted = True
+
+    def _chain(
+        self, start: int, first: int, skipped: list[bool], neighbours: list[set[int]]
+    ) -> Optional[list[int]]:
+        path = [start, first]
+        while skipped[path[-1]]:
+            following = (neighbours[path[-1]] - {path[-2]}).pop()
+            if following in path:
+                return None
+            if self._find_edge_or_none(path[-1], following) is None:
+                return None
+            path.append(following)
+        return path
+
+    def _append_shortcut(self, path: list[int]):
+        shortcut = len(self._shortcut_targets)
+        self._shortcut_targets.append(path[-1])
+        self._shortcut_paths.extend(path)
+        self._shortcut_path_offsets.append(len(self._shortcut_paths))
+        self._shortcuts_by_key[(path[0], path[-1])] = shortcut
+        for i in path[1:-1]:
+            self._bypassing_shortcuts.setdefault(i, []).append(shortcut)
+
+        trips = []
+        first = self._find_edge(path[0], path[1])
+        for departure, time in zip(*self._edge_trips(first)):
+            for a, b in zip(path[1:], path[2:]):
+                trip = self._edge_trip(self._find_edge(a, b), time)
+                if trip is None:
+                    break
+                time = trip[1]
+            else:
+                trips.append((departure, time))
+        _append_sorted_trips(
+            trips,
+            self._shortcut_trip_offsets,
+            self._shortcut_departures,
+            self._shortcut_arrivals,
+            self._shortcut_earliest,
+        )
@@ -0,0 +1,82 @@
+from time import perf_counter
+from urllib.parse import urlencode
+import asyncio
+import random
+import sys
+
+from benchmark import percentiles, sample_queries
+from pathfinder import Pathfinder
+from server import JourneyServer, prewarm
+
+
+async def request(host: str, port: int, target: str) -> int:
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    await reader.read()
+    writer.close()
+    return status
+
+
+async def run_load(
+    host: str, port: int, targets: list[str], concurrency: int
+) -> list[float]:
+    # concurrency clients send the targets one after another until all are done.
+    pending = iter(targets)
+    timings: list[float] = []
+    statuses: dict[int, int] = {}
+
+    async def client():
+        for target in pending:
+            t = perf_counter()
+            status = await request(host, port, target)
+            timings.append((perf_counter() - t) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    print(f"  responses {dict(sorted(statuses.items()))}")
+    return timings
+
+
+def make_targets(pathfinder: Pathfinder, n: int, distinct: int) -> list[str]:
+    # n requests drawn from distinct queries, so popular ones repeat the way
+    # they would behind a web frontend.
+    queries = sample_queries(pathfinder, distinct)
+    rng = random.Random(1)
+    targets = []
+    for start, end, time in rng.choices(queries, k=n):
+        params = {"start": start, "end": end, "time": time, "km_cost": 0}
+        targets.append("/path?" + urlencode(params))
+    return targets
+
+
+async def main(csv_filename: str, n: int, distinct: int):
+    pathfinder = Pathfinder.from_csv(csv_filename, cache_size=0)
+    prewarm(pathfinder)
+    targets = make_targets(pathfinder, n, distinct)
+    print(f"load test: {n} requests over {distinct} distinct queries")
+    for concurrency in (1, 8, 32):
+        journeys = JourneyServer(pathfinder)
+        server = await journeys.start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        t = perf_counter()
+        timings = await run_load("127.0.0.1", port, targets, concurrency)
+        elapsed = perf_counter() - t
+        server.close()
+        await server.wait_closed()
+        journeys.close()
+        print(
+            f"  concurrency {concurrency:2}: {n / elapsed:6.1f} requests/s, "
+            f"{journeys.searches} searches, {journeys.coalesced} coalesced"
+        )
+        print(f"  {percentiles(timings)}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} csv_file [requests] [distinct_queries]")
+        sys.exit(1)
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    distinct = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    asyncio.run(main(sys.argv[1], n, distinct))
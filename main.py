@@ -1,30 +1,59 @@
 import sys
+from csa import ConnectionScan
+from raptor import Raptor
 from utils import pretty_print_bus_stops
-from pathfinder import Pathfinder, BusStop
+from pathfinder import Pathfinder, BusStop, SearchStats
 from time import time
 
 
 p = Pathfinder.from_csv("connection_graph.csv")
 
-start = input("Select starting point: ")
-if not p.stop_exists(start):
-    raise ValueError("Bus stop doesnt exist")
-end = input("Select destination: ")
-if not p.stop_exists(start):
-    raise ValueError("Bus stop doesnt exist")
-optimization = input("[t/p] t - time, p - transfers: ")
-if optimization not in ["t", "p"]:
+
+def input_stop(prompt: str) -> str:
+    stop = input(prompt)
+    while not p.stop_exists(stop):
+        suggestions = p.find_stop_names(stop)
+        if not suggestions:
+            raise ValueError("Bus stop doesnt exist")
+        print(f"Bus stop doesnt exist, did you mean: {', '.join(suggestions)}?")
+        stop = input(prompt)
+    return stop
+
+
+start = input_stop("Select starting point: ")
+end = input_stop("Select destination: ")
+optimization = input("[t/p/o] t - time, p - transfers, o - all options: ")
+if optimization not in ["t", "p", "o"]:
     raise ValueError("Invalid choice")
 arr_time = input("Starting time [13:54:00]: ")
-algorithm = input("[a/d] a - a*, d - dijkstra: ")
-if algorithm not in ["a", "d"]:
+
+if optimization == "o":
+    raptor = Raptor.from_graph(p.graph)
+    start_t = time()
+    journeys = raptor.find_journeys(start, end, arr_time)
+    time_ms = (time() - start_t) * 1000
+    for journey in journeys:
+        print(
+            f"Arrival at {journey.arrival} ({journey.duration} min), "
+            f"{journey.transfers} transfers:"
+        )
+        pretty_print_bus_stops(journey.bus_stops)
+    if not journeys:
+        print(f"Couldnt find the path")
+    print(f"Time taken: {time_ms:.2f}ms. Options: {len(journeys)}", file=sys.stderr)
+    sys.exit()
+
+algorithm = input(
+    "[a/d/b/c] a - a*, d - dijkstra, b - bidirectional, c - connection scan: "
+)
+if algorithm not in ["a", "d", "b", "c"]:
     raise ValueError("Invalid choice")
+if algorithm == "c" and optimization != "t":
+    raise ValueError("Connection scan can only optimize time")
 
-km_cost = 0
 minute_cost = 0
 transfer_cost = 0
-if algorithm == "a":
-    km_cost = 100000
+heuristic = "landmarks" if algorithm == "a" else "distance"
 if optimization == "t":
     minute_cost = 1
 else:
@@ -36,16 +65,26 @@ else:
 # optimization = "t"
 # algorithm = "d"
 
-start_t = time()
-result = p.find_path(
-    start,
-    end,
-    arr_time,
-    minute_cost=minute_cost,
-    transfer_cost=transfer_cost,
-    km_cost=km_cost,
-)
-end_t = time()
+if algorithm == "c":
+    connection_scan = ConnectionScan.from_graph(p.graph)
+    start_t = time()
+    result = connection_scan.find_path(start, end, arr_time)
+    end_t = time()
+else:
+    stats = SearchStats()
+    start_t = time()
+    result = p.find_path(
+        start,
+        end,
+        arr_time,
+        minute_cost=minute_cost,
+        transfer_cost=transfer_cost,
+        km_cost=0,
+        heuristic=heuristic,
+        algorithm="bidirectional" if algorithm == "b" else "astar",
+        stats=stats,
+    )
+    end_t = time()
 time_ms = (end_t - start_t) * 1000
 
 
@@ -56,3 +95,9 @@ if result:
 else:
     print(f"Time taken: {time_ms:.2f}ms. Path not found", file=sys.stderr)
     print(f"Couldnt find the path")
+if algorithm != "c":
+    print(
+        f"Expanded {stats.expanded} nodes, relaxed {stats.relaxed} edges and "
+        f"{stats.transfers} transfers, {stats.lookups} trip lookups",
+        file=sys.stderr,
+    )
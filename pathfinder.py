@@ -1,27 +1,40 @@
-from dataclasses import dataclass
-from typing import Optional, Tuple
+from array import array
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from threading import Lock, local
+from time import perf_counter
+from typing import TYPE_CHECKING, Iterable, Iterator, NamedTuple, Optional, Tuple
+from bounds import GeodesicBound, LandmarkTable
+from transfers import HUB, WALK, StopHubs, TransferModel
 from graph import (
-    Connection,
     ExpandedGraph,
     Node,
     RowEntry,
-    to_row_entry,
-    to_datetime,
+    TimetableChanges,
+    TimetableUpdate,
+    format_minutes,
+    to_minutes,
 )
-from datetime import datetime
+import heapq
+import itertools
 import math
 
+if TYPE_CHECKING:
+    from csa import ConnectionScan
+    from transfer_patterns import Pattern, TransferPatterns
 
-def difference_in_minutes(a: datetime, b: datetime):
-    c = b - a
-    return math.floor(c.total_seconds() / 60)
+
+HEURISTICS = ("distance", "geodesic", "landmarks")
+ALGORITHMS = ("astar", "bidirectional")
 
 
 def cartesian(a: Tuple[float, float], b: Tuple[float, float]):
     return math.sqrt((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2)
 
 
-@dataclass
+@dataclass(frozen=True)
 class BusStop:
     departs_from: str
     departure: str
@@ -30,28 +43,230 @@ class BusStop:
     bus_n: str
 
 
+class PathResult:
+    # A path found by find_paths. Hops are kept as flat (from node id, to node
+    # id, departure, arrival) ints and BusStop strings are only formatted when
+    # bus_stops() is called.
+    __slots__ = ("cost", "_graph", "_hops", "_bus_stops")
+
+    cost: float
+
+    def __init__(
+        self,
+        cost: float,
+        graph: ExpandedGraph,
+        hops: array,
+        bus_stops: Optional[list[BusStop]] = None,
+    ):
+        self.cost = cost
+        self._graph = graph
+        self._hops = hops
+        self._bus_stops = bus_stops
+
+    def __len__(self) -> int:
+        if self._bus_stops is not None:
+            return len(self._bus_stops)
+        return len(self._hops) // 4
+
+    def bus_stops(self) -> list[BusStop]:
+        if self._bus_stops is None:
+            hops = self._hops
+            node = self._graph.get_node_by_id
+            self._bus_stops = [
+                BusStop(
+                    departs_from=node(hops[i]).bus_stop_name,
+                    departure=format_minutes(hops[i + 2]),
+                    arrives_to=node(hops[i + 1]).bus_stop_name,
+                    arrival=format_minutes(hops[i + 3]),
+                    bus_n=node(hops[i + 1]).bus_n,
+                )
+                for i in range(0, len(hops), 4)
+            ]
+        return list(self._bus_stops)
+
+
 @dataclass
 class SavedConnection:
     previous: Node
-    connection: Optional[Connection]
+    trip: Optional[Tuple[int, int]]
 
     def __hash__(self) -> int:
         return (self.previous).__hash__()
 
 
-class Pathfinder:
-    _graph: ExpandedGraph
-    _minute_cost: float
-    _tranfer_cost: float
-    _km_cost: float
+@dataclass(frozen=True)
+class PathQuery:
+    start: str
+    end: str
+    time: str
+    minute_cost: float = 1
+    transfer_cost: float = 5
+    km_cost: float = 1
+    starting_line: Optional[str] = None
+    heuristic: str = "distance"
+    algorithm: str = "astar"
+
+
+@dataclass
+class SearchStats:
+    # Work done by one find_path search, times are in seconds. Only collected
+    # when asked for, a search without stats skips all of the counting.
+    expanded: int = 0
+    relaxed: int = 0
+    transfers: int = 0
+    pushes: int = 0
+    pops: int = 0
+    lookups: int = 0
+    setup_time: float = 0
+    search_time: float = 0
+    reconstruction_time: float = 0
+    cached: bool = False
+
 
-    _starting_time: datetime
-    _target_coords: Tuple[float, float]
-    _target_bus_stop: str
-    _scores: dict[Node, Tuple[float, datetime]]
+StatsHook = Callable[[PathQuery, SearchStats], None]
 
-    def __init__(self, row_entries: list[RowEntry]) -> None:
-        self._graph = ExpandedGraph(row_entries)
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+@dataclass
+class BackwardContext:
+    # Lower bounds on the cost left from a node to the target, found by
+    # Dijkstra over reversed edges weighted with their shortest trip.
+    bounds: dict[Node, float] = field(default_factory=dict)
+    settled: set[Node] = field(default_factory=set)
+    open: list[Tuple[float, int, Node]] = field(default_factory=list)
+    push_counter: Iterator[int] = field(default_factory=itertools.count)
+    # Lowest bound left open, no unsettled node can be closer than this.
+    frontier: float = 0
+
+
+class SearchLabels:
+    # Score, arrival, parent and the trip from it of the nodes a search has
+    # reached, in lists indexed by node id, hubs numbered after the graph's
+    # own nodes. An entry only counts when its stamp is the current one, so
+    # reset() starts the next search without clearing anything and one
+    # instance serves every search of a thread.
+    __slots__ = ("stamp", "scores", "arrivals", "parents", "trips", "stamps", "visits")
+
+    stamp: int
+    scores: list[float]
+    arrivals: array
+    parents: list[Optional[Node]]
+    trips: list[Optional[Tuple[int, int]]]
+    stamps: array
+    visits: array
+
+    def __init__(self, size: int):
+        self.stamp = 0
+        self.scores = [math.inf] * size
+        self.arrivals = array("i", bytes(4 * size))
+        self.parents = [None] * size
+        self.trips = [None] * size
+        self.stamps = array("I", bytes(4 * size))
+        self.visits = array("I", bytes(4 * size))
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def reset(self):
+        self.stamp += 1
+        if self.stamp == 2**32:
+            self.stamp = 1
+            self.stamps = array("I", bytes(4 * len(self)))
+            self.visits = array("I", bytes(4 * len(self)))
+
+    def parent(self, node: Node) -> Optional[SavedConnection]:
+        if self.stamps[node.id] != self.stamp:
+            return None
+        previous = self.parents[node.id]
+        if previous is None:
+            return None
+        return SavedConnection(previous, self.trips[node.id])
+
+    def visited(self, node: Node) -> bool:
+        return self.visits[node.id] == self.stamp
+
+
+@dataclass
+class SearchContext:
+    starting_time: int
+    target_bus_stop: str
+    target_coords: Tuple[float, float]
+    minute_cost: float
+    transfer_cost: float
+    km_cost: float
+    heuristic: str = "distance"
+    # Left unset by contexts that never search, like the ones only used to
+    # price a journey.
+    labels: Optional[SearchLabels] = None
+
+    bounds: dict[str, float] = field(default_factory=dict)
+    open: list[Tuple[float, int, int, Node, float]] = field(default_factory=list)
+    push_counter: Iterator[int] = field(default_factory=itertools.count)
+    # Targets that contraction hid inside a shortcut, by the node it starts at.
+    bypassed_targets: dict[Node, list[Node]] = field(default_factory=dict)
+    # Bounds of a bidirectional search once both halves have met.
+    backward: Optional[BackwardContext] = None
+    stats: Optional[SearchStats] = None
+
+
+class Pathfinder:
+    _graph: ExpandedGraph
+    _cache: OrderedDict[PathQuery, Optional[Tuple[tuple[BusStop, ...], float]]]
+    _cache_size: int
+    # Graph generation the cached results were found on.
+    _cache_generation: int
+    _cache_hits: int
+    _cache_misses: int
+    _cache_lock: Lock
+    _connection_scan: Optional["ConnectionScan"]
+    _geodesic_bound: Optional[GeodesicBound]
+    _landmark_table: Optional[LandmarkTable]
+    _transfer_patterns: Optional["TransferPatterns"]
+    _hubs: Optional[StopHubs]
+    _stats_hook: Optional[StatsHook]
+    # The SearchLabels of each thread.
+    _local: local
+
+    def __init__(
+        self,
+        row_entries: Iterable[RowEntry] = (),
+        graph: Optional[ExpandedGraph] = None,
+        cache_size: int = 4096,
+        transfers: Optional[TransferModel] = None,
+        stats_hook: Optional[StatsHook] = None,
+    ) -> None:
+        self._graph = graph if graph is not None else ExpandedGraph(row_entries)
+        self._hubs = None
+        if transfers is not None:
+            if self._graph.contracted:
+                raise ValueError("Walking transfers need a graph without shortcuts")
+            self._hubs = StopHubs(self._graph, transfers)
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_generation = self._graph.generation
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._cache_lock = Lock()
+        self._connection_scan = None
+        self._geodesic_bound = None
+        self._landmark_table = None
+        self._transfer_patterns = None
+        self._stats_hook = stats_hook
+        self._local = local()
+
+    def set_stats_hook(self, hook: Optional[StatsHook]):
+        # hook(query, stats) is called after every search find_path runs.
+        self._stats_hook = hook
+
+    @property
+    def graph(self) -> ExpandedGraph:
+        return self._graph
 
     def find_path(
         self,
@@ -62,133 +277,713 @@ class Pathfinder:
         transfer_cost: float = 5,
         km_cost: float = 1,
         starting_line: Optional[str] = None,
+        heuristic: str = "distance",
+        algorithm: str = "astar",
+        stats: Optional[SearchStats] = None,
     ):
-        self._graph.reset()
-        self._minute_cost = minute_cost
-        self._tranfer_cost = transfer_cost
-        self._km_cost = km_cost
-
-        self._starting_time = to_datetime(time)
-        self._target_bus_stop = end
-        self._saved_parents = {}
-        self._init_scores(start, starting_line)
-        target_node = self._graph.get_nodes_by_stop_name(end)[0]
-        self._target_coords = (target_node.longitude, target_node.latitude)
+        query = PathQuery(
+            start,
+            end,
+            time,
+            minute_cost,
+            transfer_cost,
+            km_cost,
+            starting_line,
+            heuristic,
+            algorithm,
+        )
+        if stats is None and self._stats_hook is not None:
+            stats = SearchStats()
+        with self._cache_lock:
+            self._check_generation()
+            generation = self._cache_generation
+            cached = self._cache_size > 0 and query in self._cache
+            if cached:
+                self._cache_hits += 1
+                self._cache.move_to_end(query)
+                result = self._cache[query]
+            elif self._cache_size > 0:
+                self._cache_misses += 1
+        if self._cache_size <= 0:
+            return self._find_path(query, stats)
+        if cached:
+            if stats is not None:
+                stats.cached = True
+                self._report_stats(query, stats)
+            return self._copy_result(result)
+
+        result = self._find_path(query, stats)
+        with self._cache_lock:
+            # Results are kept as tuples of frozen BusStops, so no caller can
+            # change what the next one gets.
+            if result is not None:
+                result = tuple(result[0]), result[1]
+            if generation == self._graph.generation:
+                self._cache[query] = result
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return self._copy_result(result)
+
+    def cache_info(self) -> CacheInfo:
+        with self._cache_lock:
+            return CacheInfo(
+                self._cache_hits, self._cache_misses, self._cache_size, len(self._cache)
+            )
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+            self._cache_hits = 0
+            self._cache_misses = 0
+
+    def apply_updates(self, updates: Iterable[TimetableUpdate]) -> TimetableChanges:
+        # Changes the timetable in place and drops the cached results the
+        # changes can affect, see _is_stale. Structures built from the whole
+        # timetable are rebuilt on their next use.
+        with self._cache_lock:
+            self._check_generation()
+        changes = self._graph.apply_updates(updates)
+        self._connection_scan = None
+        self._geodesic_bound = None
+        self._landmark_table = None
+        with self._cache_lock:
+            self._cache_generation = self._graph.generation
+            stale = [
+                query
+                for query, result in self._cache.items()
+                if self._is_stale(query, result, changes)
+            ]
+            for query in stale:
+                del self._cache[query]
+        return changes
+
+    def _check_generation(self):
+        # Any change to the graph not made through apply_updates, like
+        # remove_node, drops every cached result. Called with the lock held.
+        if self._cache_generation != self._graph.generation:
+            self._cache.clear()
+            self._cache_generation = self._graph.generation
+            self._connection_scan = None
+            self._geodesic_bound = None
+            self._landmark_table = None
 
-        winner = self._run()
+    @staticmethod
+    def _is_stale(
+        query: PathQuery,
+        result: Optional[Tuple[list[BusStop], float]],
+        changes: TimetableChanges,
+    ) -> bool:
+        # Cancelled, delayed and closed parts of the timetable only matter to
+        # results that ride them. An added or moved trip can only give a
+        # cheaper result when it leaves after the query time and arrives
+        # before the cached cost in minutes has passed.
+        if changes.reopened:
+            return True
+        if result is not None:
+            for b in result[0]:
+                if (
+                    (b.bus_n, b.departs_from, b.arrives_to) in changes.edges
+                    or b.departs_from in changes.closed
+                    or b.arrives_to in changes.closed
+                ):
+                    return True
+        time = to_minutes(query.time)
+        for departure, arrival in changes.trips:
+            if departure < time:
+                continue
+            if result is None or query.minute_cost <= 0:
+                return True
+            if arrival < time + result[1] / query.minute_cost:
+                return True
+        return False
 
+    @staticmethod
+    def _copy_result(result):
+        if result is None:
+            return None
+        stops, cost = result
+        return list(stops), cost
+
+    def _find_path(self, query: PathQuery, stats: Optional[SearchStats] = None):
+        if query.heuristic not in HEURISTICS:
+            raise ValueError(f"Unknown heuristic {query.heuristic}")
+        if query.algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown algorithm {query.algorithm}")
+        if query.algorithm == "bidirectional":
+            t = perf_counter()
+            result = self._find_path_bidirectional(query, stats)
+            if stats is not None:
+                stats.search_time = perf_counter() - t
+                self._report_stats(query, stats)
+            return result
+        if stats is None:
+            ctx = self._start_search(query)
+            winner = self._run(ctx)
+            if winner is None:
+                return None
+            stops = self._prepare_results(winner, ctx.labels)
+            return stops, self._calculate_cost(ctx, stops)
+
+        t = perf_counter()
+        ctx = self._start_search(query, stats)
+        setup_done = perf_counter()
+        stats.setup_time = setup_done - t
+        winner = self._run(ctx)
+        search_done = perf_counter()
+        stats.search_time = search_done - setup_done
+        result = None
         if winner is not None:
-            stops = self._prepare_results(winner, self._saved_parents)
-            cost = self._calculate_cost(stops)
-            return stops, cost
-        else:
+            stops = self._prepare_results(winner, ctx.labels)
+            result = stops, self._calculate_cost(ctx, stops)
+        stats.reconstruction_time = perf_counter() - search_done
+        self._report_stats(query, stats)
+        return result
+
+    def _start_search(
+        self, query: PathQuery, stats: Optional[SearchStats] = None
+    ) -> SearchContext:
+        # The context of an A* run for query, with its start nodes open.
+        target_node = self._graph.get_nodes_by_stop_name(query.end)[0]
+        ctx = SearchContext(
+            starting_time=to_minutes(query.time),
+            target_bus_stop=query.end,
+            target_coords=(target_node.longitude, target_node.latitude),
+            minute_cost=query.minute_cost,
+            transfer_cost=query.transfer_cost,
+            km_cost=query.km_cost,
+            heuristic=query.heuristic,
+            labels=self._search_labels(),
+            stats=stats,
+        )
+        self._init_scores(ctx, query.start, query.starting_line)
+        self._init_bypassed_targets(ctx, [query.end])
+        return ctx
+
+    def _search_labels(self) -> SearchLabels:
+        # The labels of this thread, reset for a new search. They are only
+        # allocated again when the number of nodes changes.
+        size = self._graph.node_count()
+        if self._hubs is not None:
+            size += self._hubs.count()
+        labels = getattr(self._local, "labels", None)
+        if labels is None or len(labels) != size:
+            labels = self._local.labels = SearchLabels(size)
+        labels.reset()
+        return labels
+
+    def _report_stats(self, query: PathQuery, stats: SearchStats):
+        if self._stats_hook is not None:
+            self._stats_hook(query, stats)
+
+    def _find_path_bidirectional(
+        self, query: PathQuery, stats: Optional[SearchStats] = None
+    ):
+        # A forward search as in find_path, ordered by cost alone, and a
+        # backward search from the target take turns until one settles a node
+        # the other has settled. The backward search runs over reversed edges
+        # weighted with their shortest trip and ignores waiting, but charges
+        # transfers, so its costs bound the cost left to the target from
+        # below. From the meeting on the forward search goes on as A* with
+        # those bounds. They are consistent and labels are ordered the same
+        # way in both searches, so it stops on the journey find_path returns
+        # as soon as the target comes off the open list.
+        if self._graph.contracted or self._hubs is not None:
+            raise ValueError("Bidirectional search needs a graph without shortcuts")
+        start, end = query.start, query.end
+        ctx = SearchContext(
+            starting_time=to_minutes(query.time),
+            target_bus_stop=end,
+            target_coords=(0, 0),
+            minute_cost=query.minute_cost,
+            transfer_cost=query.transfer_cost,
+            km_cost=0,
+            labels=self._search_labels(),
+            stats=stats,
+        )
+        self._init_scores(ctx, start, query.starting_line)
+        back = BackwardContext()
+        for n in self._graph.get_nodes_by_stop_name(end):
+            if not n.removed:
+                self._set_bound(back, n, 0)
+
+        met = None
+        while met is None:
+            node = self._get_best_node(ctx)
+            if node is None:
+                return None
+            if node.bus_stop_name == end:
+                return self._bidirectional_results(ctx, node)
+            self._discover_node(ctx, node)
+            if node in back.settled:
+                met = node
+            settled = self._settle_backward(ctx, back)
+            if settled is None:
+                break
+            if ctx.labels.visited(settled):
+                met = settled
+
+        back.frontier = back.open[0][0] if back.open else math.inf
+        ctx.backward = back
+        ctx.open = [
+            (score + self._lower_bound(ctx, node), arrival_time, counter, node, score)
+            for _, arrival_time, counter, node, score in ctx.open
+        ]
+        heapq.heapify(ctx.open)
+        winner = self._run(ctx)
+        if winner is None:
             return None
+        return self._bidirectional_results(ctx, winner)
+
+    def _bidirectional_results(self, ctx: SearchContext, winner: Node):
+        stops = self._prepare_results(winner, ctx.labels)
+        return stops, self._calculate_cost(ctx, stops)
+
+    def _settle_backward(
+        self, ctx: SearchContext, back: BackwardContext
+    ) -> Optional[Node]:
+        while back.open:
+            bound, _, node = heapq.heappop(back.open)
+            if node in back.settled or bound != back.bounds[node]:
+                continue
+            back.settled.add(node)
+            for n, minutes in self._graph.get_reverse_neighbours(node):
+                self._set_bound(back, n, bound + minutes * ctx.minute_cost)
+            if node.bus_stop_name != ctx.target_bus_stop:
+                for n in self._graph.get_nodes_by_stop_name(node.bus_stop_name):
+                    if n != node and not n.removed:
+                        self._set_bound(back, n, bound + ctx.transfer_cost)
+            return node
+        return None
+
+    def _set_bound(self, back: BackwardContext, node: Node, bound: float):
+        if node in back.settled or bound >= back.bounds.get(node, math.inf):
+            return
+        back.bounds[node] = bound
+        heapq.heappush(back.open, (bound, next(back.push_counter), node))
+
+    def find_paths_concurrently(self, queries: list[PathQuery], workers: int = 4):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda q: self.find_path(**asdict(q)), queries))
+
+    def find_paths(self, queries: Iterable[PathQuery]) -> list[Optional[PathResult]]:
+        # find_path for every query, without the cache. The searches share the
+        # label arrays of this thread like any other. On a plain graph a result
+        # keeps its hops as node ids and BusStops are only formatted when
+        # bus_stops() is called.
+        graph = self._graph
+        plain = self._hubs is None and not graph.contracted
+        results = []
+        for query in queries:
+            if query.algorithm != "astar" or not plain:
+                result = self._find_path(query)
+                if result is not None:
+                    result = PathResult(result[1], graph, array("i"), result[0])
+                results.append(result)
+                continue
+            if query.heuristic not in HEURISTICS:
+                raise ValueError(f"Unknown heuristic {query.heuristic}")
+
+            ctx = self._start_search(query)
+            winner = self._run(ctx)
+            if winner is None:
+                results.append(None)
+                continue
+            hops = array("i")
+            lines = set()
+            current = winner
+            c = ctx.labels.parent(current)
+            while c is not None:
+                if c.trip:
+                    hops.extend((c.trip[1], c.trip[0], current.id, c.previous.id))
+                    lines.add(current.bus_n)
+                current = c.previous
+                c = ctx.labels.parent(current)
+            hops.reverse()
+            cost = max(len(lines) - 1, 0) * query.transfer_cost
+            if hops:
+                cost += (hops[-1] - ctx.starting_time) * query.minute_cost
+            results.append(PathResult(cost, graph, hops))
+        return results
+
+    def find_paths_from(
+        self,
+        start: str,
+        time: str,
+        targets: Optional[Iterable[str]] = None,
+        minute_cost: float = 1,
+        transfer_cost: float = 5,
+        starting_line: Optional[str] = None,
+    ) -> dict[str, Tuple[list[BusStop], float]]:
+        # One Dijkstra run that keeps going until every target stop (or every
+        # reachable stop, without targets) is settled. There is no single
+        # target to aim at, so the distance heuristic is not used.
+        ctx = SearchContext(
+            starting_time=to_minutes(time),
+            target_bus_stop=start,
+            target_coords=(0, 0),
+            minute_cost=minute_cost,
+            transfer_cost=transfer_cost,
+            km_cost=0,
+            labels=self._search_labels(),
+        )
+        self._init_scores(ctx, start, starting_line)
+        remaining = set(targets) if targets is not None else None
+        self._init_bypassed_targets(ctx, remaining)
+
+        winners: dict[str, Node] = {}
+        best = self._get_best_node(ctx)
+        while best is not None:
+            stop = best.bus_stop_name
+            if stop not in winners and (remaining is None or stop in remaining):
+                winners[stop] = best
+                if remaining is not None:
+                    remaining.discard(stop)
+                    if not remaining:
+                        break
+            self._discover_node(ctx, best)
+            best = self._get_best_node(ctx)
+
+        results = {}
+        for stop, winner in winners.items():
+            stops = self._prepare_results(winner, ctx.labels)
+            if stops:
+                results[stop] = (stops, self._calculate_cost(ctx, stops))
+        return results
+
+    def find_profile(
+        self, start: str, end: str, from_time: str, to_time: str
+    ) -> list[Tuple[list[BusStop], float]]:
+        # Every journey worth taking between from_time and to_time, ordered by
+        # departure: each one leaves later or arrives earlier than the others.
+        # Costs are minutes from departure to arrival with free transfers.
+        from csa import ConnectionScan
+
+        if self._connection_scan is None:
+            self._connection_scan = ConnectionScan.from_graph(self._graph)
+        return self._connection_scan.find_profile(start, end, from_time, to_time)
+
+    def use_transfer_patterns(self, patterns: Optional["TransferPatterns"]):
+        self._transfer_patterns = patterns
+
+    def find_path_by_patterns(
+        self,
+        start: str,
+        end: str,
+        time: str,
+        minute_cost: float = 1,
+        transfer_cost: float = 5,
+    ):
+        # Only follows the precomputed line sequences for this pair, falling
+        # back to find_path for pairs or costs they were not built for.
+        patterns = None
+        if self._transfer_patterns is not None:
+            patterns = self._transfer_patterns.get(
+                start, end, minute_cost, transfer_cost
+            )
+        if patterns:
+            ctx = SearchContext(
+                starting_time=to_minutes(time),
+                target_bus_stop=end,
+                target_coords=(0, 0),
+                minute_cost=minute_cost,
+                transfer_cost=transfer_cost,
+                km_cost=0,
+            )
+            best = None
+            for pattern in patterns:
+                stops = self._follow_pattern(ctx, pattern)
+                if stops:
+                    cost = self._calculate_cost(ctx, stops)
+                    if best is None or cost < best[1]:
+                        best = stops, cost
+            if best is not None:
+                return best
+        return self.find_path(start, end, time, minute_cost, transfer_cost, 0)
 
-    def _run(self):
-        best = self._get_best_node()
-        while best != None:
-            if best.bus_stop_name == self._target_bus_stop:
+    def _follow_pattern(
+        self, ctx: SearchContext, pattern: "Pattern"
+    ) -> Optional[list[BusStop]]:
+        time = ctx.starting_time
+        bus_stops = []
+        for line, stops in pattern:
+            for a, b in zip(stops, stops[1:]):
+                try:
+                    trip = self._graph.get_best_trip(
+                        self._graph.get_node(a, line),
+                        self._graph.get_node(b, line),
+                        time,
+                    )
+                except ValueError:
+                    return None
+                if trip is None:
+                    return None
+                bus_stops.append(
+                    BusStop(
+                        departs_from=a,
+                        arrives_to=b,
+                        bus_n=line,
+                        departure=format_minutes(trip[0]),
+                        arrival=format_minutes(trip[1]),
+                    )
+                )
+                time = trip[1]
+        return bus_stops
+
+    def _run(self, ctx: SearchContext):
+        best = self._get_best_node(ctx)
+        while best is not None:
+            if best.bus_stop_name == ctx.target_bus_stop:
                 return best
             else:
-                self._discover_node(best)
-                best = self._get_best_node()
-
-    def _discover_node(self, node: Node):
-        for n in self._graph.get_neighbouring_nodes(node):
+                self._discover_node(ctx, best)
+                best = self._get_best_node(ctx)
+
+    def _discover_node(self, ctx: SearchContext, node: Node):
+        # Rides to the next stop of the line and changes to other lines at the
+        # stop, with the targets shortcuts skip over ridden to like the next
+        # stop. Every label goes through _relax.
+        labels = ctx.labels
+        visits, stamp = labels.visits, labels.stamp
+        visits[node.id] = stamp
+        stats = ctx.stats
+        if stats is not None:
+            stats.expanded += 1
+        hubs = self._hubs
+        if hubs is not None and node.bus_n == HUB:
+            self._discover_hub(ctx, node)
+            return
+
+        graph = self._graph
+        score, arrival_time = labels.scores[node.id], labels.arrivals[node.id]
+        minute_cost, transfer_cost = ctx.minute_cost, ctx.transfer_cost
+        distance_cost = ctx.heuristic == "distance" and ctx.km_cost
+        neighbours = graph.get_neighbouring_nodes(node, hubs is None)
+        if ctx.bypassed_targets:
+            neighbours += ctx.bypassed_targets.get(node, ())
+        for n in neighbours:
+            if visits[n.id] == stamp:
+                continue
             if n.bus_stop_name != node.bus_stop_name:
-                self._discover_regular_connection(node, n)
+                if stats is not None:
+                    stats.relaxed += 1
+                    stats.lookups += 1
+                trip = graph.get_best_trip(node, n, arrival_time)
+                if not trip:
+                    continue
+                total_cost = score + (trip[1] - arrival_time) * minute_cost
+                reached = trip[1]
             else:
-                self._discover_transfer_connection(node, n)
-
-        self._graph.remove_node(node)
-        self._scores.pop(node)
-
-    def _discover_regular_connection(self, a: Node, b: Node):
-        score, arrival_time = self._scores[a]
-
-        connection = self._graph.get_best_connection(a, b, arrival_time)
-        if connection:
-            minutes = difference_in_minutes(arrival_time, connection.arrives_at)
-            heuristic_cost = self._heuristic_cost(b)
-            total_cost = score + minutes * self._minute_cost + heuristic_cost
-            if total_cost < self._scores[b][0]:
-                self._scores[b] = (total_cost, connection.arrives_at)
-                self._saved_parents[b] = SavedConnection(a, connection)
-
-    def _discover_transfer_connection(self, a: Node, b: Node):
-        score, arrival_time = self._scores[a]
-        heuristic_cost = self._heuristic_cost(b)
-        total_cost = score + self._tranfer_cost + heuristic_cost
-        if total_cost < self._scores[b][0]:
-            self._scores[b] = (total_cost, arrival_time)
-            self._saved_parents[b] = SavedConnection(a, None)
-
-    def _heuristic_cost(self, a: Node):
+                if stats is not None:
+                    stats.transfers += 1
+                trip = None
+                total_cost = score + transfer_cost
+                reached = arrival_time
+            if distance_cost:
+                total_cost += self._heuristic_cost(ctx, n)
+            self._relax(ctx, n, total_cost, reached, node, trip)
+        if hubs is not None:
+            hub = hubs.hub(node.bus_stop_name)
+            if not labels.visited(hub):
+                self._discover_move(ctx, node, hub, 0, 0)
+
+    def _discover_hub(self, ctx: SearchContext, hub: Node):
+        # Boarding any line costs a transfer and the time needed to change,
+        # walking to a nearby stop costs the minutes it takes.
+        model = self._hubs.model
+        for n in self._graph.get_nodes_by_stop_name(hub.bus_stop_name):
+            if not ctx.labels.visited(n) and not n.removed:
+                cost = ctx.transfer_cost + model.change_minutes * ctx.minute_cost
+                self._discover_move(ctx, hub, n, cost, model.change_minutes)
+        for n, minutes in self._hubs.walks(hub.bus_stop_name):
+            if not ctx.labels.visited(n) and not self._graph.is_closed(n.bus_stop_name):
+                self._discover_move(ctx, hub, n, minutes * ctx.minute_cost, minutes)
+
+    def _discover_move(
+        self, ctx: SearchContext, a: Node, b: Node, cost: float, minutes: int
+    ):
+        score, arrival_time = ctx.labels.scores[a.id], ctx.labels.arrivals[a.id]
+        if ctx.stats is not None:
+            ctx.stats.relaxed += 1
+        total_cost = score + cost + self._heuristic_cost(ctx, b)
+        trip = None
+        if a.bus_n == HUB and b.bus_n == HUB:
+            trip = (arrival_time, arrival_time + minutes)
+        self._relax(ctx, b, total_cost, arrival_time + minutes, a, trip)
+
+    def _heuristic_cost(self, ctx: SearchContext, a: Node):
+        # The "distance" heuristic is added to the score of every node on the
+        # path, so it weighs distance against time instead of bounding it.
+        if ctx.heuristic != "distance" or not ctx.km_cost:
+            return 0
         coords = (a.longitude, a.latitude)
-        return cartesian(coords, self._target_coords) * self._km_cost
-
-    def _prepare_results(
-        self, winner: Node, saved_parents: dict[Node, SavedConnection]
-    ) -> list[BusStop]:
+        return cartesian(coords, ctx.target_coords) * ctx.km_cost
+
+    def _lower_bound(self, ctx: SearchContext, a: Node) -> float:
+        # Admissible A* estimate, only used to order the open list.
+        if ctx.backward is not None:
+            if a in ctx.backward.settled:
+                return ctx.backward.bounds[a]
+            return ctx.backward.frontier
+        if ctx.heuristic == "distance":
+            return 0
+        stop = a.bus_stop_name
+        bound = ctx.bounds.get(stop)
+        if bound is None:
+            if self._geodesic_bound is None:
+                self._geodesic_bound = GeodesicBound(self._graph)
+            minutes = self._geodesic_bound.lower_bound(stop, ctx.target_bus_stop)
+            # Landmark times only know about rides, not walks.
+            if ctx.heuristic == "landmarks" and self._hubs is None:
+                if self._landmark_table is None:
+                    self._landmark_table = LandmarkTable(self._graph)
+                landmarks = self._landmark_table.lower_bound(stop, ctx.target_bus_stop)
+                minutes = max(minutes, landmarks)
+            bound = ctx.bounds[stop] = minutes * ctx.minute_cost
+        return bound
+
+    def precompute_bounds(self, landmarks: int = 8):
+        self._geodesic_bound = GeodesicBound(self._graph)
+        self._landmark_table = LandmarkTable(self._graph, landmarks)
+
+    def _prepare_results(self, winner: Node, labels: SearchLabels) -> list[BusStop]:
         current = winner
         bus_stops = []
-        while current in saved_parents:
-            c = saved_parents[current]
-            if c.connection:
+        c = labels.parent(current)
+        while c is not None:
+            if c.trip and current.bus_n == HUB:
                 bus_stops.append(
                     BusStop(
                         departs_from=c.previous.bus_stop_name,
                         arrives_to=current.bus_stop_name,
-                        bus_n=current.bus_n,
-                        departure=c.connection.departs_at.strftime("%H:%M"),
-                        arrival=c.connection.arrives_at.strftime("%H:%M"),
+                        bus_n=WALK,
+                        departure=format_minutes(c.trip[0]),
+                        arrival=format_minutes(c.trip[1]),
                     )
                 )
-            current = saved_parents[current].previous
+            elif c.trip:
+                legs = self._graph.unpack_trip(c.previous, current, c.trip)
+                for a, b, trip in reversed(legs):
+                    bus_stops.append(
+                        BusStop(
+                            departs_from=a.bus_stop_name,
+                            arrives_to=b.bus_stop_name,
+                            bus_n=b.bus_n,
+                            departure=format_minutes(trip[0]),
+                            arrival=format_minutes(trip[1]),
+                        )
+                    )
+            current = c.previous
+            c = labels.parent(current)
         bus_stops.reverse()
         return bus_stops
 
-    def _calculate_cost(self, bus_stops: list[BusStop]):
+    def _calculate_cost(self, ctx: SearchContext, bus_stops: list[BusStop]):
         lines_set = set()
         for b in bus_stops:
-            lines_set.add(b.bus_n)
-        transfers = len(lines_set) - 1
-        total_time = difference_in_minutes(
-            self._starting_time, to_datetime(bus_stops[-1].arrival)
-        )
-        cost = transfers * self._tranfer_cost + total_time * self._minute_cost
+            if b.bus_n != WALK:
+                lines_set.add(b.bus_n)
+        transfers = max(len(lines_set) - 1, 0)
+        total_time = to_minutes(bus_stops[-1].arrival) - ctx.starting_time
+        cost = transfers * ctx.transfer_cost + total_time * ctx.minute_cost
         return cost
 
-    def _init_scores(self, start: str, starting_line=None):
+    def _init_bypassed_targets(
+        self, ctx: SearchContext, stops: Optional[Iterable[str]]
+    ):
+        if not self._graph.contracted:
+            return
+        if stops is None:
+            nodes = self._graph.get_nodes()
+        else:
+            nodes = [n for s in stops for n in self._graph.get_nodes_by_stop_name(s)]
+        for n in nodes:
+            if n.removed:
+                continue
+            for head in self._graph.get_shortcut_heads(n):
+                if not head.removed:
+                    ctx.bypassed_targets.setdefault(head, []).append(n)
+
+    def _init_scores(self, ctx: SearchContext, start: str, starting_line=None):
         if starting_line:
             starting_nodes = [self._graph.get_node(start, starting_line)]
         else:
             starting_nodes = self._graph.get_nodes_by_stop_name(start)
-        scores: dict[Node, Tuple[float, datetime]] = {}
-        for n in self._graph.get_nodes():
-            scores[n] = (100000000, self._starting_time)
         for n in starting_nodes:
-            scores[n] = (0, self._starting_time)
-        self._scores = scores
-
-    def _get_best_node(self) -> Optional[Node]:
-        best_node = None
-        best_score = 1000000000
+            if not n.removed:
+                self._relax(ctx, n, 0, ctx.starting_time)
+        if self._hubs is not None and not starting_line:
+            if not self._graph.is_closed(start):
+                self._relax(ctx, self._hubs.hub(start), 0, ctx.starting_time)
 
-        for node, (score, _) in self._scores.items():
-            if score < best_score:
-                best_node = node
-                best_score = score
-        return best_node
+    def _relax(
+        self,
+        ctx: SearchContext,
+        node: Node,
+        score: float,
+        arrival_time: int,
+        previous: Optional[Node] = None,
+        trip: Optional[Tuple[int, int]] = None,
+    ):
+        # Labels are ordered by score and then by arrival, so a node ends up
+        # with the same label whichever order the search settles nodes in.
+        # The label is only taken, and the node pushed, when it is better.
+        labels = ctx.labels
+        i = node.id
+        if labels.stamps[i] == labels.stamp:
+            old = labels.scores[i]
+            if score > old or (score == old and arrival_time >= labels.arrivals[i]):
+                return
+        labels.stamps[i] = labels.stamp
+        labels.scores[i] = score
+        labels.arrivals[i] = arrival_time
+        labels.parents[i] = previous
+        labels.trips[i] = trip
+        priority = score
+        if ctx.backward is not None or ctx.heuristic != "distance":
+            priority += self._lower_bound(ctx, node)
+        entry = (priority, arrival_time, next(ctx.push_counter), node, score)
+        heapq.heappush(ctx.open, entry)
+        if ctx.stats is not None:
+            ctx.stats.pushes += 1
+
+    def _get_best_node(self, ctx: SearchContext) -> Optional[Node]:
+        # Entries are never updated in place, a node reached again with a
+        # better score is pushed once more and the stale entries are skipped.
+        labels = ctx.labels
+        while ctx.open:
+            _, arrival_time, _, node, score = heapq.heappop(ctx.open)
+            if ctx.stats is not None:
+                ctx.stats.pops += 1
+            i = node.id
+            if (
+                labels.visits[i] != labels.stamp
+                and score == labels.scores[i]
+                and arrival_time == labels.arrivals[i]
+            ):
+                return node
+        return None
 
     @staticmethod
-    def from_csv(csv_filename) -> "Pathfinder":
-        rows = open(csv_filename).read().splitlines()[1:]
-        row_entries = [to_row_entry(r) for r in rows]
-        return Pathfinder(row_entries)
+    def from_csv(
+        csv_filename, snapshot=None, cache_size: int = 4096, contract: bool = False
+    ) -> "Pathfinder":
+        if snapshot is None:
+            graph = ExpandedGraph.from_csv(csv_filename, contract)
+        else:
+            try:
+                graph = ExpandedGraph.load(snapshot, source=csv_filename)
+                if contract and not graph.contracted:
+                    graph.contract()
+            except (OSError, ValueError):
+                graph = ExpandedGraph.from_csv(csv_filename, contract)
+                graph.save(snapshot)
+        return Pathfinder(graph=graph, cache_size=cache_size)
 
     def node_exists(self, name: str):
         return len(self._graph.get_nodes_by_stop_name(name)) > 0
 
     def stop_exists(self, stop_name: str):
         return self._graph.get_nodes_by_stop_name(stop_name) != []
+
+    def find_stop_names(self, query: str, limit: int = 5) -> list[str]:
+        return self._graph.find_stop_names(query, limit)
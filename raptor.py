@@ -0,0 +1,214 @@
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Iterable, NamedTuple, Optional
+
+from graph import (
+    ExpandedGraph,
+    RowEntry,
+    TimetableRow,
+    format_minutes,
+    read_timetable,
+    sort_connections,
+    to_minutes,
+    to_timetable_row,
+)
+from pathfinder import BusStop
+
+UNREACHED = 2**32
+
+
+@dataclass
+class Journey:
+    bus_stops: list[BusStop]
+    arrival: str
+    duration: int
+    transfers: int
+
+
+class Ride(NamedTuple):
+    arrival: int
+    connection: int
+    # The ride up to the stop this connection departs from, None if the line
+    # was boarded there.
+    previous: Optional["Ride"]
+
+
+class Label(NamedTuple):
+    arrival: int
+    line: int
+    round: int
+    ride: Optional[Ride]
+
+
+class Route:
+    departures: array
+    arrivals: array
+    departure_stops: array
+    arrival_stops: array
+
+    def __init__(self, connections: list[tuple[int, int, int, int]]):
+        sort_connections(connections)
+        self.departures = array("H", [c[0] for c in connections])
+        self.arrivals = array("H", [c[1] for c in connections])
+        self.departure_stops = array("I", [c[2] for c in connections])
+        self.arrival_stops = array("I", [c[3] for c in connections])
+
+
+class Raptor:
+    # Round based search where round k finds the earliest arrival at every stop
+    # using at most k rides. A ride is any sequence of connections of one line,
+    # waiting on the line at a stop is free, just like staying on a line node
+    # of ExpandedGraph. Every round that improves the target adds one journey
+    # to the Pareto set of (arrival time, transfers).
+    _stop_names: list[str]
+    _stop_ids: dict[str, int]
+    _lines: list[str]
+    _routes: list[Route]
+    _lines_by_stop: list[list[int]]
+
+    def __init__(self, row_entries: Iterable[RowEntry] = ()):
+        self._build(to_timetable_row(e) for e in row_entries)
+
+    @staticmethod
+    def from_rows(rows: Iterable[TimetableRow]) -> "Raptor":
+        raptor = Raptor.__new__(Raptor)
+        raptor._build(rows)
+        return raptor
+
+    @staticmethod
+    def from_csv(csv_filename) -> "Raptor":
+        return Raptor.from_rows(read_timetable(csv_filename))
+
+    @staticmethod
+    def from_graph(graph: ExpandedGraph) -> "Raptor":
+        return Raptor.from_rows(graph.get_timetable_rows())
+
+    def find_journeys(
+        self, start: str, end: str, time: str, max_transfers: int = 5
+    ) -> list[Journey]:
+        starting_time = to_minutes(time)
+        target = self._stop_ids[end]
+        labels = [{self._stop_ids[start]: Label(starting_time, -1, 0, None)}]
+        best = [UNREACHED] * len(self._stop_names)
+        best[self._stop_ids[start]] = starting_time
+        marked = {self._stop_ids[start]}
+        journeys = []
+
+        for k in range(1, max_transfers + 2):
+            previous = labels[-1]
+            current = dict(previous)
+            next_marked = set()
+
+            # Stops that did not improve in the last round were already boarded
+            # from in an earlier one, so only marked stops are boarding points.
+            boarding = {stop: previous[stop].arrival for stop in marked}
+            lines = {line for stop in marked for line in self._lines_by_stop[stop]}
+            for line in sorted(lines):
+                on_line = self._scan_route(self._routes[line], boarding, best[target])
+                for stop, ride in on_line.items():
+                    if ride.arrival < best[stop] and ride.arrival < best[target]:
+                        best[stop] = ride.arrival
+                        current[stop] = Label(ride.arrival, line, k, ride)
+                        next_marked.add(stop)
+
+            labels.append(current)
+            if target in next_marked:
+                bus_stops = self._prepare_results(target, labels)
+                journeys.append(
+                    Journey(
+                        bus_stops=bus_stops,
+                        arrival=format_minutes(best[target]),
+                        duration=best[target] - starting_time,
+                        transfers=k - 1,
+                    )
+                )
+            marked = next_marked
+            if not marked:
+                break
+        return journeys
+
+    def _scan_route(
+        self, route: Route, boarding: dict[int, int], cutoff: int
+    ) -> dict[int, Ride]:
+        on_line: dict[int, Ride] = {}
+        departure_stops = route.departure_stops
+        arrival_stops = route.arrival_stops
+        departures = route.departures
+        arrivals = route.arrivals
+        # Nothing departing after the best arrival at the target can improve it.
+        first = min(boarding.values())
+        last = bisect_left(departures, cutoff)
+        for c in range(bisect_left(departures, first), last):
+            stop = departure_stops[c]
+            departure = departures[c]
+            ride = on_line.get(stop)
+            if ride is None or ride.arrival > departure:
+                boarded = boarding.get(stop)
+                if boarded is None or boarded > departure:
+                    continue
+                ride = None
+
+            end = arrival_stops[c]
+            current = on_line.get(end)
+            if current is None or arrivals[c] < current.arrival:
+                on_line[end] = Ride(arrivals[c], c, ride)
+        return on_line
+
+    def _prepare_results(
+        self, target: int, labels: list[dict[int, Label]]
+    ) -> list[BusStop]:
+        bus_stops = []
+        label = labels[-1][target]
+        while label.ride is not None:
+            route = self._routes[label.line]
+            ride = label.ride
+            while True:
+                bus_stops.append(self._bus_stop(route, label.line, ride.connection))
+                if ride.previous is None:
+                    break
+                ride = ride.previous
+            stop = route.departure_stops[ride.connection]
+            label = labels[label.round - 1][stop]
+        bus_stops.reverse()
+        return bus_stops
+
+    def _bus_stop(self, route: Route, line: int, c: int) -> BusStop:
+        return BusStop(
+            departs_from=self._stop_names[route.departure_stops[c]],
+            departure=format_minutes(route.departures[c]),
+            arrives_to=self._stop_names[route.arrival_stops[c]],
+            arrival=format_minutes(route.arrivals[c]),
+            bus_n=self._lines[line],
+        )
+
+    def stop_exists(self, stop_name: str):
+        return stop_name in self._stop_ids
+
+    def _build(self, rows: Iterable[TimetableRow]):
+        self._stop_names = []
+        self._stop_ids = {}
+        self._lines = []
+        line_ids: dict[str, int] = {}
+        connections: list[list[tuple[int, int, int, int]]] = []
+
+        def stop_id(name):
+            if name not in self._stop_ids:
+                self._stop_ids[name] = len(self._stop_names)
+                self._stop_names.append(name)
+            return self._stop_ids[name]
+
+        for r in rows:
+            if r.bus_n not in line_ids:
+                line_ids[r.bus_n] = len(self._lines)
+                self._lines.append(r.bus_n)
+                connections.append([])
+            connections[line_ids[r.bus_n]].append(
+                (r.departs_at, r.arrives_at, stop_id(r.start), stop_id(r.end))
+            )
+
+        self._routes = [Route(c) for c in connections]
+        self._lines_by_stop = [[] for _ in self._stop_names]
+        for line, route in enumerate(self._routes):
+            for stop in set(route.departure_stops):
+                self._lines_by_stop[stop].append(line)
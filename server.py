@@ -0,0 +1,190 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+import asyncio
+import json
+import sys
+
+from pathfinder import HEURISTICS, PathQuery, Pathfinder
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+COST_FIELDS = ("minute_cost", "transfer_cost", "km_cost")
+
+Response = Tuple[int, bytes]
+
+
+def _json(status: int, value) -> Response:
+    return status, json.dumps(value).encode()
+
+
+class JourneyServer:
+    # Answers GET /path?start=..&end=..&time=..[&minute_cost=..] over HTTP,
+    # one request per connection. Searches run in a thread pool so the event
+    # loop keeps accepting connections. Identical queries that arrive while
+    # one is being searched wait for that search instead of starting their
+    # own, and its response body is encoded once for all of them.
+    pathfinder: Pathfinder
+    searches: int
+    coalesced: int
+    _in_flight: dict[PathQuery, asyncio.Future]
+
+    def __init__(self, pathfinder: Pathfinder, workers: int = 4):
+        self.pathfinder = pathfinder
+        self.searches = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def plan(self, query: PathQuery) -> Response:
+        future = self._in_flight.get(query)
+        if future is None:
+            self.searches += 1
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, self._search, query)
+            self._in_flight[query] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(query, None))
+        else:
+            self.coalesced += 1
+        # A client that disconnects must not cancel a search others wait on.
+        return await asyncio.shield(future)
+
+    def _search(self, query: PathQuery) -> Response:
+        try:
+            result = self.pathfinder.find_path(**asdict(query))
+        except ValueError as e:
+            return _json(400, {"error": str(e)})
+        if result is None:
+            return _json(404, {"error": "Couldnt find the path"})
+        bus_stops, cost = result
+        return _json(200, {"cost": cost, "bus_stops": [asdict(b) for b in bus_stops]})
+
+    def parse_query(self, target: str) -> PathQuery:
+        url = urlsplit(target)
+        if url.path != "/path":
+            raise LookupError(url.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        for name in ("start", "end", "time"):
+            if name not in params:
+                raise ValueError(f"Missing parameter {name}")
+        for name in ("start", "end"):
+            if not self.pathfinder.stop_exists(params[name]):
+                raise ValueError(f"Bus stop {params[name]} doesnt exist")
+        hour, _, minute = params["time"].partition(":")
+        if not (hour.isdigit() and minute[:2].isdigit()):
+            raise ValueError(f"Invalid time {params['time']}")
+        costs = {name: float(params[name]) for name in COST_FIELDS if name in params}
+        heuristic = params.get("heuristic", "distance")
+        if heuristic not in HEURISTICS:
+            raise ValueError(f"Unknown heuristic {heuristic}")
+        return PathQuery(
+            params["start"],
+            params["end"],
+            params["time"],
+            starting_line=params.get("line"),
+            heuristic=heuristic,
+            **costs,
+        )
+
+    async def respond(self, method: str, target: str) -> Response:
+        if method != "GET":
+            return _json(405, {"error": f"Method {method} not allowed"})
+        if urlsplit(target).path == "/stats":
+            return _json(
+                200,
+                {
+                    "searches": self.searches,
+                    "coalesced": self.coalesced,
+                    "in_flight": len(self._in_flight),
+                    "cache": self.pathfinder.cache_info()._asdict(),
+                },
+            )
+        try:
+            query = self.parse_query(target)
+        except LookupError:
+            return _json(404, {"error": f"Unknown path {urlsplit(target).path}"})
+        except ValueError as e:
+            return _json(400, {"error": str(e)})
+        if query.start == query.end:
+            return _json(200, {"cost": 0, "bus_stops": []})
+        return await self.plan(query)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            if len(request_line) != 3:
+                status, body = _json(400, {"error": "Malformed request"})
+            else:
+                try:
+                    status, body = await self.respond(*request_line[:2])
+                except Exception as e:
+                    print(f"Error answering {request_line[1]}: {e!r}", file=sys.stderr)
+                    status, body = _json(500, {"error": "Internal server error"})
+            writer.write(
+                f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(
+        self, host: str = "127.0.0.1", port: int = 8080, unix: Optional[str] = None
+    ) -> asyncio.AbstractServer:
+        if unix is not None:
+            return await asyncio.start_unix_server(self.handle, unix, backlog=1024)
+        return await asyncio.start_server(self.handle, host, port, backlog=1024)
+
+
+def prewarm(pathfinder: Pathfinder):
+    # A snapshot is memory-mapped, so its pages are read on first use. One
+    # search reaching every stop pulls them in before the first request.
+    nodes = pathfinder.graph.get_nodes()
+    if nodes:
+        pathfinder.find_paths_from(nodes[0].bus_stop_name, "12:00")
+
+
+async def serve(pathfinder: Pathfinder, port: int, unix: Optional[str], workers: int):
+    journeys = JourneyServer(pathfinder, workers)
+    server = await journeys.start(port=port, unix=unix)
+    where = unix or ", ".join(str(s.getsockname()) for s in server.sockets)
+    print(f"Serving journeys on {where}", file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        journeys.close()
+
+
+if __name__ == "__main__":
+    args, options = [], {"--port": "8080", "--unix": None, "--workers": "4"}
+    argv = iter(sys.argv[1:])
+    for arg in argv:
+        if arg in options:
+            options[arg] = next(argv, None)
+        else:
+            args.append(arg)
+    if len(args) > 1 or None in (options["--port"], options["--workers"]):
+        print(f"Usage: {sys.argv[0]} [csv_file] [--port N | --unix PATH] [--workers N]")
+        sys.exit(1)
+    csv_filename = args[0] if args else "connection_graph.csv"
+    pathfinder = Pathfinder.from_csv(csv_filename, snapshot=csv_filename + ".snapshot")
+    prewarm(pathfinder)
+    port, workers = int(options["--port"]), int(options["--workers"])
+    asyncio.run(serve(pathfinder, port, options["--unix"], workers))
@@ -0,0 +1,171 @@
+from dataclasses import dataclass
+from typing import Iterator, Tuple
+import csv
+import math
+import random
+import sys
+
+from graph import TimetableRow
+
+CSV_HEADER = [
+    "",
+    "company",
+    "line",
+    "departure_time",
+    "arrival_time",
+    "start_stop",
+    "end_stop",
+    "start_stop_lat",
+    "start_stop_lon",
+    "end_stop_lat",
+    "end_stop_lon",
+]
+# South west corner of the city and the spacing of its stops, about 450m.
+ORIGIN = (51.05, 16.95)
+SPACING = (0.004, 0.006)
+FIRST_DEPARTURE = 5 * 60
+LAST_DEPARTURE = 22 * 60
+RUSH_HOURS = ((7 * 60, 9 * 60), (15 * 60, 18 * 60))
+
+
+@dataclass(frozen=True)
+class CityParameters:
+    # Stops laid out on the grid, those no line passes are left out.
+    stops: int = 1000
+    lines: int = 40
+    # Departures per direction over the day.
+    trips_per_line: int = 60
+    # Chance that a line runs through a stop another line already serves when
+    # it has the choice, 0 spreads lines over the city, 1 bundles them.
+    interchange_density: float = 0.3
+    seed: int = 0
+
+
+class _City:
+    # Stops on a square grid with a little jitter. Lines cross it from one
+    # side to the other, stepping forward and now and then sideways.
+    def __init__(self, params: CityParameters):
+        self.params = params
+        self.rng = random.Random(params.seed)
+        self.side = max(2, math.ceil(math.sqrt(params.stops)))
+        self.coords: dict[Tuple[int, int], Tuple[float, float]] = {}
+        for i in range(self.side):
+            for j in range(self.side):
+                if len(self.coords) == params.stops:
+                    break
+                self.coords[(i, j)] = (
+                    ORIGIN[0] + (i + self.rng.uniform(-0.25, 0.25)) * SPACING[0],
+                    ORIGIN[1] + (j + self.rng.uniform(-0.25, 0.25)) * SPACING[1],
+                )
+        self.served: set[Tuple[int, int]] = set()
+
+    def route(self, vertical: bool) -> list[Tuple[int, int]]:
+        rng = self.rng
+        across = rng.randrange(self.side)
+        cell = (0, across) if vertical else (across, 0)
+        route = [cell] if cell in self.coords else []
+        while True:
+            forward = (cell[0] + 1, cell[1]) if vertical else (cell[0], cell[1] + 1)
+            candidates = [forward]
+            for side in (-1, 1):
+                if vertical:
+                    candidates.append((forward[0], forward[1] + side))
+                else:
+                    candidates.append((forward[0] + side, forward[1]))
+            candidates = [c for c in candidates if c in self.coords]
+            if not candidates:
+                break
+            shared = [c for c in candidates if c in self.served]
+            fresh = [c for c in candidates if c not in self.served]
+            bundle = rng.random() < self.params.interchange_density
+            if shared and (bundle or not fresh):
+                candidates = shared
+            elif fresh:
+                candidates = fresh
+            # Going straight on is the most likely step.
+            if forward in candidates and rng.random() < 0.6:
+                cell = forward
+            else:
+                cell = rng.choice(candidates)
+            route.append(cell)
+        self.served.update(route)
+        return route
+
+    def name(self, cell: Tuple[int, int]) -> str:
+        return f"Stop {cell[0]}-{cell[1]}"
+
+
+def generate_rows(params: CityParameters) -> Iterator[TimetableRow]:
+    city = _City(params)
+    rng = city.rng
+    trips = max(params.trips_per_line, 1)
+    headway = (LAST_DEPARTURE - FIRST_DEPARTURE) / trips
+    for line in range(params.lines):
+        route = city.route(vertical=line % 2 == 1)
+        if len(route) < 2:
+            continue
+        bus_n = str(100 + line)
+        hops = [rng.randint(1, 3) for _ in route[1:]]
+        offset = rng.uniform(0, headway)
+        for stops, minutes in ((route, hops), (route[::-1], hops[::-1])):
+            for trip in range(trips):
+                time = FIRST_DEPARTURE + round(offset + trip * headway)
+                rush = any(start <= time < end for start, end in RUSH_HOURS)
+                for a, b, hop in zip(stops, stops[1:], minutes):
+                    duration = hop + 1 if rush and rng.random() < 0.3 else hop
+                    (a_lat, a_lon), (b_lat, b_lon) = city.coords[a], city.coords[b]
+                    yield TimetableRow(
+                        city.name(a),
+                        city.name(b),
+                        time,
+                        time + duration,
+                        bus_n,
+                        a_lat,
+                        a_lon,
+                        b_lat,
+                        b_lon,
+                    )
+                    time += duration
+
+
+def _format_time(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+def write_csv(path, params: CityParameters) -> int:
+    # Same columns as connection_graph.csv, returns the number of rows.
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        for r in generate_rows(params):
+            writer.writerow(
+                [
+                    count,
+                    "MPK",
+                    r.bus_n,
+                    _format_time(r.departs_at),
+                    _format_time(r.arrives_at),
+                    r.start,
+                    r.end,
+                    r.start_latitude,
+                    r.start_longitude,
+                    r.end_latitude,
+                    r.end_longitude,
+                ]
+            )
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(
+            f"Usage: {sys.argv[0]} output_csv [stops] [lines] [trips_per_line] "
+            "[interchange_density] [seed]"
+        )
+        sys.exit(1)
+    types = (int, int, int, float, int)
+    values = [t(v) for t, v in zip(types, sys.argv[2:])]
+    rows = write_csv(sys.argv[1], CityParameters(*values))
+    print(f"Wrote {rows} rows to {sys.argv[1]}")
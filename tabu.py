@@ -1,9 +1,22 @@
+from collections import deque
 from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Optional, Tuple
 from dataclasses import dataclass
 
 from pathfinder import BusStop
 
+_worker_calculate_cost: Optional[Callable] = None
+
+
+def _init_worker(cost_factory: Callable, cost_factory_args: tuple):
+    global _worker_calculate_cost
+    _worker_calculate_cost = cost_factory(*cost_factory_args)
+
+
+def _calculate_cost_in_worker(solution: "Solution"):
+    return _worker_calculate_cost(solution)
+
 
 @dataclass
 class Solution:
@@ -14,34 +27,115 @@ class Solution:
             return False
         return self.bus_stops == other.bus_stops
 
+    def __hash__(self) -> int:
+        return hash(self.key())
+
+    def key(self) -> tuple[str, ...]:
+        return tuple(self.bus_stops)
+
+
+class TabuList:
+    tenure: int
+
+    _queue: deque[tuple[str, ...]]
+    _counts: dict[tuple[str, ...], int]
+
+    def __init__(self, tenure: int):
+        self.tenure = tenure
+        self._queue = deque()
+        self._counts = {}
+
+    def __contains__(self, solution: Solution) -> bool:
+        return solution.key() in self._counts
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def add(self, solution: Solution):
+        key = solution.key()
+        self._queue.append(key)
+        self._counts[key] = self._counts.get(key, 0) + 1
+        while len(self._queue) > self.tenure:
+            oldest = self._queue.popleft()
+            self._counts[oldest] -= 1
+            if self._counts[oldest] == 0:
+                del self._counts[oldest]
+
 
 class Tabu:
     initial_solution: Solution
     calculate_cost: Callable
     generate_neighborhood: Callable
+    tenure: Optional[int]
+    aspiration: bool
+    workers: int
+    cost_factory: Optional[Callable]
+    cost_factory_args: tuple
+
+    _executor: Optional[Executor] = None
 
     def __init__(
         self,
         initial_solution: Solution,
         calculate_cost: Callable,
         generate_neighborhood: Callable,
+        tenure: Optional[int] = None,
+        aspiration: bool = False,
+        workers: int = 1,
+        cost_factory: Optional[Callable] = None,
+        cost_factory_args: tuple = (),
     ):
+        # tenure is how many recent solutions stay tabu. By default that is 3
+        # per stop plus the latest move and its neighbourhood.
+        # With aspiration, a tabu neighbour is still accepted when it beats
+        # the best solution found so far.
+        # With workers > 1 neighbours are evaluated in a thread pool sharing
+        # calculate_cost. If cost_factory is given, a process pool is used
+        # instead and every worker builds its own cost function once, by
+        # calling cost_factory(*cost_factory_args). Both have to be picklable.
         self.initial_solution = initial_solution
         self.calculate_cost = calculate_cost
         self.generate_neighborhood = generate_neighborhood
+        self.tenure = tenure
+        self.aspiration = aspiration
+        self.workers = workers
+        self.cost_factory = cost_factory
+        self.cost_factory_args = cost_factory_args
+
+    def _create_executor(self) -> Optional[Executor]:
+        if self.workers <= 1:
+            return None
+        if self.cost_factory is None:
+            return ThreadPoolExecutor(max_workers=self.workers)
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.cost_factory, self.cost_factory_args),
+        )
+
+    def _calculate_costs(self, solutions: list[Solution]) -> list:
+        if self._executor is None:
+            return [self.calculate_cost(s) for s in solutions]
+        if isinstance(self._executor, ProcessPoolExecutor):
+            return list(self._executor.map(_calculate_cost_in_worker, solutions))
+        return list(self._executor.map(self.calculate_cost, solutions))
 
     def find_best_neighbour(
-        self, neighbours: list[Solution], tabu
+        self, neighbours: list[Solution], tabu, best_cost: float = float("inf")
     ) -> Tuple[Optional[Solution], float, list[BusStop]]:
         best_neighbour = None
         best_neighbour_cost = float("inf")
         best_path = None
 
-        for n in neighbours:
-            if n in tabu:
+        if self.aspiration:
+            candidates = neighbours
+        else:
+            candidates = [n for n in neighbours if n not in tabu]
+        # Results come back in candidate order, so ties are broken the same
+        # way as in a serial run.
+        for n, (cost, path) in zip(candidates, self._calculate_costs(candidates)):
+            if n in tabu and not cost < best_cost:
                 continue
-
-            cost, path = self.calculate_cost(n)
             if cost < best_neighbour_cost:
                 best_neighbour = n
                 best_neighbour_cost = cost
@@ -50,6 +144,15 @@ class Tabu:
         return best_neighbour, best_neighbour_cost, best_path
 
     def run(self, iterations: int):
+        self._executor = self._create_executor()
+        try:
+            return self._run(iterations)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._executor = None
+
+    def _run(self, iterations: int):
 
         current_solution = self.initial_solution
         current_cost, path = self.calculate_cost(current_solution)
@@ -57,19 +160,23 @@ class Tabu:
         best_solution = current_solution
         best_cost = current_cost
         best_path = path
-        tabu: list[Solution] = []
+        per_stop = 3 * len(current_solution.bus_stops)
+        tabu = TabuList(self.tenure if self.tenure is not None else per_stop)
 
         for _ in range(iterations):
 
             neighborhood: list[Solution] = self.generate_neighborhood(current_solution)
-            new_solution, new_cost, new_path = self.find_best_neighbour(neighborhood, tabu)
+            new_solution, new_cost, new_path = self.find_best_neighbour(
+                neighborhood, tabu, best_cost
+            )
             if not new_solution:
-                return best_solution, best_cost
-            while len(tabu) > 3 * len(current_solution.bus_stops):
-                tabu.remove(tabu[0])
+                return best_solution, best_cost, best_path
 
-            tabu.append(new_solution)
-            tabu.extend(neighborhood)
+            if self.tenure is None:
+                tabu.tenure = per_stop + 1 + len(neighborhood)
+            tabu.add(new_solution)
+            for n in neighborhood:
+                tabu.add(n)
 
             current_solution = new_solution
             current_cost = new_cost
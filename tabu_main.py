@@ -1,4 +1,8 @@
-from pathfinder import Pathfinder
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Optional
+from pathfinder import BusStop, Pathfinder
 from utils import pretty_print_bus_stops
 import sys
 import time
@@ -6,42 +10,134 @@ import random
 from tabu import Tabu, Solution
 
 
-def get_cost_function(initial_time, minute_cost, transfer_cost, km_cost):
-
-    def calculate_path(sol: Solution):
+@dataclass(frozen=True)
+class LegState:
+    # Where a tour stands after one of its legs.
+    time: str
+    line: Optional[str]
+    cost: float
+    path: tuple[BusStop, ...]
+
+
+class TourCost:
+    # calculate_cost for Tabu. The state after every leg is kept by tour
+    # prefix, so a neighbour that only differs from the current solution from
+    # position i on is planned from stop i - 1, reusing the legs before it.
+    # Prefixes whose next leg has no path are kept as None.
+    find_path_calls: int
+    reused_legs: int
+
+    _prefixes: OrderedDict[tuple[str, ...], Optional[LegState]]
+
+    def __init__(
+        self,
+        pathfinder: Pathfinder,
+        initial_time: str,
+        minute_cost: float,
+        transfer_cost: float,
+        km_cost: float,
+        max_prefixes: int = 4096,
+    ):
+        # max_prefixes bounds the kept states, 0 plans every tour in full.
+        self.pathfinder = pathfinder
+        self.initial_time = initial_time
+        self.minute_cost = minute_cost
+        self.transfer_cost = transfer_cost
+        self.km_cost = km_cost
+        self.max_prefixes = max_prefixes
+        self.find_path_calls = 0
+        self.reused_legs = 0
+        self._prefixes = OrderedDict()
+        self._lock = Lock()
+
+    def _cached_prefix(self, stops: list[str]):
+        # The longest planned prefix of stops, as (legs, state).
+        with self._lock:
+            for legs in range(len(stops) - 1, 0, -1):
+                key = tuple(stops[: legs + 1])
+                if key in self._prefixes:
+                    self._prefixes.move_to_end(key)
+                    self.reused_legs += legs
+                    return legs, self._prefixes[key]
+        return 0, LegState(self.initial_time, None, 0, ())
+
+    def _store(self, key: tuple[str, ...], state: Optional[LegState]):
+        with self._lock:
+            self.find_path_calls += 1
+            if self.max_prefixes <= 0:
+                return
+            self._prefixes[key] = state
+            if len(self._prefixes) > self.max_prefixes:
+                self._prefixes.popitem(last=False)
+
+    def __call__(self, sol: Solution):
         stops = sol.bus_stops
-
-        line = None
-        time = initial_time
-        total_cost = 0
-        full_path = []
-
-        for i in range(len(stops) - 1):
-            a = stops[i]
-            b = stops[i + 1]
-            result = pathfinder.find_path(
-                a,
-                b,
-                time,
-                starting_line=line,
-                minute_cost=minute_cost,
-                transfer_cost=transfer_cost,
-                km_cost=km_cost,
+        legs, state = self._cached_prefix(stops)
+        if state is None:
+            return 10000000, []
+
+        for i in range(legs, len(stops) - 1):
+            result = self.pathfinder.find_path(
+                stops[i],
+                stops[i + 1],
+                state.time,
+                starting_line=state.line,
+                minute_cost=self.minute_cost,
+                transfer_cost=self.transfer_cost,
+                km_cost=self.km_cost,
             )
             if not result:
-                return 10000000
+                self._store(tuple(stops[: i + 2]), None)
+                return 10000000, []
 
             partial_path, cost = result
-            full_path.extend(partial_path)
-
             last_stop = partial_path[-1]
-
-            line = last_stop.bus_n
-            time = last_stop.arrival
-            total_cost += cost
-
-        return total_cost, full_path
-    return calculate_path
+            state = LegState(
+                last_stop.arrival,
+                last_stop.bus_n,
+                state.cost + cost,
+                state.path + tuple(partial_path),
+            )
+            self._store(tuple(stops[: i + 2]), state)
+
+        return state.cost, list(state.path)
+
+
+def get_cost_function(
+    pathfinder, initial_time, minute_cost, transfer_cost, km_cost, max_prefixes=4096
+):
+    return TourCost(
+        pathfinder, initial_time, minute_cost, transfer_cost, km_cost, max_prefixes
+    )
+
+
+def build_distance_matrix(
+    pathfinder, stops, initial_time, minute_cost, transfer_cost
+) -> dict[tuple[str, str], float]:
+    # Costs between every pair of tour stops, all departing at initial_time,
+    # with one search per origin instead of one per pair.
+    matrix = {}
+    for a in stops:
+        targets = [b for b in stops if b != a]
+        results = pathfinder.find_paths_from(
+            a,
+            initial_time,
+            targets,
+            minute_cost=minute_cost,
+            transfer_cost=transfer_cost,
+        )
+        for b in targets:
+            matrix[(a, b)] = results[b][1] if b in results else float("inf")
+    return matrix
+
+
+def load_cost_function(
+    csv_filename, snapshot, initial_time, minute_cost, transfer_cost, km_cost
+):
+    pathfinder = Pathfinder.from_csv(csv_filename, snapshot)
+    return get_cost_function(
+        pathfinder, initial_time, minute_cost, transfer_cost, km_cost
+    )
 
 
 def two_swap_neighbourhood(sol: Solution) -> list[Solution]:
@@ -57,33 +153,37 @@ def two_swap_neighbourhood(sol: Solution) -> list[Solution]:
     return neighbourhood
 
 
-pathfinder = Pathfinder.from_csv("connection_graph.csv")
+if __name__ == "__main__":
+    pathfinder = Pathfinder.from_csv("connection_graph.csv")
 
-# starting_point = input('Przystanek początkowy: ')
-# visited_stops = input('Przystanki do odwiedzenia: ')
-# optimize = input('Kryterium optymalizacyjne, t/p: ')
-# starting_time = input('Czas początkowy: ')
+    # starting_point = input('Przystanek początkowy: ')
+    # visited_stops = input('Przystanki do odwiedzenia: ')
+    # optimize = input('Kryterium optymalizacyjne, t/p: ')
+    # starting_time = input('Czas początkowy: ')
 
-starting_point = "Tramwajowa"
-visited_stops = 'Kępa Mieszczańska;Wyszyńskiego;Kochanowskiego;Sanocka'
-optimize = 'p'
-starting_time = '8:00'
+    starting_point = "Tramwajowa"
+    visited_stops = 'Kępa Mieszczańska;Wyszyńskiego;Kochanowskiego;Sanocka'
+    optimize = 'p'
+    starting_time = '8:00'
 
-time_cost = 1 if optimize == 't' else 0
-transfer_cost = 1 if optimize == 'p' else 0
+    time_cost = 1 if optimize == 't' else 0
+    transfer_cost = 1 if optimize == 'p' else 0
 
-path = [starting_point] + visited_stops.split(';') + [starting_point]
-tabu = Tabu(
-    initial_solution=Solution(path),
-    calculate_cost=get_cost_function(starting_time, time_cost, transfer_cost, 0),
-    generate_neighborhood=two_swap_neighbourhood,
-)
+    path = [starting_point] + visited_stops.split(';') + [starting_point]
+    tabu = Tabu(
+        initial_solution=Solution(path),
+        calculate_cost=get_cost_function(
+            pathfinder, starting_time, time_cost, transfer_cost, 0
+        ),
+        generate_neighborhood=two_swap_neighbourhood,
+    )
 
-start = time.time()
-solution, cost, path = tabu.run(1)
-end = time.time()
+    start = time.time()
+    solution, cost, path = tabu.run(1)
+    end = time.time()
 
-print(f'Found solution: {"->".join(solution.bus_stops)}')
-print(f"Time taken: {end - start:.2f}s. Path cost: {cost}", file=sys.stderr)
-pretty_print_bus_stops(path)
+    print(f'Found solution: {"->".join(solution.bus_stops)}')
+    print(f"Time taken: {end - start:.2f}s. Path cost: {cost}", file=sys.stderr)
+    print(f"Leg cache: {pathfinder.cache_info()}", file=sys.stderr)
+    pretty_print_bus_stops(path)
 
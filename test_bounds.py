@@ -0,0 +1,69 @@
+import pytest
+
+from bounds import GeodesicBound, LandmarkTable, to_metres
+from graph import ExpandedGraph, TimetableUpdate
+from pathfinder import Pathfinder
+from testutils import rowentry
+
+A, B, C, D = (51.1, 17.0), (51.1, 17.01), (51.11, 17.01), (51.12, 17.01)
+
+
+def graph() -> ExpandedGraph:
+    return ExpandedGraph(
+        [
+            rowentry("a", "b", 540, 542, "101", A, B),
+            rowentry("b", "c", 542, 547, "101", B, C),
+            rowentry("c", "d", 550, 555, "102", C, D),
+            rowentry("a", "b", 600, 604, "101", A, B),
+        ]
+    )
+
+
+def test_to_metres():
+    x1, y1 = to_metres(*A, 51.1)
+    x2, y2 = to_metres(*C, 51.1)
+    assert x2 - x1 == pytest.approx(698, abs=1)
+    assert y2 - y1 == pytest.approx(1112, abs=1)
+
+
+def test_geodesic_bound():
+    bound = GeodesicBound(graph())
+
+    assert bound.max_speed == pytest.approx(bound.distance("a", "b") / 2)
+    assert bound.lower_bound("a", "b") == pytest.approx(2)
+    assert bound.lower_bound("b", "b") == 0
+    assert bound.lower_bound("a", "d") <= 12
+
+
+def test_landmark_bound():
+    landmarks = LandmarkTable(graph(), count=2)
+
+    assert landmarks.count == 2
+    assert landmarks.lower_bound("a", "d") == 12
+    assert landmarks.lower_bound("b", "c") == 5
+    assert landmarks.lower_bound("d", "a") == 0
+
+
+def test_geodesic_bound_with_zero_minute_ride():
+    rows = [
+        rowentry("a", "b", 540, 542, "101", A, B),
+        rowentry("b", "c", 545, 545, "101", B, C),
+    ]
+    bound = GeodesicBound(ExpandedGraph(rows))
+
+    assert bound.lower_bound("a", "c") == 0
+
+
+def test_bounds_with_closed_stop():
+    closed = graph()
+    closed.apply_updates([TimetableUpdate("close", "b")])
+    bound = GeodesicBound(closed)
+    landmarks = LandmarkTable(closed, count=2)
+
+    assert bound.max_speed == pytest.approx(bound.distance("a", "b") / 2)
+    assert bound.lower_bound("a", "d") <= 12
+    assert landmarks.lower_bound("a", "d") == 12
+    pathfinder = Pathfinder(graph=closed, cache_size=0)
+    for heuristic in ("geodesic", "landmarks"):
+        assert pathfinder.find_path("c", "d", "9:00", 1, 5, 0, heuristic=heuristic)
+        assert not pathfinder.find_path("a", "d", "9:00", 1, 5, 0, heuristic=heuristic)
@@ -0,0 +1,114 @@
+import pytest
+
+from csa import ConnectionScan
+from graph import format_minutes, to_minutes
+from pathfinder import BusStop, Pathfinder
+from testutils import random_timetable, rowentry, zero_minute_chain
+from utils import pretty_print_bus_stops
+
+
+def test_path():
+    scan = ConnectionScan(
+        [
+            rowentry("a", "b", 540, 555, "101"),
+            rowentry("b", "c", 555, 570, "222"),
+            rowentry("a", "c", 545, 580, "101"),
+        ]
+    )
+
+    assert scan.find_path("a", "c", "9:00") == (
+        [
+            BusStop("a", "09:00", "b", "09:15", "101"),
+            BusStop("b", "09:15", "c", "09:30", "222"),
+        ],
+        30,
+    )
+    assert scan.find_path("a", "c", "9:01") == (
+        [BusStop("a", "09:05", "c", "09:40", "101")],
+        39,
+    )
+    assert scan.find_path("c", "a", "9:00") is None
+
+
+def test_zero_minute_chain():
+    scan = ConnectionScan(zero_minute_chain())
+    assert scan.find_path("a", "d", "9:00") == (
+        [
+            BusStop("a", "09:00", "b", "09:00", "101"),
+            BusStop("b", "09:00", "c", "09:00", "101"),
+            BusStop("c", "09:00", "d", "09:05", "101"),
+        ],
+        5,
+    )
+
+
+@pytest.mark.parametrize("shortest", [1, 0])
+def test_matches_pathfinder_earliest_arrival(shortest):
+    for seed in range(5):
+        rows = random_timetable(seed, shortest)
+        scan = ConnectionScan(rows)
+        pathfinder = Pathfinder(rows, cache_size=0)
+        stops = sorted({r.start for r in rows} | {r.end for r in rows})
+
+        for a in stops:
+            for b in stops:
+                if a == b:
+                    continue
+                expected = pathfinder.find_path(a, b, "8:30", 1, 0, 0)
+                result = scan.find_path(a, b, "8:30")
+                if expected is None:
+                    assert result is None
+                    continue
+                path, cost = result
+                assert cost == expected[1]
+                assert path[0].departs_from == a and path[-1].arrives_to == b
+                for previous, current in zip(path, path[1:]):
+                    assert previous.arrives_to == current.departs_from
+                    assert previous.arrival <= current.departure
+                pretty_print_bus_stops(path)
+
+
+def test_profile_of_zero_minute_chain():
+    scan = ConnectionScan(zero_minute_chain())
+    profile = scan.find_profile("a", "d", "8:50", "9:10")
+    assert profile == [(scan.find_path("a", "d", "9:00")[0], 5)]
+
+
+@pytest.mark.parametrize("shortest", [1, 0])
+def test_profile_matches_per_minute_queries(shortest):
+    for seed in range(5):
+        rows = random_timetable(seed, shortest)
+        scan = ConnectionScan(rows)
+        stops = sorted({r.start for r in rows} | {r.end for r in rows})
+
+        for a in stops:
+            for b in stops:
+                if a == b:
+                    continue
+                profile = scan.find_profile(a, b, "8:20", "9:10")
+                departures = [to_minutes(p[0][0].departure) for p in profile]
+                arrivals = [to_minutes(p[0][-1].arrival) for p in profile]
+                assert departures == sorted(set(departures))
+                assert arrivals == sorted(set(arrivals))
+
+                for path, cost in profile:
+                    assert path[0].departs_from == a and path[-1].arrives_to == b
+                    for previous, current in zip(path, path[1:]):
+                        assert previous.arrives_to == current.departs_from
+                        assert previous.arrival <= current.departure
+                    assert cost == to_minutes(path[-1].arrival) - to_minutes(
+                        path[0].departure
+                    )
+
+                # Without a profile entry left, leaving after the window must
+                # be just as good.
+                after = scan.find_path(a, b, "9:11")
+                after = after and after[1] + 9 * 60 + 11
+                for minute in range(8 * 60 + 20, 9 * 60 + 11):
+                    expected = scan.find_path(a, b, format_minutes(minute))
+                    expected = expected and expected[1] + minute
+                    later = [i for i, d in enumerate(departures) if d >= minute]
+                    if later:
+                        assert expected == arrivals[later[0]]
+                    else:
+                        assert expected == after
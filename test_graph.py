@@ -1,7 +1,18 @@
 from datetime import datetime
 
 import pytest
-from graph import Connection, ExpandedGraph, RowEntry, Node
+import graph as graph_module
+from graph import (
+    Connection,
+    ExpandedGraph,
+    RowEntry,
+    Node,
+    TimetableRow,
+    TimetableUpdate,
+    read_timetable,
+)
+from pathfinder import Pathfinder
+from testutils import rowentry
 from typing import Tuple
 
 
@@ -18,28 +29,6 @@ def to_datetime(time: str):
     return datetime(2000, 1, day, hour, second)
 
 
-def rowentry(
-    a,
-    b,
-    start: str = "9:00",
-    end: str = "9:15",
-    bus="A",
-    a_coords=(0, 0),
-    b_coords=(0, 0),
-) -> RowEntry:
-    return RowEntry(
-        start=a,
-        end=b,
-        departs_at=to_datetime(start),
-        arrives_at=to_datetime(end),
-        bus_n=bus,
-        start_latitude=a_coords[0],
-        start_longitude=a_coords[1],
-        end_latitude=b_coords[0],
-        end_longitude=b_coords[1],
-    )
-
-
 def node(bus_stop, bus_n) -> Node:
     return Node(bus_stop, bus_n, 0, 0)
 
@@ -133,6 +122,17 @@ def test_neighboring_nodes(nodes, bus_stop, bus_n, expected):
             "10:00",
             None,
         ),
+        (
+            [
+                rowentry("a", "b", "9:20", "9:25", "101"),
+                rowentry("a", "b", "9:00", "9:30", "101"),
+                rowentry("a", "b", "9:40", "9:45", "101"),
+            ],
+            ("a", "101"),
+            ("b", "101"),
+            "8:50",
+            Connection(to_datetime("9:20"), to_datetime("09:25"), "101"),
+        ),
         (
             [rowentry("a", "b", "9:00", "9:15", "101")],
             ("b", "101"),
@@ -201,3 +201,264 @@ def test_remove_node__same_bus_line():
 
     with pytest.raises(ValueError):
         graph.get_best_connection(a_101, a_102, to_datetime("9:90"))
+
+
+@pytest.mark.parametrize("use_mmap", [True, False])
+def test_snapshot_roundtrip(tmp_path, use_mmap):
+    graph = ExpandedGraph(
+        [
+            rowentry("a", "b", "9:00", "9:15", "101", a_coords=(1, 2)),
+            rowentry("a", "b", "9:20", "9:25", "101"),
+            rowentry("b", "c", "9:30", "9:40", "101"),
+            rowentry("a", "c", "9:00", "9:15", "102", b_coords=(3, 4)),
+        ]
+    )
+    graph.save(tmp_path / "graph.snapshot")
+    loaded = ExpandedGraph.load(tmp_path / "graph.snapshot", mmap=use_mmap)
+
+    assert loaded.get_nodes() == graph.get_nodes()
+    c_102 = loaded.get_node("c", "102")
+    assert (c_102.latitude, c_102.longitude) == (3, 4)
+    for n in graph.get_nodes():
+        loaded_node = loaded.get_node(n.bus_stop_name, n.bus_n)
+        assert set(loaded.get_neighbouring_nodes(loaded_node)) == set(
+            graph.get_neighbouring_nodes(n)
+        )
+    a = loaded.get_node("a", "101")
+    b = loaded.get_node("b", "101")
+    assert loaded.get_best_connection(a, b, to_datetime("9:10")) == Connection(
+        to_datetime("9:20"), to_datetime("9:25"), "101"
+    )
+
+
+def test_snapshot_invalidated_by_source_change(tmp_path):
+    csv_file = tmp_path / "connections.csv"
+    header = ",company,line,departure_time,arrival_time,start_stop,end_stop,"
+    header += "start_stop_lat,start_stop_lon,end_stop_lat,end_stop_lon\n"
+    csv_file.write_text(header + "0,MPK,101,09:00:00,09:15:00,a,b,1,2,3,4\n")
+
+    ExpandedGraph.from_csv(csv_file).save(tmp_path / "graph.snapshot")
+    ExpandedGraph.load(tmp_path / "graph.snapshot", source=csv_file)
+
+    csv_file.write_text(header + "0,MPK,101,09:00:00,09:20:00,a,b,1,2,3,4\n")
+    with pytest.raises(ValueError):
+        ExpandedGraph.load(tmp_path / "graph.snapshot", source=csv_file)
+
+
+TIMETABLE_HEADER = (
+    ",company,line,departure_time,arrival_time,start_stop,end_stop,"
+    "start_stop_lat,start_stop_lon,end_stop_lat,end_stop_lon\n"
+)
+
+
+def test_read_timetable(tmp_path):
+    csv_file = tmp_path / "connections.csv"
+    csv_file.write_text(
+        TIMETABLE_HEADER
+        + "0,MPK,101,09:05:00,09:15:00,Plac Grunwaldzki,b,51.11,17.06,51.1,-17.5\n"
+        + "\n"
+        + '1,MPK,N,23:58:00,24:03:00,b,"Most, Zachodni",51.1,-17.5,51,17\n'
+        + "2,MPK,N,25:10:00,25:12:00,\"Most, Zachodni\",c,51,17,1e1,0\n"
+    )
+
+    rows = list(read_timetable(csv_file))
+    assert rows == [
+        TimetableRow(
+            "Plac Grunwaldzki", "b", 545, 555, "101", 51.11, 17.06, 51.1, -17.5
+        ),
+        TimetableRow("b", "Most, Zachodni", 1438, 1443, "N", 51.1, -17.5, 51.0, 17.0),
+        TimetableRow("Most, Zachodni", "c", 1510, 1512, "N", 51.0, 17.0, 10.0, 0.0),
+    ]
+    # Stop and line names are interned, repeated ones are the same object.
+    assert rows[0].end is rows[1].start
+    assert rows[1].bus_n is rows[2].bus_n
+
+
+def test_read_timetable_header_only(tmp_path):
+    csv_file = tmp_path / "connections.csv"
+    csv_file.write_text(TIMETABLE_HEADER)
+    assert list(read_timetable(csv_file)) == []
+
+    csv_file.write_text("")
+    assert list(read_timetable(csv_file)) == []
+
+
+@pytest.mark.parametrize(
+    "row",
+    [
+        "0,MPK,101,09:00:00,09:15:00,a,b,1,2,3\n",
+        "0,MPK,101,9.00,09:15:00,a,b,1,2,3,4\n",
+        "0,MPK,101,09:00:00,,a,b,1,2,3,4\n",
+        "0,MPK,101,09:00:00,09:15:00,a,b,1,north,3,4\n",
+    ],
+)
+def test_read_timetable_malformed_row(tmp_path, row):
+    csv_file = tmp_path / "connections.csv"
+    first = "0,MPK,101,08:00:00,08:15:00,a,b,1,2,3,4\n"
+    csv_file.write_text(TIMETABLE_HEADER + first + row)
+
+    rows = read_timetable(csv_file)
+    assert next(rows).departs_at == 480
+    with pytest.raises(ValueError, match="line 3"):
+        next(rows)
+
+
+@pytest.mark.parametrize("use_mmap", [True, False])
+def test_truncated_snapshot_is_rejected(tmp_path, use_mmap):
+    csv_file = tmp_path / "connections.csv"
+    csv_file.write_text(
+        TIMETABLE_HEADER
+        + "0,MPK,101,09:00:00,09:15:00,a,b,1,2,3,4\n"
+        + "1,MPK,101,09:15:00,09:20:00,b,c,3,4,5,6\n"
+    )
+    snapshot = tmp_path / "graph.snapshot"
+    ExpandedGraph.from_csv(csv_file).save(snapshot)
+    # Nothing is left behind from writing it.
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "connections.csv",
+        "graph.snapshot",
+    ]
+    data = snapshot.read_bytes()
+
+    for size in (len(data) * 3 // 4, len(data) // 2, 12, 6):
+        snapshot.write_bytes(data[:size])
+        with pytest.raises(ValueError):
+            ExpandedGraph.load(snapshot, mmap=use_mmap)
+
+    # Pathfinder.from_csv falls back to the CSV and writes the snapshot again.
+    snapshot.write_bytes(data[:12])
+    pathfinder = Pathfinder.from_csv(csv_file, snapshot)
+    assert pathfinder.find_path("a", "c", "9:00", 1, 0, 0)[1] == 20
+    assert snapshot.read_bytes() == data
+
+
+def test_source_checksum_only_computed_for_snapshots(tmp_path, monkeypatch):
+    csv_file = tmp_path / "connections.csv"
+    header = ",company,line,departure_time,arrival_time,start_stop,end_stop,"
+    header += "start_stop_lat,start_stop_lon,end_stop_lat,end_stop_lon\n"
+    csv_file.write_text(header + "0,MPK,101,09:00:00,09:15:00,a,b,1,2,3,4\n")
+    hashed = []
+    checksum = graph_module.file_checksum
+    monkeypatch.setattr(
+        graph_module, "file_checksum", lambda f: hashed.append(f) or checksum(f)
+    )
+
+    graph = ExpandedGraph.from_csv(csv_file)
+    assert hashed == []
+    graph.save(tmp_path / "graph.snapshot")
+    assert hashed == [csv_file]
+    loaded = ExpandedGraph.load(tmp_path / "graph.snapshot", source=csv_file)
+    assert loaded.source_checksum == checksum(csv_file)
+    assert hashed == [csv_file] * 2
+
+
+def test_find_stop_names():
+    graph = ExpandedGraph(
+        [
+            rowentry("Plac Grunwaldzki", "Most Grunwaldzki", bus="101"),
+            rowentry("Plac Bema", "Plac Grunwaldzki", bus="102"),
+            rowentry("Galeria Dominikańska", "Plac Bema", bus="102"),
+        ]
+    )
+
+    assert graph.find_stop_names("plac") == ["Plac Bema", "Plac Grunwaldzki"]
+    assert graph.find_stop_names("Plac Grunwaldzki", limit=1) == ["Plac Grunwaldzki"]
+    assert graph.find_stop_names("Galeria Dominikanska") == ["Galeria Dominikańska"]
+    assert graph.find_stop_names("Sky Tower") == []
+
+
+def line_with_chain() -> list[RowEntry]:
+    return [
+        rowentry("a", "b", "9:00", "9:05", "101"),
+        rowentry("b", "c", "9:05", "9:10", "101"),
+        rowentry("c", "d", "9:12", "9:15", "101"),
+        rowentry("a", "b", "9:20", "9:25", "101"),
+        rowentry("b", "c", "9:25", "9:30", "101"),
+        rowentry("c", "d", "9:30", "9:33", "101"),
+        rowentry("d", "c", "9:00", "9:03", "101"),
+        rowentry("c", "b", "9:03", "9:08", "101"),
+        rowentry("b", "a", "9:08", "9:13", "101"),
+        rowentry("a", "d", "9:00", "9:30", "102"),
+    ]
+
+
+@pytest.mark.parametrize("use_mmap", [True, False])
+def test_contraction(tmp_path, use_mmap):
+    graph = ExpandedGraph(line_with_chain(), contract=True)
+    graph.save(tmp_path / "graph.snapshot")
+    for g in (graph, ExpandedGraph.load(tmp_path / "graph.snapshot", mmap=use_mmap)):
+        a, b, c, d = (g.get_node(s, "101") for s in "abcd")
+        assert g.contracted
+        assert set(g.get_neighbouring_nodes(a)) == {d, g.get_node("a", "102")}
+        assert set(g.get_neighbouring_nodes(d)) == {a, g.get_node("d", "102")}
+        assert set(g.get_neighbouring_nodes(b)) == {a, c}
+        assert g.get_shortcut_heads(c) == [a, d]
+
+        assert g.get_best_trip(a, d, 540) == (540, 555)
+        assert g.get_best_trip(a, d, 541) == (560, 573)
+        assert g.get_best_trip(a, c, 541) == (560, 570)
+        assert g.get_best_trip(a, b, 541) == (560, 565)
+        assert g.unpack_trip(a, d, (540, 555)) == [
+            (a, b, (540, 545)),
+            (b, c, (545, 550)),
+            (c, d, (552, 555)),
+        ]
+        assert g.unpack_trip(d, b, (540, 548)) == [
+            (d, c, (540, 543)),
+            (c, b, (543, 548)),
+        ]
+        assert g.unpack_trip(a, b, (540, 545)) == [(a, b, (540, 545))]
+
+
+@pytest.mark.parametrize("contract", [False, True])
+def test_apply_updates(tmp_path, contract):
+    graph = ExpandedGraph(line_with_chain(), contract=contract)
+    a, b, c, d = (graph.get_node(s, "101") for s in "abcd")
+    changes = graph.apply_updates(
+        [
+            TimetableUpdate("delay", "a", "101", "b", departure=540, minutes=3),
+            TimetableUpdate("cancel", "c", "101", "d", departure=570),
+            TimetableUpdate("add", "b", "101", "c", departure=546, arrival=549),
+            TimetableUpdate("close", "d"),
+        ]
+    )
+    assert changes.edges == {("101", "a", "b"), ("101", "c", "d")}
+    assert changes.trips == [(543, 548), (546, 549)]
+    assert changes.closed == {"d"} and not changes.reopened
+
+    assert graph.get_best_trip(a, b, 540) == (543, 548)
+    assert graph.get_best_trip(a, b, 544) == (560, 565)
+    # The added trip overtakes the one leaving at 545.
+    assert graph.get_best_trip(b, c, 545) == (546, 549)
+    if contract:
+        assert graph.get_best_trip(a, c, 540) == (543, 570)
+    assert d.removed and graph.closed_stops() == {"d"}
+    assert d not in graph.get_neighbouring_nodes(c)
+    assert graph.source_checksum is None
+
+    graph.save(tmp_path / "graph.snapshot")
+    loaded = ExpandedGraph.load(tmp_path / "graph.snapshot")
+    assert loaded.closed_stops() == {"d"}
+    assert sorted(loaded.get_timetable_rows()) == sorted(graph.get_timetable_rows())
+
+    changes = graph.apply_updates([TimetableUpdate("reopen", "d")])
+    assert changes.reopened == {"d"} and not d.removed
+    assert graph.get_best_trip(c, d, 560) is None
+    assert graph.get_best_trip(c, d, 550) == (552, 555)
+
+
+def test_invalid_update_leaves_graph_unchanged():
+    graph = ExpandedGraph(line_with_chain())
+    rows = sorted(graph.get_timetable_rows())
+    for update in [
+        TimetableUpdate("cancel", "a", "101", "b", departure=541),
+        TimetableUpdate("add", "a", "101", "c", departure=541, arrival=550),
+        TimetableUpdate("add", "a", "101", "b", departure=541, arrival=530),
+        TimetableUpdate("close", "z"),
+        TimetableUpdate("detour", "a", "101", "b"),
+    ]:
+        with pytest.raises(ValueError):
+            graph.apply_updates(
+                [TimetableUpdate("delay", "a", "101", "b", 540, minutes=5), update]
+            )
+    assert sorted(graph.get_timetable_rows()) == rows
@@ -1,44 +1,10 @@
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from typing import Optional
-from pathfinder import BusStop, Pathfinder
-from graph import RowEntry
+from pathfinder import BusStop, PathQuery, Pathfinder, SearchStats
+from graph import ExpandedGraph, RowEntry, TimetableUpdate
+from testutils import random_timetable, rowentry
 import pytest
-from datetime import datetime
-
-
-def to_datetime(time: str):
-    if time is None:
-        return None
-    hour, second = time.split(":")
-    day = 1
-    hour = int(hour)
-    second = int(second)
-    if hour >= 24:
-        day = 2
-        hour -= 24
-    return datetime(2000, 1, day, hour, second)
-
-
-def rowentry(
-    a,
-    b,
-    start: str = "9:00",
-    end: str = "9:15",
-    bus="A",
-    a_coords=(0, 0),
-    b_coords=(0, 0),
-) -> RowEntry:
-    return RowEntry(
-        start=a,
-        end=b,
-        departs_at=to_datetime(start),
-        arrives_at=to_datetime(end),
-        bus_n=bus,
-        start_latitude=a_coords[0],
-        start_longitude=a_coords[1],
-        end_latitude=b_coords[0],
-        end_longitude=b_coords[1],
-    )
+import random
 
 
 @dataclass
@@ -260,3 +226,366 @@ def test_path(params: PathfinderTestParams):
         print(expected)
         assert actual == expected
     assert cost == params.expected_cost
+
+
+def test_concurrent_queries_match_serial():
+    nodes = []
+    for i, line in enumerate(["101", "102", "103"]):
+        stops = [f"s{(i + j * (i + 1)) % 7}" for j in range(6)]
+        for hour in range(8, 12):
+            for j in range(len(stops) - 1):
+                nodes.append(
+                    rowentry(
+                        stops[j],
+                        stops[j + 1],
+                        f"{hour}:{10 * j + i:02d}",
+                        f"{hour}:{10 * j + i + 5:02d}",
+                        line,
+                    )
+                )
+    pathfinder = Pathfinder(nodes, cache_size=0)
+    stop_names = sorted({n.start for n in nodes} | {n.end for n in nodes})
+    queries = [
+        PathQuery(a, b, f"{hour}:{minute:02d}", km_cost=0)
+        for a in stop_names
+        for b in stop_names
+        if a != b
+        for hour in (8, 9)
+        for minute in (0, 25)
+    ]
+
+    serial = [pathfinder.find_path(**asdict(q)) for q in queries]
+    concurrent = pathfinder.find_paths_concurrently(queries, workers=8)
+
+    assert concurrent == serial
+
+
+def test_leg_cache():
+    pathfinder = Pathfinder(
+        [
+            rowentry("a", "b", "9:00", "9:15", "101"),
+            rowentry("b", "c", "9:15", "9:30", "101"),
+        ],
+        cache_size=2,
+    )
+
+    first = pathfinder.find_path("a", "c", "9:00")
+    assert pathfinder.find_path("a", "c", "9:00") == first
+    assert pathfinder.find_path("a", "c", "9:00", transfer_cost=1) == first
+    assert pathfinder.cache_info() == (1, 2, 2, 2)
+
+    pathfinder.find_path("a", "b", "9:00")
+    pathfinder.find_path("a", "c", "9:00")
+    assert pathfinder.cache_info() == (1, 4, 2, 2)
+
+    pathfinder.clear_cache()
+    assert pathfinder.cache_info() == (0, 0, 2, 0)
+
+
+def test_cached_results_are_isolated_and_dropped_on_graph_changes():
+    pathfinder = Pathfinder(
+        [
+            rowentry("a", "b", "9:00", "9:15", "101"),
+            rowentry("b", "c", "9:15", "9:30", "101"),
+            rowentry("a", "c", "9:00", "9:40", "102"),
+        ]
+    )
+
+    stops, cost = pathfinder.find_path("a", "c", "9:00", 1, 0, 0)
+    expected = list(stops)
+    stops.clear()
+    with pytest.raises(AttributeError):
+        expected[0].arrival = "10:00"
+    assert pathfinder.find_path("a", "c", "9:00", 1, 0, 0) == (expected, cost)
+
+    pathfinder.graph.remove_node(pathfinder.graph.get_node("b", "101"))
+    stops, cost = pathfinder.find_path("a", "c", "9:00", 1, 0, 0)
+    assert [s.bus_n for s in stops] == ["102"] and cost == 40
+    assert pathfinder.cache_info().currsize == 1
+
+    pathfinder.graph.reset()
+    assert pathfinder.find_path("a", "c", "9:00", 1, 0, 0) == (expected, 30)
+
+    pathfinder.apply_updates([TimetableUpdate("close", "b")])
+    assert pathfinder.find_path("a", "c", "9:00", 1, 0, 0)[1] == 40
+    pathfinder.graph.reset()
+    assert not pathfinder.graph.is_closed("b")
+    assert pathfinder.find_path("a", "c", "9:00", 1, 0, 0) == (expected, 30)
+
+
+def test_paths_from_one_stop_match_find_path():
+    pathfinder = Pathfinder(
+        [
+            rowentry("a", "b", "9:00", "9:15", "101"),
+            rowentry("b", "c", "9:15", "9:30", "101"),
+            rowentry("a", "d", "9:05", "9:10", "102"),
+            rowentry("d", "c", "9:10", "9:20", "102"),
+            rowentry("c", "e", "9:40", "9:50", "101"),
+            rowentry("x", "y", "9:00", "9:10", "103"),
+        ],
+        cache_size=0,
+    )
+
+    results = pathfinder.find_paths_from("a", "9:00")
+    assert set(results) == {"b", "c", "d", "e"}
+    for stop, result in results.items():
+        assert result == pathfinder.find_path("a", stop, "9:00", km_cost=0)
+
+    assert set(pathfinder.find_paths_from("a", "9:00", targets=["c", "y"])) == {"c"}
+
+
+def test_profile():
+    pathfinder = Pathfinder(
+        [
+            rowentry("a", "b", "9:00", "9:15", "101"),
+            rowentry("b", "c", "9:15", "9:30", "101"),
+            rowentry("a", "c", "9:05", "9:40", "102"),
+            rowentry("a", "c", "9:10", "9:25", "103"),
+            rowentry("a", "b", "9:20", "9:35", "101"),
+            rowentry("b", "c", "9:35", "9:50", "101"),
+            rowentry("a", "c", "10:00", "10:10", "103"),
+        ]
+    )
+
+    assert pathfinder.find_profile("a", "c", "9:00", "9:30") == [
+        ([BusStop("a", "09:10", "c", "09:25", "103")], 15),
+        (
+            [
+                BusStop("a", "09:20", "b", "09:35", "101"),
+                BusStop("b", "09:35", "c", "09:50", "101"),
+            ],
+            30,
+        ),
+    ]
+    assert pathfinder.find_profile("c", "a", "9:00", "9:30") == []
+
+
+def test_admissible_heuristics_match_dijkstra():
+    rng = random.Random(3)
+    coords = {
+        f"s{i}": (51 + rng.random() / 20, 17 + rng.random() / 20) for i in range(12)
+    }
+    nodes = random_timetable(3, coords=coords)
+    pathfinder = Pathfinder(nodes, cache_size=0)
+    pathfinder.precompute_bounds(landmarks=3)
+    stops = sorted({n.start for n in nodes} | {n.end for n in nodes})
+
+    for a in stops:
+        for b in stops:
+            if a == b:
+                continue
+            expected = pathfinder.find_path(a, b, "8:30", 1, 5, 0)
+            for heuristic in ("geodesic", "landmarks"):
+                result = pathfinder.find_path(
+                    a, b, "8:30", 1, 5, 0, heuristic=heuristic
+                )
+                assert (result and result[1]) == (expected and expected[1])
+
+    with pytest.raises(ValueError):
+        pathfinder.find_path("s0", "s1", "8:30", heuristic="straight")
+
+    # Rides timed at zero minutes leave no finite top speed to bound with.
+    # The chain starts with a step away from t, so f1 is three hops from it.
+    chain = ["a", "f1", "g1", "g2", "t"]
+    coords = {
+        stop: (51 + i / 100, 17) for stop, i in zip(chain, (0, -1, 0, 1, 2))
+    }
+    nodes = [
+        rowentry(a, b, "9:00", "9:00", "101", coords[a], coords[b])
+        for a, b in zip(chain, chain[1:])
+    ]
+    nodes.append(rowentry("a", "t", "9:00", "9:02", "102", coords["a"], coords["t"]))
+    pathfinder = Pathfinder(nodes, cache_size=0)
+    assert pathfinder.find_path("a", "t", "9:00", 1, 0, 0)[1] == 0
+    for heuristic in ("geodesic", "landmarks"):
+        result = pathfinder.find_path("a", "t", "9:00", 1, 0, 0, heuristic=heuristic)
+        assert result[1] == 0
+
+
+def test_contracted_graph_matches_full_graph():
+    for seed in range(4):
+        rows = random_timetable(seed)
+        full = Pathfinder(rows, cache_size=0)
+        contracted = Pathfinder(graph=ExpandedGraph(rows, contract=True), cache_size=0)
+        stops = sorted({r.start for r in rows} | {r.end for r in rows})
+
+        for a in stops:
+            expected = full.find_paths_from(a, "8:30", minute_cost=1, transfer_cost=0)
+            results = contracted.find_paths_from(
+                a, "8:30", minute_cost=1, transfer_cost=0
+            )
+            assert {s: r[1] for s, r in results.items()} == {
+                s: r[1] for s, r in expected.items()
+            }
+            for b, (path, _) in results.items():
+                assert path == contracted.find_path(a, b, "8:30", 1, 0, 0)[0]
+                assert path[0].departs_from == a and path[-1].arrives_to == b
+                for previous, current in zip(path, path[1:]):
+                    assert previous.arrives_to == current.departs_from
+                    assert previous.arrival <= current.departure
+
+
+def test_bidirectional_matches_find_path():
+    for seed in range(8):
+        rows = random_timetable(seed)
+        pathfinder = Pathfinder(rows, cache_size=0)
+        stops = sorted({r.start for r in rows} | {r.end for r in rows})
+
+        for a in stops:
+            for b in stops:
+                if a == b:
+                    continue
+                for transfer_cost in (0, 5):
+                    expected = pathfinder.find_path(a, b, "8:30", 1, transfer_cost, 0)
+                    result = pathfinder.find_path(
+                        a, b, "8:30", 1, transfer_cost, algorithm="bidirectional"
+                    )
+                    assert (result is None) == (expected is None)
+                    if result is None:
+                        continue
+                    path, cost = result
+                    assert result == expected
+                    assert path[0].departs_from == a and path[-1].arrives_to == b
+                    for previous, current in zip(path, path[1:]):
+                        assert previous.arrives_to == current.departs_from
+                        assert previous.arrival <= current.departure
+
+    with pytest.raises(ValueError):
+        pathfinder.find_path("s0", "s1", "8:30", algorithm="backwards")
+
+
+def test_find_paths_matches_find_path():
+    rows = random_timetable(5)
+    pathfinder = Pathfinder(rows, cache_size=0)
+    stops = sorted({r.start for r in rows} | {r.end for r in rows})
+    queries = [
+        PathQuery(a, b, time, minute_cost, transfer_cost, km_cost)
+        for a in stops
+        for b in stops
+        if a != b
+        for time in ("8:30", "9:40")
+        for minute_cost, transfer_cost, km_cost in [(1, 0, 0), (1, 5, 0), (0, 1, 10)]
+    ]
+    queries.append(PathQuery("s0", "s5", "8:30", km_cost=0, heuristic="geodesic"))
+
+    results = pathfinder.find_paths(queries)
+    assert len(results) == len(queries)
+    assert any(r is None for r in results)
+    for query, result in zip(queries, results):
+        expected = pathfinder.find_path(**asdict(query))
+        if expected is None:
+            assert result is None
+        else:
+            assert result.cost == expected[1]
+            assert len(result) == len(expected[0])
+            assert result.bus_stops() == expected[0]
+
+
+def test_search_stats():
+    rows = random_timetable(1)
+    calls = []
+    pathfinder = Pathfinder(
+        rows, cache_size=8, stats_hook=lambda q, s: calls.append((q, s))
+    )
+    result = pathfinder.find_path("s0", "s3", "8:30", 1, 5, 0)
+    assert result is not None
+    assert len(calls) == 1
+    query, stats = calls[0]
+    assert (query.start, query.end) == ("s0", "s3")
+    assert not stats.cached
+    assert stats.expanded > 0 and stats.relaxed > 0
+    assert stats.lookups == stats.relaxed
+    assert stats.pushes >= stats.pops >= stats.expanded
+    assert stats.search_time > 0
+
+    pathfinder.find_path("s0", "s3", "8:30", 1, 5, 0)
+    assert len(calls) == 2 and calls[1][1].cached
+
+    pathfinder.set_stats_hook(None)
+    stats = SearchStats()
+    assert pathfinder.find_path("s0", "s3", "9:30", 1, 5, 0, stats=stats)
+    assert stats.expanded > 0 and len(calls) == 2
+
+
+def random_updates(graph: ExpandedGraph, rng: random.Random) -> list[TimetableUpdate]:
+    rows = rng.sample(sorted(set(graph.get_timetable_rows())), 16)
+    updates = []
+    for r in rows[:4]:
+        minutes = rng.randint(-3, 15)
+        updates.append(
+            TimetableUpdate("delay", r.start, r.bus_n, r.end, r.departs_at, 0, minutes)
+        )
+    for r in rows[4:8]:
+        updates.append(TimetableUpdate("cancel", r.start, r.bus_n, r.end, r.departs_at))
+    for r in rows[8:]:
+        departure = rng.randint(8 * 60 + 30, 9 * 60 + 30)
+        arrival = departure + rng.randint(0, 2)
+        updates.append(
+            TimetableUpdate("add", r.start, r.bus_n, r.end, departure, arrival)
+        )
+    return updates
+
+
+@pytest.mark.parametrize("contract", [False, True])
+def test_updates_invalidate_affected_cache_entries(contract):
+    rng = random.Random(7)
+    for seed in range(6):
+        graph = ExpandedGraph(random_timetable(seed), contract=contract)
+        pathfinder = Pathfinder(graph=graph, cache_size=1000)
+        stops = sorted({n.bus_stop_name for n in pathfinder.graph.get_nodes()})
+        queries = [
+            (a, b, time, 1, 0, 0)
+            for a in stops
+            for b in stops
+            if a != b
+            for time in ("8:30", "9:10")
+        ]
+        for q in queries:
+            pathfinder.find_path(*q)
+
+        updates = random_updates(pathfinder.graph, rng)
+        if seed == 1 or contract:
+            updates.append(TimetableUpdate("close", stops[seed % 4 + 2]))
+        pathfinder.apply_updates(updates)
+        assert 0 < pathfinder.cache_info().currsize < len(queries)
+
+        rows = pathfinder.graph.get_timetable_rows()
+        fresh = Pathfinder(graph=ExpandedGraph.from_rows(rows))
+        for stop in pathfinder.graph.closed_stops():
+            for n in fresh.graph.get_nodes_by_stop_name(stop):
+                fresh.graph.remove_node(n)
+        for q in queries:
+            result, expected = pathfinder.find_path(*q), fresh.find_path(*q)
+            assert (result and result[1]) == (expected and expected[1])
+
+
+def test_closed_stop_skipped_by_shortcut():
+    rows = [
+        rowentry(a, b, 540 + 5 * i, 545 + 5 * i, "101")
+        for i, (a, b) in enumerate(zip("abcd", "bcde"))
+    ]
+    for contract in (False, True):
+        graph = ExpandedGraph(rows, contract=contract)
+        graph.apply_updates([TimetableUpdate("close", "b")])
+        pathfinder = Pathfinder(graph=graph, cache_size=0)
+        for stop in "bcde":
+            assert pathfinder.find_path("a", stop, "9:00", 1, 5, 0) is None
+        assert pathfinder.find_path("c", "d", "9:00", 1, 5, 0)[1] == 15
+
+
+def test_added_trip_invalidates_only_queries_it_can_improve():
+    pathfinder = Pathfinder(
+        [
+            rowentry("a", "b", "9:00", "9:10", "A"),
+            rowentry("b", "c", "9:10", "9:20", "A"),
+            rowentry("a", "c", "9:30", "9:35", "B"),
+        ]
+    )
+    assert pathfinder.find_path("a", "c", "9:00", 1, 0, 0)[1] == 20
+    assert pathfinder.find_path("a", "c", "9:05", 1, 0, 0)[1] == 30
+
+    pathfinder.apply_updates([TimetableUpdate("add", "a", "B", "c", 542, 545)])
+    assert pathfinder.cache_info().currsize == 1
+    assert pathfinder.find_path("a", "c", "9:00", 1, 0, 0)[1] == 5
+    assert pathfinder.find_path("a", "c", "9:05", 1, 0, 0)[1] == 30
+    assert pathfinder.cache_info().hits == 1
@@ -0,0 +1,66 @@
+import pytest
+
+from pathfinder import BusStop, Pathfinder
+from raptor import Raptor
+from testutils import random_timetable, rowentry, zero_minute_chain
+
+
+def test_pareto_journeys():
+    raptor = Raptor(
+        [
+            rowentry("a", "b", 540, 560, "101"),
+            rowentry("b", "c", 560, 600, "101"),
+            rowentry("a", "d", 545, 550, "102"),
+            rowentry("d", "c", 551, 555, "103"),
+            rowentry("a", "c", 540, 590, "104"),
+        ]
+    )
+
+    journeys = raptor.find_journeys("a", "c", "9:00")
+
+    assert [(j.arrival, j.transfers) for j in journeys] == [
+        ("09:50", 0),
+        ("09:15", 1),
+    ]
+    assert journeys[1].bus_stops == [
+        BusStop("a", "09:05", "d", "09:10", "102"),
+        BusStop("d", "09:11", "c", "09:15", "103"),
+    ]
+
+
+def test_zero_minute_chain():
+    journeys = Raptor(zero_minute_chain()).find_journeys("a", "d", "9:00")
+    assert len(journeys) == 1
+    assert journeys[0].transfers == 0 and journeys[0].duration == 5
+    assert [s.arrives_to for s in journeys[0].bus_stops] == ["b", "c", "d"]
+
+
+@pytest.mark.parametrize("shortest", [1, 0])
+def test_matches_pathfinder(shortest):
+    for seed in range(5):
+        rows = random_timetable(seed, shortest)
+        raptor = Raptor(rows)
+        pathfinder = Pathfinder(rows, cache_size=0)
+        stops = sorted({r.start for r in rows} | {r.end for r in rows})
+
+        for a in stops:
+            for b in stops:
+                if a == b:
+                    continue
+                fastest = pathfinder.find_path(a, b, "8:30", 1, 0, 0)
+                journeys = raptor.find_journeys(a, b, "8:30")
+                if fastest is None:
+                    assert journeys == []
+                    continue
+                assert journeys[-1].duration == fastest[1]
+                for journey in journeys:
+                    stops_on_way = journey.bus_stops
+                    assert stops_on_way[0].departs_from == a
+                    assert stops_on_way[-1].arrives_to == b
+                    assert stops_on_way[-1].arrival == journey.arrival
+                    for previous, current in zip(stops_on_way, stops_on_way[1:]):
+                        assert previous.arrives_to == current.departs_from
+                        assert previous.arrival <= current.departure
+                for earlier, later in zip(journeys, journeys[1:]):
+                    assert later.transfers > earlier.transfers
+                    assert later.duration < earlier.duration
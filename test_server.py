@@ -0,0 +1,109 @@
+from threading import Event
+import asyncio
+import json
+
+from load_test import request
+from pathfinder import Pathfinder
+from server import JourneyServer
+from testutils import random_timetable
+
+
+class BlockingPathfinder(Pathfinder):
+    # Holds every search until released, so requests are sure to overlap.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.release = Event()
+        self.calls = 0
+
+    def find_path(self, *args, **kwargs):
+        self.calls += 1
+        self.release.wait(5)
+        return super().find_path(*args, **kwargs)
+
+
+class FailingPathfinder(Pathfinder):
+    def find_path(self, *args, **kwargs):
+        raise RuntimeError("search failed")
+
+
+async def get(port: int, target: str):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {target} HTTP/1.1\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, body = response.split(b"\r\n\r\n", 1)
+    return int(head.split()[1]), json.loads(body)
+
+
+def run_with_server(pathfinder: Pathfinder, client):
+    async def main():
+        journeys = JourneyServer(pathfinder)
+        server = await journeys.start(port=0)
+        try:
+            return await client(journeys, server.sockets[0].getsockname()[1])
+        finally:
+            server.close()
+            await server.wait_closed()
+            journeys.close()
+
+    return asyncio.run(main())
+
+
+def test_path_response():
+    pathfinder = Pathfinder(random_timetable(0), cache_size=0)
+
+    async def client(journeys, port):
+        status, body = await get(port, "/path?start=s0&end=s5&time=8:30&km_cost=0")
+        expected = pathfinder.find_path("s0", "s5", "8:30", km_cost=0)
+        assert status == 200
+        assert body["cost"] == expected[1]
+        assert [b["arrives_to"] for b in body["bus_stops"]] == [
+            b.arrives_to for b in expected[0]
+        ]
+
+        assert await get(port, "/path?start=s0&end=s0&time=8:30") == (
+            200,
+            {"cost": 0, "bus_stops": []},
+        )
+        assert (await get(port, "/path?start=s0&end=nowhere&time=8:30"))[0] == 400
+        assert (await get(port, "/path?start=s0&end=s5"))[0] == 400
+        assert (await get(port, "/path?start=s0&end=s5&time=x"))[0] == 400
+        assert (await get(port, "/elsewhere"))[0] == 404
+        assert await request("127.0.0.1", port, "/stats") == 200
+
+    run_with_server(pathfinder, client)
+
+
+def test_identical_queries_are_coalesced():
+    pathfinder = BlockingPathfinder(random_timetable(0), cache_size=0)
+
+    async def client(journeys, port):
+        same = "/path?start=s0&end=s5&time=8:30&km_cost=0"
+        other = "/path?start=s1&end=s5&time=8:30&km_cost=0"
+        requests = [asyncio.create_task(get(port, same)) for _ in range(5)]
+        requests.append(asyncio.create_task(get(port, other)))
+        while journeys.searches + journeys.coalesced < 6:
+            await asyncio.sleep(0.01)
+        pathfinder.release.set()
+        responses = await asyncio.gather(*requests)
+
+        assert [status for status, _ in responses[:5]] == [200] * 5
+        assert all(body == responses[0][1] for _, body in responses[:5])
+        assert responses[5][1] != responses[0][1]
+        assert journeys.searches == 2 and journeys.coalesced == 4
+        assert pathfinder.calls == 2
+
+    run_with_server(pathfinder, client)
+
+
+def test_failed_search_answers_500():
+    pathfinder = FailingPathfinder(random_timetable(0), cache_size=0)
+
+    async def client(journeys, port):
+        target = "/path?start=s0&end=s5&time=8:30"
+        responses = await asyncio.gather(*(get(port, target) for _ in range(3)))
+        assert [status for status, _ in responses] == [500] * 3
+        assert await request("127.0.0.1", port, "/stats") == 200
+
+    run_with_server(pathfinder, client)
@@ -0,0 +1,46 @@
+from collections import Counter
+
+from graph import ExpandedGraph, read_timetable
+from synthetic import CityParameters, generate_rows, write_csv
+
+
+def interchange_share(params: CityParameters) -> float:
+    graph = ExpandedGraph.from_rows(generate_rows(params))
+    lines_at_stop = Counter(n.bus_stop_name for n in graph.get_nodes())
+    return sum(1 for c in lines_at_stop.values() if c > 1) / len(lines_at_stop)
+
+
+def test_csv_round_trip(tmp_path):
+    params = CityParameters(stops=50, lines=4, trips_per_line=5, seed=3)
+    path = tmp_path / "city.csv"
+    count = write_csv(path, params)
+
+    rows = list(generate_rows(params))
+    assert count == len(rows) > 0
+    read = list(read_timetable(path))
+    assert [(r.start, r.end, r.departs_at, r.arrives_at, r.bus_n) for r in read] == [
+        (r.start, r.end, r.departs_at, r.arrives_at, r.bus_n) for r in rows
+    ]
+    assert list(generate_rows(params)) == rows
+
+
+def test_timetable_shape():
+    params = CityParameters(stops=100, lines=6, trips_per_line=10)
+    rows = list(generate_rows(params))
+    assert {r.bus_n for r in rows} == {str(100 + line) for line in range(6)}
+    assert len({r.start for r in rows} | {r.end for r in rows}) <= 100
+    for r in rows:
+        assert r.start != r.end
+        assert 1 <= r.arrives_at - r.departs_at <= 4
+    for line in range(6):
+        trips = [r for r in rows if r.bus_n == str(100 + line)]
+        departures = {r.departs_at for r in trips if r.start == trips[0].start}
+        assert len(departures) == 10
+
+
+def test_interchange_density():
+    spread = CityParameters(stops=400, lines=20, trips_per_line=2)
+    bundled = CityParameters(
+        stops=400, lines=20, trips_per_line=2, interchange_density=1
+    )
+    assert interchange_share(bundled) > interchange_share(spread)
@@ -0,0 +1,164 @@
+import random
+
+from pathfinder import Pathfinder
+from tabu import Solution, Tabu, TabuList
+from tabu_main import TourCost
+from testutils import rowentry
+
+
+def test_tabu_list_tenure():
+    tabu = TabuList(tenure=2)
+    a, b, c = Solution(["a"]), Solution(["b"]), Solution(["c"])
+
+    tabu.add(a)
+    tabu.add(b)
+    tabu.add(a)
+    assert a in tabu and b in tabu
+
+    tabu.add(c)
+    assert a in tabu and c in tabu
+    assert b not in tabu
+    assert Solution(["a"]) in tabu
+    assert len(tabu) == 2
+
+
+def original_tabu_run(initial, calculate_cost, generate_neighborhood, iterations):
+    # The search loop before TabuList, trimming a plain list before each move.
+    current, tabu = initial, []
+    best, best_cost = initial, calculate_cost(initial)[0]
+    for _ in range(iterations):
+        neighborhood = generate_neighborhood(current)
+        candidate, candidate_cost = None, float("inf")
+        for n in neighborhood:
+            if n not in tabu:
+                cost = calculate_cost(n)[0]
+                if cost < candidate_cost:
+                    candidate, candidate_cost = n, cost
+        if candidate is None:
+            break
+        while len(tabu) > 3 * len(current.bus_stops):
+            tabu.remove(tabu[0])
+        tabu.append(candidate)
+        tabu.extend(neighborhood)
+        current = candidate
+        if candidate_cost < best_cost:
+            best, best_cost = candidate, candidate_cost
+    return best, best_cost
+
+
+def planar_tour_length(stops: int, seed: int = 0):
+    # A tour length over random points, cheap enough to stand in for find_path.
+    rng = random.Random(seed)
+    coords = {str(i): (rng.random(), rng.random()) for i in range(stops)}
+
+    def tour_length(sol: Solution):
+        points = [coords[s] for s in sol.bus_stops]
+        length = sum(
+            ((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) ** 0.5
+            for a, b in zip(points, points[1:])
+        )
+        return length, []
+
+    return tour_length
+
+
+def two_swaps(sol: Solution):
+    neighbours = []
+    for _ in range(8):
+        i, j = random.sample(range(1, len(sol.bus_stops) - 1), 2)
+        route = list(sol.bus_stops)
+        route[i], route[j] = route[j], route[i]
+        neighbours.append(Solution(route))
+    return neighbours
+
+
+def test_default_tenure_keeps_original_trajectory():
+    tour = Solution([str(i) for i in range(7)] + ["0"])
+    tour_length = planar_tour_length(7)
+
+    def run(search):
+        evaluated = []
+
+        def calculate_cost(sol: Solution):
+            evaluated.append(sol.key())
+            return tour_length(sol)
+
+        random.seed(1)
+        best = search(calculate_cost)
+        return evaluated, best[:2]
+
+    original = run(lambda cost: original_tabu_run(tour, cost, two_swaps, 200))
+    current = run(lambda cost: Tabu(tour, cost, two_swaps).run(200))
+    assert current == original
+
+
+def test_worker_pools_match_serial_run():
+    tour = Solution([str(i) for i in range(9)] + ["0"])
+    results = []
+    for kwargs in (
+        {},
+        {"workers": 3},
+        {"workers": 3, "cost_factory": planar_tour_length, "cost_factory_args": (9,)},
+    ):
+        random.seed(2)
+        tabu = Tabu(tour, planar_tour_length(9), two_swaps, **kwargs)
+        results.append(tabu.run(50)[:2])
+
+    assert results[0][1] < planar_tour_length(9)(tour)[0]
+    assert results[1] == results[0]
+    assert results[2] == results[0]
+
+
+def test_aspiration_accepts_tabu_neighbour_better_than_best():
+    tabu = Tabu(
+        initial_solution=Solution(["x"]),
+        calculate_cost=lambda s: (len(s.bus_stops), []),
+        generate_neighborhood=lambda s: [],
+        aspiration=True,
+    )
+    short, long = Solution(["a"]), Solution(["a", "b", "c"])
+    tabu_list = TabuList(tenure=5)
+    tabu_list.add(short)
+    tabu_list.add(long)
+
+    best, cost, _ = tabu.find_best_neighbour([long, short], tabu_list, best_cost=2)
+    assert best == short and cost == 1
+
+    best, _, _ = tabu.find_best_neighbour([long, short], tabu_list, best_cost=1)
+    assert best is None
+
+
+def ring_timetable(n: int):
+    # Two lines around a ring of n stops, one each way, and one across it.
+    stops = [f"s{i}" for i in range(n)]
+    rows = []
+    for start in range(8 * 60, 12 * 60, 6):
+        for line, route in (("1", stops + stops[:1]), ("2", stops[::-1] + stops[-1:])):
+            for k, (a, b) in enumerate(zip(route, route[1:])):
+                rows.append(rowentry(a, b, start + 3 * k, start + 3 * k + 3, line))
+        across = stops[:: n // 2]
+        for a, b in (across, across[::-1]):
+            rows.append(rowentry(a, b, start + 1, start + 5, "3"))
+    return rows
+
+
+def test_tour_cost_reuses_shared_prefixes():
+    pathfinder = Pathfinder(ring_timetable(8), cache_size=0)
+    incremental = TourCost(pathfinder, "8:00", 1, 5, 0)
+    full = TourCost(pathfinder, "8:00", 1, 5, 0, max_prefixes=0)
+    rng = random.Random(0)
+    tour = [f"s{i}" for i in range(6)] + ["s0"]
+    for _ in range(30):
+        i, j = sorted(rng.sample(range(1, len(tour) - 1), 2))
+        neighbour = list(tour)
+        neighbour[i], neighbour[j] = neighbour[j], neighbour[i]
+        for sol in (Solution(tour), Solution(neighbour)):
+            cost, path = incremental(sol)
+            assert (cost, path) == full(sol)
+            assert path[-1].arrives_to == "s0"
+        if rng.random() < 0.5:
+            tour = neighbour
+
+    assert full.reused_legs == 0
+    assert incremental.find_path_calls + incremental.reused_legs == full.find_path_calls
+    assert incremental.find_path_calls < full.find_path_calls / 2
@@ -0,0 +1,75 @@
+from pathfinder import BusStop, Pathfinder
+from testutils import random_timetable, rowentry
+from transfer_patterns import TransferPatterns, journey_pattern
+
+TIMES = ["8:00", "8:15", "8:30", "8:45"]
+
+
+def test_journey_pattern():
+    assert journey_pattern(
+        [
+            BusStop("a", "09:00", "b", "09:05", "101"),
+            BusStop("b", "09:05", "c", "09:10", "101"),
+            BusStop("c", "09:12", "d", "09:20", "102"),
+        ]
+    ) == (("101", ("a", "b", "c")), ("102", ("c", "d")))
+
+
+def test_patterns_match_find_path(tmp_path):
+    rows = random_timetable(2)
+    stops = sorted({r.start for r in rows} | {r.end for r in rows})
+    pairs = [(a, b) for a in stops for b in stops if a != b]
+    patterns = TransferPatterns.build(Pathfinder, (rows,), pairs, TIMES)
+    assert len(patterns) > 0
+
+    patterns.save(tmp_path / "patterns")
+    loaded = TransferPatterns.load(tmp_path / "patterns")
+    assert loaded.times == TIMES
+    for a, b in pairs:
+        assert loaded.get(a, b, 1, 5) == patterns.get(a, b, 1, 5)
+    assert loaded.get(stops[0], stops[1], 1, 0) is None
+
+    # The search keeps one label per node, so following a stored pattern can
+    # even beat it, but never loses to it at the times the patterns came from.
+    pathfinder = Pathfinder(rows, cache_size=0)
+    pathfinder.use_transfer_patterns(loaded)
+    for a, b in pairs:
+        for time in TIMES:
+            expected = pathfinder.find_path(a, b, time, 1, 5, 0)
+            result = pathfinder.find_path_by_patterns(a, b, time, 1, 5)
+            if expected is None:
+                assert result is None
+                continue
+            assert result[1] <= expected[1]
+            assert result[0][0].departs_from == a and result[0][-1].arrives_to == b
+
+
+def test_parallel_build_matches_serial():
+    rows = random_timetable(3)
+    stops = sorted({r.start for r in rows} | {r.end for r in rows})
+    pairs = [(a, b) for a in stops[:4] for b in stops if a != b]
+
+    serial = TransferPatterns.build(Pathfinder, (rows,), pairs, TIMES)
+    parallel = TransferPatterns.build(Pathfinder, (rows,), pairs, TIMES, workers=2)
+    for a, b in pairs:
+        assert parallel.get(a, b, 1, 5) == serial.get(a, b, 1, 5)
+
+
+def test_missing_pair_falls_back_to_search():
+    rows = [
+        rowentry("a", "b", 540, 550, "101"),
+        rowentry("b", "c", 552, 560, "102"),
+    ]
+    pathfinder = Pathfinder(rows)
+    pathfinder.use_transfer_patterns(
+        TransferPatterns.build(Pathfinder, (rows,), [("a", "b")], ["9:00"])
+    )
+
+    assert pathfinder.find_path_by_patterns("a", "b", "9:00") == (
+        [BusStop("a", "09:00", "b", "09:10", "101")],
+        10,
+    )
+    assert pathfinder.find_path_by_patterns("a", "c", "9:00") == pathfinder.find_path(
+        "a", "c", "9:00", km_cost=0
+    )
+    assert pathfinder.cache_info().misses == 1
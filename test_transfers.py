@@ -0,0 +1,85 @@
+import itertools
+
+import pytest
+
+from graph import ExpandedGraph, TimetableUpdate
+from pathfinder import BusStop, Pathfinder
+from testutils import random_timetable, rowentry
+from transfers import StopHubs, TransferModel
+
+# b is about 110 metres north of a, c and d are over a kilometre away.
+A, B, C, D = (51.1, 17.0), (51.101, 17.0), (51.11, 17.0), (51.09, 17.0)
+
+
+def test_walks_within_radius():
+    graph = ExpandedGraph(
+        [
+            rowentry("a", "c", "9:00", "9:10", "101", A, C),
+            rowentry("b", "c", "9:00", "9:10", "102", B, C),
+        ]
+    )
+    hubs = StopHubs(graph, TransferModel(walking_speed=80, radius=300))
+
+    assert hubs.walks("a") == [(hubs.hub("b"), 2)]
+    assert hubs.walks("b") == [(hubs.hub("a"), 2)]
+    assert hubs.walks("c") == []
+    assert StopHubs(graph, TransferModel(radius=0)).walk_count() == 0
+
+
+def test_walking_transfer():
+    rows = [
+        rowentry("c", "a", "9:00", "9:10", "101", C, A),
+        rowentry("b", "d", "9:11", "9:20", "102", B, D),
+        rowentry("b", "d", "9:15", "9:25", "102", B, D),
+    ]
+    assert Pathfinder(rows).find_path("c", "d", "9:00", km_cost=0) is None
+
+    pathfinder = Pathfinder(rows, transfers=TransferModel(change_minutes=1))
+    assert pathfinder.find_path("c", "d", "9:00", km_cost=0) == (
+        [
+            BusStop("c", "09:00", "a", "09:10", "101"),
+            BusStop("a", "09:10", "b", "09:12", "walk"),
+            BusStop("b", "09:15", "d", "09:25", "102"),
+        ],
+        30,
+    )
+
+
+def test_hubs_without_walks_match_stop_transfers():
+    for seed in range(3):
+        rows = random_timetable(seed)
+        plain = Pathfinder(rows, cache_size=0)
+        hubs = Pathfinder(rows, cache_size=0, transfers=TransferModel(radius=0))
+        stops = sorted({r.start for r in rows} | {r.end for r in rows})
+
+        for a, b in itertools.permutations(stops, 2):
+            expected = plain.find_path(a, b, "8:30", 1, 5, 0)
+            result = hubs.find_path(a, b, "8:30", 1, 5, 0)
+            assert (result and result[1]) == (expected and expected[1])
+
+
+def test_contracted_graph_rejected():
+    graph = ExpandedGraph(random_timetable(0), contract=True)
+    with pytest.raises(ValueError):
+        Pathfinder(graph=graph, transfers=TransferModel())
+
+
+def test_reopened_stop_gets_its_hub():
+    rows = [
+        rowentry("c", "a", "9:00", "9:10", "101", C, A),
+        rowentry("b", "d", "9:15", "9:25", "102", B, D),
+    ]
+    graph = ExpandedGraph(rows)
+    graph.apply_updates([TimetableUpdate("close", "b")])
+    pathfinder = Pathfinder(graph=graph, transfers=TransferModel())
+    assert pathfinder.find_path("c", "d", "9:00", km_cost=0) is None
+    assert pathfinder.find_path("c", "b", "9:00", km_cost=0) is None
+
+    pathfinder.apply_updates([TimetableUpdate("reopen", "b")])
+    stops, cost = pathfinder.find_path("c", "d", "9:00", km_cost=0)
+    assert [(s.departs_from, s.bus_n) for s in stops] == [
+        ("c", "101"),
+        ("a", "walk"),
+        ("b", "102"),
+    ]
+    assert cost == 30
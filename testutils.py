@@ -0,0 +1,75 @@
+from datetime import datetime
+import random
+from typing import Optional, Tuple, Union
+
+from graph import RowEntry, from_minutes, to_datetime
+
+
+def to_time(time: Union[str, int]) -> datetime:
+    # "H:MM" or minutes after midnight.
+    if isinstance(time, str):
+        return to_datetime(time)
+    return from_minutes(time)
+
+
+def rowentry(
+    a,
+    b,
+    start: Union[str, int] = "9:00",
+    end: Union[str, int] = "9:15",
+    bus="A",
+    a_coords: Tuple[float, float] = (0, 0),
+    b_coords: Tuple[float, float] = (0, 0),
+) -> RowEntry:
+    return RowEntry(
+        start=a,
+        end=b,
+        departs_at=to_time(start),
+        arrives_at=to_time(end),
+        bus_n=bus,
+        start_latitude=a_coords[0],
+        start_longitude=a_coords[1],
+        end_latitude=b_coords[0],
+        end_longitude=b_coords[1],
+    )
+
+
+def random_timetable(
+    seed: int,
+    shortest: int = 1,
+    coords: Optional[dict[str, Tuple[float, float]]] = None,
+) -> list[RowEntry]:
+    # Five lines over twelve stops, s0 to s11, hops take shortest to 6
+    # minutes. Stops are placed at coords, or all at (0, 0) without it.
+    rng = random.Random(seed)
+    stops = [f"s{i}" for i in range(12)]
+    coords = coords or {}
+    rows = []
+    for line in range(5):
+        route = rng.sample(stops, 5)
+        for start in range(8 * 60, 10 * 60, rng.randint(7, 20)):
+            time = start
+            for a, b in zip(route, route[1:]):
+                duration = rng.randint(shortest, 6)
+                rows.append(
+                    rowentry(
+                        a,
+                        b,
+                        time,
+                        time + duration,
+                        str(100 + line),
+                        coords.get(a, (0, 0)),
+                        coords.get(b, (0, 0)),
+                    )
+                )
+                time += duration
+    return rows
+
+
+def zero_minute_chain():
+    # b-c is listed, and numbered, before a-b, which it has to come after.
+    return [
+        rowentry("b", "c", "9:00", "9:00", "101"),
+        rowentry("a", "b", "9:00", "9:00", "101"),
+        rowentry("c", "d", "9:00", "9:05", "101"),
+    ]
@@ -0,0 +1,197 @@
+from array import array
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Optional, Tuple
+import json
+import struct
+import sys
+
+from pathfinder import BusStop, Pathfinder
+
+PATTERNS_MAGIC = b"MPKPATTS"
+PATTERNS_VERSION = 1
+
+# The legs of a journey, each one a line and the stops it is ridden through.
+Pattern = Tuple[Tuple[str, Tuple[str, ...]], ...]
+
+_worker_pathfinder: Optional[Pathfinder] = None
+
+
+def _init_worker(pathfinder_factory: Callable, pathfinder_factory_args: tuple):
+    global _worker_pathfinder
+    _worker_pathfinder = pathfinder_factory(*pathfinder_factory_args)
+
+
+def _patterns_in_worker(task):
+    return _collect_patterns(_worker_pathfinder, *task)
+
+
+def _collect_patterns(
+    pathfinder: Pathfinder,
+    start: str,
+    targets: list[str],
+    times: list[str],
+    minute_cost: float,
+    transfer_cost: float,
+) -> dict[str, set[Pattern]]:
+    patterns: dict[str, set[Pattern]] = {}
+    for time in times:
+        results = pathfinder.find_paths_from(
+            start,
+            time,
+            targets,
+            minute_cost=minute_cost,
+            transfer_cost=transfer_cost,
+        )
+        for end, (stops, _) in results.items():
+            patterns.setdefault(end, set()).add(journey_pattern(stops))
+    return patterns
+
+
+def journey_pattern(bus_stops: list[BusStop]) -> Pattern:
+    legs = []
+    for b in bus_stops:
+        if legs and legs[-1][0] == b.bus_n:
+            legs[-1][1].append(b.arrives_to)
+        else:
+            legs.append((b.bus_n, [b.departs_from, b.arrives_to]))
+    return tuple((line, tuple(stops)) for line, stops in legs)
+
+
+class TransferPatterns:
+    # The line sequences of optimal journeys between chosen stop pairs, found
+    # by searching from every start at a set of departure times. A journey
+    # leaving at another time is assumed to follow one of them.
+    minute_cost: float
+    transfer_cost: float
+    times: list[str]
+
+    _patterns: dict[Tuple[str, str], list[Pattern]]
+
+    def __init__(
+        self,
+        patterns: dict[Tuple[str, str], list[Pattern]],
+        times: list[str],
+        minute_cost: float = 1,
+        transfer_cost: float = 5,
+    ):
+        self._patterns = patterns
+        self.times = times
+        self.minute_cost = minute_cost
+        self.transfer_cost = transfer_cost
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def get(
+        self, start: str, end: str, minute_cost: float, transfer_cost: float
+    ) -> Optional[list[Pattern]]:
+        if (minute_cost, transfer_cost) != (self.minute_cost, self.transfer_cost):
+            return None
+        return self._patterns.get((start, end))
+
+    @staticmethod
+    def build(
+        pathfinder_factory: Callable,
+        pathfinder_factory_args: tuple,
+        pairs: Iterable[Tuple[str, str]],
+        times: list[str],
+        minute_cost: float = 1,
+        transfer_cost: float = 5,
+        workers: int = 1,
+    ) -> "TransferPatterns":
+        targets_by_start: dict[str, list[str]] = {}
+        for start, end in pairs:
+            if start != end:
+                targets_by_start.setdefault(start, []).append(end)
+        tasks = [
+            (start, targets, times, minute_cost, transfer_cost)
+            for start, targets in targets_by_start.items()
+        ]
+
+        if workers > 1:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(pathfinder_factory, pathfinder_factory_args),
+            ) as executor:
+                results = list(executor.map(_patterns_in_worker, tasks))
+        else:
+            pathfinder = pathfinder_factory(*pathfinder_factory_args)
+            results = [_collect_patterns(pathfinder, *task) for task in tasks]
+
+        patterns = {}
+        for task, found in zip(tasks, results):
+            for end, end_patterns in found.items():
+                patterns[(task[0], end)] = sorted(end_patterns)
+        return TransferPatterns(patterns, list(times), minute_cost, transfer_cost)
+
+    def save(self, path):
+        # Patterns are stored as one flat array of stop and line ids:
+        # start, end, pattern count, then per pattern the leg count and per
+        # leg the line, stop count and stops.
+        stop_names: dict[str, int] = {}
+        line_names: dict[str, int] = {}
+
+        def stop_id(name):
+            return stop_names.setdefault(name, len(stop_names))
+
+        def line_id(name):
+            return line_names.setdefault(name, len(line_names))
+
+        data = array("I")
+        for (start, end), patterns in self._patterns.items():
+            data.extend((stop_id(start), stop_id(end), len(patterns)))
+            for pattern in patterns:
+                data.append(len(pattern))
+                for line, stops in pattern:
+                    data.extend((line_id(line), len(stops)))
+                    data.extend(stop_id(s) for s in stops)
+
+        header = json.dumps(
+            {
+                "byteorder": sys.byteorder,
+                "minute_cost": self.minute_cost,
+                "transfer_cost": self.transfer_cost,
+                "times": self.times,
+                "stops": list(stop_names),
+                "lines": list(line_names),
+                "pairs": len(self._patterns),
+            }
+        ).encode()
+        with open(path, "wb") as f:
+            f.write(PATTERNS_MAGIC)
+            f.write(struct.pack("<IQ", PATTERNS_VERSION, len(header)))
+            f.write(header)
+            f.write(data.tobytes())
+
+    @staticmethod
+    def load(path) -> "TransferPatterns":
+        with open(path, "rb") as f:
+            if f.read(len(PATTERNS_MAGIC)) != PATTERNS_MAGIC:
+                raise ValueError("Not a transfer patterns file")
+            version, header_length = struct.unpack("<IQ", f.read(12))
+            if version != PATTERNS_VERSION:
+                raise ValueError("Unsupported transfer patterns version")
+            header = json.loads(f.read(header_length))
+            if header["byteorder"] != sys.byteorder:
+                raise ValueError("Patterns were saved with a different byte order")
+            data = array("I", f.read())
+
+        stops, lines = header["stops"], header["lines"]
+        values = iter(data)
+        patterns = {}
+        for _ in range(header["pairs"]):
+            start, end = stops[next(values)], stops[next(values)]
+            end_patterns = []
+            for _ in range(next(values)):
+                legs = []
+                for _ in range(next(values)):
+                    line, count = lines[next(values)], next(values)
+                    leg = tuple(stops[next(values)] for _ in range(count))
+                    legs.append((line, leg))
+                end_patterns.append(tuple(legs))
+            patterns[(start, end)] = end_patterns
+        return TransferPatterns(
+            patterns, header["times"], header["minute_cost"], header["transfer_cost"]
+        )
@@ -0,0 +1,85 @@
+from dataclasses import dataclass
+from typing import Tuple
+import math
+
+from bounds import to_metres
+from graph import ExpandedGraph, Node
+
+HUB = "*"
+WALK = "walk"
+
+
+@dataclass(frozen=True)
+class TransferModel:
+    # Metres per minute, 80 is a bit under 5 km/h.
+    walking_speed: float = 80
+    # Stops closer than this many metres are linked by a walk.
+    radius: float = 300
+    # Minutes it takes at least to board another line.
+    change_minutes: int = 0
+
+
+class StopHubs:
+    # One hub node per stop that every line node at the stop alights to and
+    # boards from, instead of linking each pair of line nodes. Hubs of stops
+    # within walking distance are linked by walks, found through a grid of
+    # radius sized cells so only the 3x3 cells around a stop are compared.
+    # Closed stops get their hub as well, so it is there once they reopen.
+    # Hubs are numbered on from the last node id of the graph.
+    model: TransferModel
+    _hubs: dict[str, Node]
+    _walks: dict[str, list[Tuple[str, int]]]
+
+    def __init__(self, graph: ExpandedGraph, model: TransferModel):
+        self.model = model
+        self._hubs = {}
+        for i in range(graph.node_count()):
+            n = graph.get_node_by_id(i)
+            if n.bus_stop_name not in self._hubs:
+                self._hubs[n.bus_stop_name] = Node(
+                    n.bus_stop_name,
+                    HUB,
+                    n.latitude,
+                    n.longitude,
+                    graph.node_count() + len(self._hubs),
+                )
+
+        hubs = list(self._hubs.values())
+        reference = sum(h.latitude for h in hubs) / len(hubs) if hubs else 0
+        coords = {
+            h.bus_stop_name: to_metres(h.latitude, h.longitude, reference) for h in hubs
+        }
+        self._walks = {stop: [] for stop in coords}
+        if model.radius <= 0:
+            return
+
+        grid: dict[Tuple[int, int], list[str]] = {}
+        for stop, (x, y) in coords.items():
+            grid.setdefault(self._cell(x, y), []).append(stop)
+        for stop, (x, y) in coords.items():
+            cx, cy = self._cell(x, y)
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for other in grid.get((cx + dx, cy + dy), []):
+                        if other == stop:
+                            continue
+                        ox, oy = coords[other]
+                        distance = math.hypot(x - ox, y - oy)
+                        if distance <= model.radius:
+                            minutes = math.ceil(distance / model.walking_speed)
+                            self._walks[stop].append((other, max(minutes, 1)))
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return math.floor(x / self.model.radius), math.floor(y / self.model.radius)
+
+    def hub(self, stop_name: str) -> Node:
+        return self._hubs[stop_name]
+
+    def walks(self, stop_name: str) -> list[Tuple[Node, int]]:
+        return [(self._hubs[s], minutes) for s, minutes in self._walks[stop_name]]
+
+    def count(self) -> int:
+        return len(self._hubs)
+
+    def walk_count(self) -> int:
+        return sum(len(w) for w in self._walks.values())